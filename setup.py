@@ -9,7 +9,7 @@ setup(
         author='Patrick Lawson',
         author_email='patrick.a.lawson@gmail.com',
         url='http://github.com/patricklaw/surly',
-        packages=['surly'],
+        packages=['surly', 'surly.bench'],
         requires=['nose'],
         classifiers=[
             'Development Status :: 2 - Pre-Alpha',
@@ -0,0 +1,11 @@
+''' The standard library's regex parser and its constants.  Python 3.11
+    made them private to ``re``: importing them as ``sre_parse`` and
+    ``sre_constants`` warns there.
+'''
+try:
+    from re._constants import *
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    from sre_constants import *
+    import sre_constants
+    import sre_parse
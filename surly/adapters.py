@@ -1,24 +1,42 @@
-import re
+try:
+    from tornado.routing import ReversibleRouter, Rule, AnyMatches
+    from tornado.escape import url_unescape
+except ImportError:
+    # Tornado (4.5 or later) is only needed for the Tornado router
+    ReversibleRouter = None
+
+from surly.mapper import MapperError
 
 class SurlyTornadoMixin(object):
-    def reverse(self, name, **kwargs):
+    def reverse(self, name, *args, **kwargs):
         """Returns a URL path for handler named `name`
 
-        The handler must be added to the application as a 
-        surly pattern.
+        The handler must be added to the application as a
+        surly pattern, or as a plain Tornado rule.
 
-        Keyword args will be substituted for capturing groups in the 
-        URLSpec regex. They will be converted to strings if necessary, 
-        encoded as utf8, and url-escaped.
+        Keyword args will be substituted for capturing groups in the
+        URLSpec regex. They will be converted to strings if necessary,
+        encoded as utf8, and url-escaped.  Names which are not the
+        mapper's are reversed by `Application.reverse_url`, with the
+        positional args.
         """
-        if name in self.application.named_handlers:
-            return self.application.named_handlers[name].reverse(**kwargs)
+        application = self.application
+        mapper = getattr(application, 'surly_mapper', None)
+        if mapper is not None:
+            try:
+                return mapper.current.reverse(name, **kwargs)
+            except MapperError:
+                # Not a name of the mapper, nor of a Mapper it mounts:
+                # possibly one of the handlers given to the application
+                return application.reverse_url(name, *args)
+        elif name in application.named_handlers:
+            return application.named_handlers[name].reverse(**kwargs)
         raise KeyError("%s not found in named urls" % name)
 
 class TornadoUrlSpec(object):
     def __init__(self, url):
         self.url = url
-        self.regex = re.compile(self.url.pattern)
+        self.regex = url.regex
 
     @property
     def kwargs(self):
@@ -37,7 +55,119 @@ class TornadoUrlSpec(object):
 
 def wrap_tornado(mapper):
     '''
-    Turn the surly url objects into objects which work with Tornado
+    Turn the surly url objects into objects which work with Tornado.
+    Mappers mounted with ``include()`` are left out; ``SurlyRouter``
+    resolves them.
+    '''
+    return [TornadoUrlSpec(url) for url in mapper.urls if not url.is_mount]
+
+def _unquote_or_none(value):
+    # What Tornado's own path matching does with captured groups
+    if value is None:
+        return None
+    if not isinstance(value, (bytes, type(u''))):
+        # A value from a converter: Tornado decodes path arguments as
+        # strings, so it gets the value's text instead
+        return type(u'')(value).encode('utf8')
+    return url_unescape(value, encoding=None, plus=False)
+
+if ReversibleRouter is not None:
+    class SurlyRouter(ReversibleRouter):
+        '''
+        A Tornado router which resolves requests with the mapper's dispatch
+        index instead of trying each URLSpec in turn.  ``url.target`` is the
+        ``RequestHandler`` class, constructed with ``url.extra_args``.
+        '''
+        def __init__(self, application, mapper):
+            self.application = application
+            self.mapper = mapper
+
+        def find_handler(self, request, **kwargs):
+            result = self.mapper.current.match(request.path, request.method,
+                                               request.host)
+            if result is None:
+                return None
+            path_kwargs = dict((str(name), _unquote_or_none(value))
+                               for name, value in result.kwargs.items())
+            return self.application.get_handler_delegate(
+                request, result.target, target_kwargs=result.extra_args,
+                path_kwargs=path_kwargs)
+
+        def reverse_url(self, name, *args):
+            ''' Tornado's ``reverse_url`` passes the values positionally;
+                they fill the url's groups in order.
+            '''
+            mapper = self.mapper.current
+            u = mapper.reverse_patterns.get(name)
+            prefix = ''
+            if u is None:
+                try:
+                    u, prefix, host = mapper._find_mounted(name)
+                except MapperError:
+                    return None
+            names = [u.group_map[index] for index in sorted(u.group_map)]
+            return prefix + u.reverse(**dict(zip(names, args)))
+
+def tornado_application(mapper, handlers=None, **settings):
+    '''
+    Create a ``tornado.web.Application`` which routes requests with a
+    ``SurlyRouter`` for ``mapper``.  Any ``handlers`` (plain Tornado rules)
+    are tried first.  The mapper is available to ``SurlyTornadoMixin`` as
+    ``application.surly_mapper``.
+    '''
+    from tornado.web import Application
+    application = Application(handlers, **settings)
+    application.surly_mapper = mapper
+    application.wildcard_router.add_rules([
+        Rule(AnyMatches(), SurlyRouter(application, mapper))])
+    return application
+
+def _not_found(environ, start_response):
+    start_response('404 Not Found', [('Content-Type', 'text/plain')])
+    return [b'Not Found']
+
+class SurlyWSGIApplication(object):
+    '''
+    A WSGI application which resolves ``PATH_INFO`` against a mapper and
+    calls ``url.target``, itself a WSGI application.  Before the target is
+    called the environ gets:
+
+    * ``surly.url``: the matched url
+    * ``surly.kwargs``: the groups captured from the path
+    * ``surly.extra_args``: ``url.extra_args`` (``{}`` if not set)
+    * ``wsgiorg.routing_args``: ``((), kwargs)``, as the wsgiorg routing
+      spec describes
+
+    Urls restricted by ``methods`` or ``host`` only apply to requests with
+    a matching ``REQUEST_METHOD`` and ``HTTP_HOST`` (or ``SERVER_NAME``).
+    Paths of urls without capturing groups are resolved with a single
+    ``Mapper.static_route`` lookup.  Other paths go through
+    ``Mapper.match``.  Unmatched paths are passed to ``not_found``, a WSGI
+    application which by default responds with a plain 404.
+
+    ``mapper`` may be a ``LiveMapper``: each request is resolved against the
+    snapshot current when it arrived.
     '''
-    return [TornadoUrlSpec(url) for url in mapper.urls]
+    def __init__(self, mapper, not_found=_not_found):
+        self.mapper = mapper
+        self.not_found = not_found
 
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO') or '/'
+        method = environ.get('REQUEST_METHOD')
+        host = environ.get('HTTP_HOST') or environ.get('SERVER_NAME')
+        mapper = self.mapper.current
+        u = mapper.static_route(path, method, host)
+        if u is not None:
+            kwargs = {}
+        else:
+            result = mapper.match(path, method, host)
+            if result is None:
+                return self.not_found(environ, start_response)
+            u = result.url
+            kwargs = result.kwargs
+        environ['surly.url'] = u
+        environ['surly.kwargs'] = kwargs
+        environ['surly.extra_args'] = u.extra_args or {}
+        environ['wsgiorg.routing_args'] = ((), kwargs)
+        return u.target(environ, start_response)
@@ -0,0 +1,85 @@
+''' ASGI adapter.  Requires Python 3.5 or later; the rest of surly does
+    not import this module.
+
+    Resolution is synchronous: the path is looked up with
+    ``Mapper.static_route`` and then, if need be, resolved with
+    ``Mapper.match``, neither of which awaits anything.  The dispatch index
+    is built in full when the application is created and again on the
+    lifespan startup event, so no request pays for compiling it.
+'''
+
+async def _not_found(scope, receive, send):
+    if scope['type'] == 'websocket':
+        # Closing before accepting: the server refuses the handshake
+        await send({'type': 'websocket.close', 'code': 1000})
+        return
+    await send({'type': 'http.response.start', 'status': 404,
+                'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': b'Not Found'})
+
+class SurlyASGIApplication(object):
+    ''' An ASGI application which resolves ``scope["path"]`` against a
+        mapper and awaits ``url.target``, itself an ASGI application, with a
+        copy of the scope which also holds:
+
+        * ``path_params``: the groups captured from the path
+        * ``surly.url``: the matched url
+        * ``surly.extra_args``: ``url.extra_args`` (``{}`` if not set)
+
+        Urls restricted by ``methods`` or ``host`` only apply to requests
+        with a matching method and ``Host`` header.  Unmatched ``http`` and
+        ``websocket`` requests are passed to ``not_found``, which by default
+        responds with a plain 404, or closes the websocket.
+        ``lifespan`` events are answered by the application itself.
+        ``mapper`` may be a ``LiveMapper``: each request is resolved against
+        the snapshot current when it arrived.
+    '''
+    def __init__(self, mapper, not_found=_not_found):
+        self.mapper = mapper
+        self.not_found = not_found
+        mapper.current.prepare()
+
+    async def __call__(self, scope, receive, send):
+        kind = scope['type']
+        if kind == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if kind != 'http' and kind != 'websocket':
+            raise ValueError('Unsupported ASGI scope type: %s' % kind)
+        path = scope['path']
+        # A websocket handshake is a GET
+        method = scope.get('method', 'GET')
+        mapper = self.mapper.current
+        host = None
+        if mapper.binds_hosts:
+            # Only look for the header when some url is bound to a host
+            for name, value in scope['headers']:
+                if name == b'host':
+                    host = value.decode('latin-1')
+                    break
+        u = mapper.static_route(path, method, host)
+        if u is not None:
+            kwargs = {}
+        else:
+            result = mapper.match(path, method, host)
+            if result is None:
+                await self.not_found(scope, receive, send)
+                return
+            u = result.url
+            kwargs = result.kwargs
+        scope = dict(scope)
+        scope['path_params'] = kwargs
+        scope['surly.url'] = u
+        scope['surly.extra_args'] = u.extra_args or {}
+        await u.target(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # The table may have changed since __init__
+                self.mapper.current.prepare()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
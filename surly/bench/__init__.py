@@ -0,0 +1,2 @@
+''' Benchmarks for surly.  Each module can be run with ``python -m``.
+'''
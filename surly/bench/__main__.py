@@ -0,0 +1,3 @@
+from surly.bench.suite import main
+
+main()
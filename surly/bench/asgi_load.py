@@ -0,0 +1,95 @@
+''' Load benchmark for the ASGI adapter (Python 3.5 or later).
+
+    Drives the application with an in-process client: each request is a
+    fresh scope plus ``receive`` and ``send`` callables, awaited on one
+    event loop with no network or server involved.  Routes are served by
+    ``SurlyASGIApplication`` and, for comparison, by a naive ASGI app
+    which tries each url's regex in turn.  The benchmark reports requests
+    per second for a static and a dynamic path at the end of the table,
+    plus the time taken by the first request after startup.
+
+    Usage: ``python -m surly.bench.asgi_load [ROUTES [REQUESTS]]``
+'''
+import asyncio
+import sys
+import time
+
+from surly.asgi import SurlyASGIApplication
+from surly.bench.wsgi_load import make_urls as make_wsgi_urls
+from surly.mapper import Mapper, url
+
+START = {'type': 'http.response.start', 'status': 200,
+         'headers': [(b'content-type', b'text/plain')]}
+BODY = {'type': 'http.response.body', 'body': b'ok'}
+
+async def target(scope, receive, send):
+    await receive()
+    await send(START)
+    await send(BODY)
+
+def make_urls(count):
+    return [url(u.pattern, target) for u in make_wsgi_urls(count)]
+
+class LinearApplication(object):
+    ''' What an ASGI app without an index does: try every route '''
+    def __init__(self, urls):
+        self.routes = [(u.regex.match, u) for u in urls]
+
+    async def __call__(self, scope, receive, send):
+        path = scope['path']
+        for match, u in self.routes:
+            found = match(path)
+            if found is not None:
+                scope = dict(scope, path_params=found.groupdict())
+                await u.target(scope, receive, send)
+                return
+        await send({'type': 'http.response.start', 'status': 404,
+                    'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+async def request(app, path):
+    ''' One GET through ``app``; returns the response status '''
+    sent = []
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+    async def send(message):
+        sent.append(message)
+    await app({'type': 'http', 'asgi': {'version': '3.0'},
+               'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+               'path': path, 'raw_path': path.encode('ascii'),
+               'query_string': b'', 'headers': []}, receive, send)
+    return sent[0]['status']
+
+async def load(app, path, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        await request(app, path)
+    return requests / (time.perf_counter() - start)
+
+async def first_request(app, path):
+    start = time.perf_counter()
+    status = await request(app, path)
+    assert status == 200, status
+    return time.perf_counter() - start
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 2000
+    requests = int(argv[2]) if len(argv) > 2 else 20000
+    loop = asyncio.new_event_loop()
+    paths = [('static', '/page%d/' % (count // 2 - 1)),
+             ('dynamic', '/section%d/item/42' % (count // 2 - 1))]
+    print('%d routes, %d requests per path' % (count, requests))
+    print('%-8s %-8s %12s %12s' % ('app', 'path', 'first', 'req/s'))
+    for name, build in [('linear', LinearApplication),
+                        ('surly', lambda urls:
+                             SurlyASGIApplication(Mapper(urls)))]:
+        for path_name, path in paths:
+            app = build(make_urls(count))
+            first = loop.run_until_complete(first_request(app, path))
+            rate = loop.run_until_complete(load(app, path, requests))
+            print('%-8s %-8s %10.2fms %12.0f'
+                  % (name, path_name, first * 1e3, rate))
+    loop.close()
+
+if __name__ == '__main__':
+    main(sys.argv)
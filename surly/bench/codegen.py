@@ -0,0 +1,71 @@
+''' Generated dispatcher benchmark (see ``surly.codegen``).
+
+    For a table of the suite's shape (``surly.bench.suite.make_urls``),
+    measures building the ``Mapper`` and resolving its first path, with and
+    without a generated module (imported from its byte-compiled file), and
+    the mean ``match`` latency over paths of every route, through the
+    dispatch index and through the module.  The match cache is off.
+
+    Usage: ``python -m surly.bench.codegen [ROUTES]``
+'''
+import importlib
+import os
+import py_compile
+import shutil
+import sys
+import tempfile
+import timeit
+
+from surly import codegen
+from surly.bench.suite import make_urls, sample_kwargs, REPLACEMENTS, clock
+from surly.mapper import Mapper
+
+MODULE = 'surly_bench_routes'
+
+def import_fresh(name):
+    sys.modules.pop(name, None)
+    return importlib.import_module(name)
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 1000
+    mapper = Mapper(make_urls(count), replacements=REPLACEMENTS)
+    paths = [u.reverse(**sample_kwargs(u)) for u in mapper.urls]
+    directory = tempfile.mkdtemp()
+    sys.path.insert(0, directory)
+    try:
+        path = os.path.join(directory, MODULE + '.py')
+        codegen.write(mapper, path, paths)
+        # As a deployment would, rather than relying on the first import
+        py_compile.compile(path)
+
+        start = clock()
+        plain = Mapper(make_urls(count), replacements=REPLACEMENTS)
+        plain.match(paths[0])
+        plain_startup = clock() - start
+        start = clock()
+        generated = Mapper(make_urls(count), replacements=REPLACEMENTS,
+                           generated=import_fresh(MODULE))
+        generated.match(paths[0])
+        generated_startup = clock() - start
+    finally:
+        sys.path.remove(directory)
+        shutil.rmtree(directory)
+
+    print('%d routes' % count)
+    print('startup    index %8.1fms  generated %8.1fms'
+          % (plain_startup * 1e3, generated_startup * 1e3))
+    plain.prepare()
+    for path in paths:
+        # Compile the generated module's regexes
+        generated.match(path)
+    for label, mapper in [('index', plain), ('generated', generated)]:
+        match = mapper.match
+        def run():
+            for path in paths:
+                match(path)
+        best = min(timeit.repeat(run, number=5, repeat=5))
+        print('match      %-10s %6.2fus' % (label,
+                                            best * 1e6 / (5 * len(paths))))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,82 @@
+''' Cold start benchmark, for short-lived jobs which build a ``Mapper`` only
+    to reverse a few names.
+
+    Measures, in fresh interpreters, the time to ``import surly.mapper``
+    and the modules it loads that it does not need (JS generation,
+    ``uuid``); then, for a table of the suite's shape
+    (``surly.bench.suite.make_urls``), the time to build the ``Mapper``,
+    eagerly and with ``lazy=True``, and to reverse a handful of names with
+    it.  The modules are byte-compiled first, as a deployment would be.
+
+    Usage: ``python -m surly.bench.coldstart [ROUTES]``
+'''
+import os
+import py_compile
+import subprocess
+import sys
+import time
+
+from surly.bench.suite import make_urls, sample_kwargs, REPLACEMENTS
+from surly.mapper import Mapper
+
+# Loaded lazily by surly.mapper: importing it should not pull them in
+OPTIONAL_MODULES = ('surly.js', 'json', 'hashlib', 'uuid')
+
+_IMPORT = '''
+import sys, time
+start = time.time()
+import surly.mapper
+print(time.time() - start)
+print(' '.join(name for name in %r if name in sys.modules))
+''' % (OPTIONAL_MODULES,)
+
+def measure_import(runs=5):
+    ''' Returns the best time to import ``surly.mapper`` in a fresh
+        interpreter, and the optional modules it loaded
+    '''
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=root)
+    best, loaded = None, None
+    for run in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', _IMPORT],
+                                         env=env).decode('ascii').split('\n')
+        elapsed = float(output[0])
+        if best is None or elapsed < best:
+            best = elapsed
+        loaded = output[1].split()
+    return best, loaded
+
+def measure_build(count, lazy, names=5):
+    ''' Returns the time to build the Mapper and the time to then reverse
+        ``names`` of its names
+    '''
+    urls = make_urls(count)
+    start = time.time()
+    mapper = Mapper(urls, replacements=REPLACEMENTS, lazy=lazy)
+    built = time.time() - start
+    step = max(1, len(mapper.urls) // names)
+    chosen = [u for u in mapper.urls[::step] if u.name][:names]
+    start = time.time()
+    for u in chosen:
+        mapper.reverse(u.name, **sample_kwargs(u))
+    return built, time.time() - start
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 10000
+    for name, module in list(sys.modules.items()):
+        if name.startswith('surly') and module is not None:
+            source = getattr(module, '__file__', '')
+            if source.endswith('.py'):
+                py_compile.compile(source)
+    elapsed, loaded = measure_import()
+    print('import surly.mapper  %8.1fms  optional modules loaded: %s'
+          % (elapsed * 1e3, ', '.join(loaded) or 'none'))
+    print('%d routes' % count)
+    for label, lazy in [('eager', False), ('lazy', True)]:
+        built, reversed_ = measure_build(count, lazy)
+        print('%-6s build %8.1fms  reverse 5 names %6.2fms'
+              % (label, built * 1e3, reversed_ * 1e3))
+
+if __name__ == '__main__':
+    main(sys.argv)
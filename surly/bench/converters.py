@@ -0,0 +1,68 @@
+''' Converter benchmark: the segment matcher against the regex path.
+
+    Two tables hold the same routes, one written with converters
+    (``<int:id>``, ``<slug:name>``, ``<uuid:key>``), which the dispatch
+    index matches segment by segment, and one with the equivalent named
+    groups, which it matches with its combined regexes.  The regex table's
+    values are converted afterwards, so both return the same kwargs.
+
+    ``resources`` gives every route a node of its own in the prefix tree,
+    as REST tables mostly do; ``shared`` puts every route on one node, so
+    each lookup tries them all.
+
+    Usage: ``python -m surly.bench.converters [ROUTES]``
+'''
+import sys
+import timeit
+import uuid
+
+from surly.mapper import Mapper, url
+from surly.converters import convert, expand
+
+KEY = uuid.UUID('12345678-1234-5678-1234-567812345678')
+
+def make_tables(count):
+    ''' Return ``{layout: (patterns, path)}``, where ``path`` matches the
+        last pattern
+    '''
+    last = count - 1
+    return {
+        'resources': (
+            ['^/resource%d/<int:id>/<slug:name>/<uuid:key>$' % i
+             for i in range(count)],
+            '/resource%d/42/some-name/%s' % (last, KEY)),
+        'shared': (
+            ['^/<slug:kind>/<int:id>/action%d/<uuid:key>$' % i
+             for i in range(count)],
+            '/things/42/action%d/%s' % (last, KEY)),
+    }
+
+def regex_match(mapper, converters, path):
+    result = mapper.match(path)
+    convert(result.kwargs, converters)
+    return result
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 100
+    number = 5000
+    print('%d routes' % count)
+    for layout, (patterns, path) in sorted(make_tables(count).items()):
+        typed = Mapper([url(pattern, None) for pattern in patterns])
+        # The same patterns with the converters spelled out as groups
+        plain = Mapper([url(expand(pattern)[0], None)
+                        for pattern in patterns])
+        typed.prepare()
+        plain.prepare()
+        converters = typed.urls[-1].converters
+        assert typed.urls[-1].segments is not None
+        assert (typed.match(path).kwargs
+                == regex_match(plain, converters, path).kwargs)
+        for label, func in [
+                ('regex', lambda: regex_match(plain, converters, path)),
+                ('segments', lambda: typed.match(path))]:
+            best = min(timeit.repeat(func, number=number, repeat=5))
+            print('%-10s %-10s %8.2fus' % (layout, label,
+                                           best * 1e6 / number))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,76 @@
+''' Instrumentation overhead: ``Mapper.match`` and ``Mapper.reverse`` on
+    the benchmark suite's synthetic table, without instrumentation and
+    instrumented at several sample rates.
+
+    Each configuration is timed for ``CALLS`` calls in each of ``ROUNDS``
+    rounds, and the best and median times per call are reported.
+
+    Usage: ``python -m surly.bench.instrument [ROUTES [CALLS [ROUNDS]]]``
+'''
+import random
+import sys
+import timeit
+
+from surly.bench.suite import make_urls, sample_kwargs, REPLACEMENTS
+from surly.mapper import Mapper
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 1000
+    calls = int(argv[2]) if len(argv) > 2 else 10000
+    rounds = int(argv[3]) if len(argv) > 3 else 51
+    mapper = Mapper(make_urls(count), replacements=REPLACEMENTS)
+    mapper.prepare()
+    rng = random.Random(0)
+    cases = []
+    for i in range(1000):
+        u = rng.choice(mapper.urls)
+        kwargs = sample_kwargs(u)
+        cases.append((u.name, kwargs, u.reverse(**kwargs)))
+
+    def match_loop():
+        match = mapper.match
+        for i in range(calls // len(cases)):
+            for name, kwargs, path in cases:
+                match(path)
+
+    def reverse_loop():
+        reverse = mapper.reverse
+        for i in range(calls // len(cases)):
+            for name, kwargs, path in cases:
+                reverse(name, **kwargs)
+
+    # Configurations are measured in turn, round after round, each with
+    # several short runs of which the best is kept, so that drift in
+    # machine load affects them all alike
+    rates = [None, 0.001, 0.01, 0.1, 1.0]
+    times = dict((rate, ([], [])) for rate in rates)
+    reverse_loop()
+    for round in range(rounds):
+        for rate in rates:
+            if rate is None:
+                mapper.uninstrument()
+            else:
+                mapper.instrument(sample_rate=rate)
+            for loop, results in zip((match_loop, reverse_loop), times[rate]):
+                results.append(min(timeit.repeat(loop, number=1, repeat=3)))
+    mapper.uninstrument()
+
+    print('%d routes, %d calls, %d rounds' % (count, calls, rounds))
+    print('%-20s %-7s %18s %18s'
+          % ('instrumentation', '', 'match', 'reverse'))
+    for summary, pick in (('best', min), ('median', _median)):
+        base = [pick(results) for results in times[None]]
+        for rate in rates:
+            match, reverse = [pick(results) for results in times[rate]]
+            label = 'off' if rate is None else 'sample_rate=%g' % rate
+            print('%-20s %-7s %8.3fus %+6.1f%% %8.3fus %+6.1f%%'
+                  % (label, summary, match * 1e6 / calls,
+                     (match / base[0] - 1) * 100, reverse * 1e6 / calls,
+                     (reverse / base[1] - 1) * 100))
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,52 @@
+''' Memory benchmark: bytes per route held by a ``Mapper``.
+
+    For tables of the suite's shape (``surly.bench.suite.make_urls``),
+    reports the memory allocated per route, and still held, once the
+    ``Mapper`` is built, once its whole dispatch index is built
+    (``prepare``), and once every url has been reversed (which builds its
+    reverse function).  Needs ``tracemalloc`` (Python 3).
+
+    Usage: ``python -m surly.bench.memory [ROUTES ...]``
+'''
+import gc
+import sys
+
+from surly.bench.suite import make_urls, sample_kwargs, REPLACEMENTS
+from surly.mapper import Mapper
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+def measure(count):
+    ''' Returns ``(built, prepared, reversed)``, in bytes per route '''
+    urls = make_urls(count)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        mapper = Mapper(urls, replacements=REPLACEMENTS)
+        del urls
+        gc.collect()
+        built = tracemalloc.get_traced_memory()[0]
+        mapper.prepare()
+        prepared = tracemalloc.get_traced_memory()[0]
+        for u in mapper.urls:
+            u.reverse(**sample_kwargs(u))
+        reversed_ = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return tuple(float(value) / count
+                 for value in (built, prepared, reversed_))
+
+def main(argv):
+    if tracemalloc is None:
+        sys.exit('tracemalloc is not available')
+    sizes = [int(arg) for arg in argv[1:]] or [1000, 10000]
+    print('%8s %10s %10s %10s' % ('routes', 'built', 'prepared',
+                                  'reversed'))
+    for count in sizes:
+        print('%8d %10.0f %10.0f %10.0f' % ((count,) + measure(count)))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,48 @@
+''' Pattern parse throughput benchmark.
+
+    For the patterns of a table of the suite's shape
+    (``surly.bench.suite.make_urls``, with its prefixes and replacements
+    applied), measures the patterns parsed per second by ``re_parse``'s own
+    scanner and by ``re.compile`` with ``sre_parse``, which it falls back
+    to, and by ``compile_pattern`` as a whole.  The ``re`` cache is purged
+    before each run, as at startup.
+
+    Usage: ``python -m surly.bench.parse [ROUTES]``
+'''
+import re
+import sys
+import timeit
+
+from surly import re_parse
+from surly.bench.suite import make_urls, REPLACEMENTS
+from surly.mapper import Mapper
+
+def throughput(function, patterns):
+    ''' Returns the patterns per second ``function`` handles '''
+    def run():
+        re.purge()
+        for pattern in patterns:
+            function(pattern)
+    best = min(timeit.repeat(run, number=1, repeat=5))
+    return len(patterns) / best
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 1000
+    patterns = [u.pattern for u in
+                Mapper(make_urls(count), replacements=REPLACEMENTS).urls]
+    scanned = 0
+    for pattern in patterns:
+        try:
+            re_parse._scan(pattern)
+            scanned += 1
+        except re_parse._Unsupported:
+            pass
+    print('%d patterns, %d handled by the scanner' % (len(patterns), scanned))
+    for label, function in [('scanner', re_parse._parse),
+                            ('sre_parse', re_parse._parse_with_re),
+                            ('compile_pattern', re_parse.compile_pattern)]:
+        print('%-16s %10.0f patterns/s'
+              % (label, throughput(function, patterns)))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,65 @@
+''' Host and method partitioning benchmark.
+
+    A table serves ``HOSTS`` virtual hosts, each with the same routes, one
+    route per method for most resources.  Requests name a host and a
+    method.  ``Mapper.match`` picks the (host, method) bucket with a dict
+    lookup and only tries its routes.  For comparison, the benchmark also
+    resolves requests the way a router without partitioning does: trying
+    each url in order and skipping those whose host or method does not
+    fit.
+
+    Usage: ``python -m surly.bench.partition [ROUTES_PER_HOST]``
+'''
+import sys
+import timeit
+
+from surly.mapper import Mapper, url, include
+
+HOSTS = 10
+METHODS = ['GET', 'POST', 'PUT', 'DELETE']
+
+def make_urls(per_host):
+    urls = []
+    for h in range(HOSTS):
+        host_urls = []
+        for i in range(per_host):
+            method = METHODS[i % len(METHODS)]
+            host_urls.append(url(r'resource%d/(?P<id>\d+)$' % (i // 4), None,
+                                 methods=method))
+        urls.append(include(r'^/', host_urls, host='host%d.example.com' % h))
+    return urls
+
+def linear_match(urls, path, method, host):
+    for u in urls:
+        if u.host is not None and u.host != host:
+            continue
+        if u.methods is not None and method not in u.methods:
+            continue
+        found = u.regex.match(path)
+        if found is not None:
+            return u, found.groupdict()
+    return None
+
+def main(argv):
+    per_host = int(argv[1]) if len(argv) > 1 else 200
+    mapper = Mapper(make_urls(per_host))
+    mapper.prepare()
+    urls = mapper.urls
+    last = per_host - 1
+    path = '/resource%d/42' % (last // 4)
+    method = METHODS[last % len(METHODS)]
+    host = 'host%d.example.com' % (HOSTS - 1)
+    assert mapper.match(path, method, host).url is linear_match(
+        urls, path, method, host)[0]
+    number = 2000
+    print('%d hosts x %d routes' % (HOSTS, per_host))
+    for label, func in [
+            ('linear, skipping host/method',
+             lambda: linear_match(urls, path, method, host)),
+            ('Mapper.match(path, method, host)',
+             lambda: mapper.match(path, method, host))]:
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print('%-34s %8.2fus' % (label, best * 1e6 / number))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,65 @@
+''' Reverse benchmark: generated reverse functions against formatting the
+    ``py_pattern`` template with ``str.format``, with and without escaping
+    the values.
+
+    Usage: ``python -m surly.bench.reverse [LINKS]``
+'''
+import sys
+import timeit
+
+from surly.mapper import Mapper, url
+
+def make_mapper():
+    return Mapper([
+        url(r'^/$', None, name='home'),
+        url(r'^/accounts/(?P<account>\d+)/projects/(?P<project>[-\w]+)/'
+            r'items/(?P<item>\d+)$', None, name='item'),
+    ])
+
+def main(argv):
+    links = int(argv[1]) if len(argv) > 1 else 100000
+    mapper = make_mapper()
+    u = mapper.reverse_patterns['item']
+    template = u.py_pattern
+    kwargs_list = [{'account': i % 50, 'project': 'project-%d' % (i % 7),
+                    'item': i} for i in range(links)]
+
+    def format_loop():
+        for kwargs in kwargs_list:
+            template.format(**kwargs)
+
+    def previous_reverse(name, **kwargs):
+        # Mapper.reverse as it was before reverse functions were generated
+        if name not in mapper.reverse_patterns:
+            raise KeyError(name)
+        return mapper.reverse_patterns[name].py_pattern.format(**kwargs)
+
+    def previous_reverse_loop():
+        for kwargs in kwargs_list:
+            previous_reverse('item', **kwargs)
+
+    def mapper_reverse_loop():
+        for kwargs in kwargs_list:
+            mapper.reverse('item', **kwargs)
+
+    def unescaped_reverse_loop():
+        for kwargs in kwargs_list:
+            mapper.reverse('item', _escape=False, **kwargs)
+
+    def reverse_many():
+        for link in mapper.reverse_many('item', kwargs_list):
+            pass
+
+    print('links: %d' % links)
+    for label, func in [('str.format of py_pattern', format_loop),
+                        ('Mapper.reverse (str.format)', previous_reverse_loop),
+                        ('Mapper.reverse', mapper_reverse_loop),
+                        ('Mapper.reverse, _escape=False',
+                         unescaped_reverse_loop),
+                        ('Mapper.reverse_many', reverse_many)]:
+        best = min(timeit.repeat(func, number=1, repeat=3))
+        print('%-30s %.3fs  (%.2f us/link)'
+              % (label, best, best * 1e6 / links))
+
+if __name__ == '__main__':
+    main(sys.argv)
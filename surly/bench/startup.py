@@ -0,0 +1,68 @@
+''' Startup benchmark: the time taken to build a ``Mapper`` of included
+    routes which use ``replacements``.
+
+    The current build parses each final pattern once.  For comparison the
+    benchmark also runs the previous scheme, in which every url was
+    compiled three times (in ``__init__``, ``apply_prefix`` and
+    ``apply_replacements``) and each compile ran ``reverse_template_js``,
+    ``reverse_template`` and ``reverse_group_map`` separately.
+
+    Usage: ``python -m surly.bench.startup [ROUTES]``
+'''
+import sys
+import time
+
+from surly.mapper import Mapper, url, include
+from surly.re_parse import (reverse_template, reverse_template_js,
+                            reverse_group_map)
+
+REPLACEMENTS = {'id': r'\d+', 'slug': r'[-\w]+'}
+
+def make_urls(count, per_include=10):
+    ''' Build ``count`` urls, grouped ``per_include`` to an ``include()``
+    '''
+    urls = []
+    for section in range(0, count, per_include):
+        section_urls = []
+        for i in range(min(per_include, count - section)):
+            n = section + i
+            section_urls.append(url(
+                r'/item%d/(?P<id>{id})/(?P<slug>{slug})$' % n, None,
+                name='route%d' % n))
+        urls.append(include(r'^/section%d' % section, section_urls))
+    return urls
+
+def _legacy_compile(pattern):
+    reverse_template_js(pattern)
+    reverse_template(pattern)
+    reverse_group_map(pattern)
+
+def build_legacy(count):
+    ''' Emulate the previous compilation scheme for ``count`` routes '''
+    for entry in make_urls(count):
+        for u in entry.urls:
+            pattern = u.pattern
+            _legacy_compile(pattern)
+            pattern = entry.prefix + pattern
+            _legacy_compile(pattern)
+            _legacy_compile(pattern.format(**REPLACEMENTS))
+
+def build_current(count):
+    return Mapper(make_urls(count), replacements=REPLACEMENTS)
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 10000
+    legacy = timed(build_legacy, count)
+    current = timed(build_current, count)
+    print('routes: %d' % count)
+    print('legacy (three compiles per url): %.3fs' % legacy)
+    print('current (one parse per url):     %.3fs' % current)
+    print('speedup: %.1fx' % (legacy / current))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,289 @@
+''' The routing benchmark suite.
+
+    Builds synthetic route tables of increasing size and measures, for
+    each: ``Mapper`` construction time and memory, the time to build the
+    full dispatch index, ``reverse`` throughput, ``js_mapper`` generation
+    time and size (readable and minified), and ``match`` latency
+    percentiles over a mix of paths, a few of which match no route.
+
+    The tables are shaped like a real site: top-level ``include()``s each
+    holding a few static pages and two further levels of nested includes
+    which capture an account and a project, with leaves mixing static
+    segments and captured ones.  Patterns use ``replacements`` for their
+    group regexes.  Tables are generated from a seed, so every run of a
+    given size measures the same routes.
+
+    Results are written as JSON.  Usage::
+
+        python -m surly.bench [--sizes 10,100,1000] [--output run.json]
+        python -m surly.bench --compare old.json new.json
+'''
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+
+import surly
+# Imported here so that its import is not timed with js_mapper
+import surly.js
+from surly.mapper import Mapper, url, include
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2: memory is not measured
+    tracemalloc = None
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    # Python 2
+    clock = time.time
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+REPLACEMENTS = {
+    'id': r'\d+',
+    'slug': r'[-\w]+',
+    'word': r'[^/]+',
+    'path': r'.+',
+}
+
+# Sample values for each group name, used to build matching paths
+VALUES = {
+    'account': 4021,
+    'project': 'my-project',
+    'item': 77,
+    'slug': 'an-item',
+    'query': 'term',
+    'path': 'docs/readme.txt',
+}
+
+# Routes directly under each top-level include
+APP_PAGES = [r'$', r'about/$', r'help/$', r'feed\.xml$']
+# Routes under the account include, and under the project include
+ACCOUNT_PAGES = [r'$', r'settings/$', r'billing/$', r'members/$',
+                 r'members/(?P<item>{id})/$']
+PROJECT_PAGES = [r'$', r'items/$', r'items/(?P<item>{id})/$',
+                 r'items/(?P<item>{id})/(?P<slug>{slug})$',
+                 r'items/(?P<item>{id})/edit$', r'search/(?P<query>{word})$',
+                 r'files/(?P<path>{path})$', r'activity/$']
+
+def make_urls(count, seed=0):
+    ''' Build a table of ``count`` named urls.  Returns the list of
+        ``url`` and ``include`` objects to pass to ``Mapper``.
+    '''
+    rng = random.Random(seed)
+    urls = []
+    made = [0]
+
+    def leaves(pages, limit):
+        out = []
+        for page in pages:
+            if made[0] >= count or len(out) >= limit:
+                break
+            out.append(url(page, None, name='r%d' % made[0]))
+            made[0] += 1
+        return out
+
+    app = 0
+    while made[0] < count:
+        prefix = '^/app%d/' % app
+        app += 1
+        app_urls = leaves(APP_PAGES, rng.randint(1, len(APP_PAGES)))
+        account_urls = leaves(ACCOUNT_PAGES,
+                              rng.randint(1, len(ACCOUNT_PAGES)))
+        projects = []
+        for i in range(rng.randint(1, 3)):
+            project_urls = leaves(PROJECT_PAGES, len(PROJECT_PAGES))
+            if project_urls:
+                projects.append(include(r'p%d/(?P<project>{slug})/' % i,
+                                        project_urls))
+        account_urls.extend(projects)
+        if account_urls:
+            app_urls.append(include(r'(?P<account>{id})/', account_urls))
+        urls.append(include(prefix, app_urls))
+    return urls
+
+def sample_kwargs(u):
+    return dict((name, VALUES[name]) for name in u.group_map.values())
+
+def percentiles(samples, points=(50, 90, 99, 99.9)):
+    samples = sorted(samples)
+    result = {}
+    for point in points:
+        index = min(len(samples) - 1, int(len(samples) * point / 100.0))
+        result['p%s' % point] = samples[index]
+    result['max'] = samples[-1]
+    return result
+
+def measure_construction(count, seed):
+    ''' Returns the mapper and the time taken to build it '''
+    urls = make_urls(count, seed)
+    gc.collect()
+    start = clock()
+    mapper = Mapper(urls, replacements=REPLACEMENTS)
+    return mapper, clock() - start
+
+def measure_memory(count, seed):
+    ''' Build the table again, tracing allocations (which slows the build
+        down too much to time it at the same time)
+    '''
+    if tracemalloc is None:
+        return None
+    urls = make_urls(count, seed)
+    gc.collect()
+    tracemalloc.start()
+    mapper = Mapper(urls, replacements=REPLACEMENTS)
+    built = tracemalloc.get_traced_memory()[0]
+    mapper.prepare()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'mapper_bytes': built, 'prepared_bytes': current,
+            'peak_bytes': peak}
+
+def measure_reverse(mapper, calls, rng):
+    names = sorted(mapper.reverse_patterns)
+    cases = []
+    for i in range(min(calls, 1000)):
+        name = rng.choice(names)
+        cases.append((name, sample_kwargs(mapper.reverse_patterns[name])))
+    reverse = mapper.reverse
+    for name, kwargs in cases:
+        # Reverse functions are generated on first use
+        reverse(name, **kwargs)
+    start = clock()
+    done = 0
+    while done < calls:
+        for name, kwargs in cases:
+            reverse(name, **kwargs)
+        done += len(cases)
+    return done / (clock() - start)
+
+def measure_js(mapper, var_name='Surly.reverse'):
+    result = {}
+    for label, minify in [('readable', False), ('minified', True)]:
+        mapper._js_cache = {}
+        start = clock()
+        source = mapper.js_mapper(var_name, minify=minify)
+        result[label] = {'seconds': clock() - start, 'bytes': len(source)}
+    return result
+
+def measure_match(mapper, lookups, rng):
+    us = list(mapper.urls)
+    paths = []
+    for i in range(min(lookups, 2000)):
+        if i % 20 == 19:
+            paths.append('/app%d/missing/page' % rng.randint(0, 1000))
+        else:
+            u = rng.choice(us)
+            paths.append(u.reverse(**sample_kwargs(u)))
+    match = mapper.match
+    samples = []
+    while len(samples) < lookups:
+        for path in paths:
+            start = clock()
+            match(path)
+            samples.append(clock() - start)
+    return dict((key, value * 1e6)
+                for key, value in percentiles(samples).items())
+
+def run_size(count, seed=0, calls=20000):
+    ''' Run every measurement on a table of ``count`` routes.  Returns a
+        dict of results, with times in seconds unless the key says
+        otherwise.
+    '''
+    rng = random.Random(seed)
+    mapper, construction = measure_construction(count, seed)
+    start = clock()
+    mapper.prepare()
+    prepare = clock() - start
+    return {
+        'routes': count,
+        'construction_seconds': construction,
+        'memory': measure_memory(count, seed),
+        'prepare_seconds': prepare,
+        'reverse_per_second': measure_reverse(mapper, calls, rng),
+        'js_mapper': measure_js(mapper),
+        'match_latency_us': measure_match(mapper, calls, rng),
+    }
+
+def run(sizes=DEFAULT_SIZES, seed=0, calls=20000, log=None):
+    results = []
+    for count in sizes:
+        if log is not None:
+            log('%d routes...' % count)
+        results.append(run_size(count, seed, calls))
+    return {
+        'surly_version': surly.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'seed': seed,
+        'calls': calls,
+        'results': results,
+    }
+
+def _flatten(value, prefix=''):
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            out.update(_flatten(item, prefix + key + '.'))
+        return out
+    return {prefix[:-1]: value}
+
+def compare(old, new):
+    ''' Yield ``(routes, metric, old, new)`` for every numeric metric
+        measured in both runs
+    '''
+    old_results = dict((r['routes'], r) for r in old['results'])
+    for result in new['results']:
+        previous = old_results.get(result['routes'])
+        if previous is None:
+            continue
+        before = _flatten(previous)
+        for metric, value in sorted(_flatten(result).items()):
+            if metric == 'routes' or not isinstance(value, (int, float)):
+                continue
+            if isinstance(before.get(metric), (int, float)):
+                yield result['routes'], metric, before[metric], value
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m surly.bench',
+        description='Benchmark surly on synthetic route tables.')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma separated table sizes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--calls', type=int, default=20000,
+                        help='reverse calls and match lookups per size')
+    parser.add_argument('--output', '-o', default=None,
+                        help='write the JSON here instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        runs = []
+        for path in args.compare:
+            with open(path) as f:
+                runs.append(json.load(f))
+        for routes, metric, before, after in compare(*runs):
+            change = (after / before - 1) * 100 if before else 0.0
+            sys.stdout.write('%8d %-36s %14.6g %14.6g %+8.1f%%\n'
+                             % (routes, metric, before, after, change))
+        return
+
+    log = lambda message: sys.stderr.write(message + '\n')
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes, args.seed, args.calls, log)
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,84 @@
+''' Routes-vs-latency benchmark for the Tornado router.
+
+    For each table size, serves the same routes two ways: as a plain list
+    of Tornado URLSpecs (tried one by one) and through ``SurlyRouter``.
+    Each app runs in a real ``HTTPServer`` on localhost.  The benchmark
+    reports the mean request latency for the last route in the table (the
+    worst case for a linear scan), and the routing cost alone, timed by
+    calling ``find_handler`` directly.
+
+    Usage: ``python -m surly.bench.tornado_routing [REQUESTS]``
+'''
+import sys
+import time
+
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.httputil import HTTPServerRequest
+from tornado.ioloop import IOLoop
+from tornado.testing import bind_unused_port
+from tornado.web import Application, RequestHandler
+
+from surly.adapters import tornado_application
+from surly.mapper import Mapper, url
+
+SIZES = [10, 100, 1000, 5000]
+
+class Handler(RequestHandler):
+    def get(self, **kwargs):
+        self.write('ok')
+
+def patterns(count):
+    return [r'^/section%d/item/(?P<id>\d+)$' % i for i in range(count)]
+
+def linear_application(count):
+    return Application([(pattern, Handler) for pattern in patterns(count)])
+
+def surly_application(count):
+    return tornado_application(Mapper([url(pattern, Handler)
+                                       for pattern in patterns(count)]))
+
+def routing_time(application, path, repeat=2000):
+    request = HTTPServerRequest(method='GET', uri=path)
+    start = time.time()
+    for i in range(repeat):
+        application.find_handler(request)
+    return (time.time() - start) / repeat
+
+def request_latency(application, path, requests):
+    sock, port = bind_unused_port()
+    server = HTTPServer(application)
+    server.add_sockets([sock])
+    client = AsyncHTTPClient()
+    target = 'http://127.0.0.1:%d%s' % (port, path)
+
+    @gen.coroutine
+    def fetch_all():
+        # Sequential fetches, so each measures one request's latency
+        start = time.time()
+        for i in range(requests):
+            yield client.fetch(target)
+        raise gen.Return(time.time() - start)
+
+    elapsed = IOLoop.current().run_sync(fetch_all)
+    server.stop()
+    return elapsed / requests
+
+def main(argv):
+    requests = int(argv[1]) if len(argv) > 1 else 500
+    print('%8s %22s %22s' % ('routes', 'linear routing/latency',
+                             'surly routing/latency'))
+    for count in SIZES:
+        path = '/section%d/item/42' % (count - 1)
+        row = [count]
+        for build in (linear_application, surly_application):
+            application = build(count)
+            application.find_handler(HTTPServerRequest(method='GET',
+                                                       uri=path))
+            row.append(routing_time(application, path) * 1e6)
+            row.append(request_latency(application, path, requests) * 1e3)
+        print('%8d %9.1fus / %6.2fms %9.1fus / %6.2fms' % tuple(row))
+
+if __name__ == '__main__':
+    main(sys.argv)
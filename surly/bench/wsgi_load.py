@@ -0,0 +1,119 @@
+''' Load benchmark for the WSGI adapter.
+
+    Serves a table of static and dynamic routes from a ``wsgiref`` server
+    on localhost, and fetches a static and a dynamic path from several
+    client threads.  For comparison, the same routes are also served by a
+    naive WSGI app which tries each url's regex in turn.  The benchmark
+    reports requests per second over HTTP, and the time spent routing
+    alone, timed by calling each app directly.
+
+    Usage: ``python -m surly.bench.wsgi_load [ROUTES [REQUESTS]]``
+'''
+import sys
+import threading
+import time
+from wsgiref.simple_server import (make_server, WSGIRequestHandler,
+                                   WSGIServer)
+
+try:
+    from socketserver import ThreadingMixIn
+    from http.client import HTTPConnection
+except ImportError:
+    # Python 2
+    from SocketServer import ThreadingMixIn
+    from httplib import HTTPConnection
+
+from surly.adapters import SurlyWSGIApplication
+from surly.mapper import Mapper, url
+
+CLIENTS = 4
+
+def target(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain'),
+                              ('Content-Length', '2')])
+    return [b'ok']
+
+def make_urls(count):
+    ''' ``count`` routes, alternately static and dynamic '''
+    urls = []
+    for i in range(count // 2):
+        urls.append(url(r'^/page%d/$' % i, target))
+        urls.append(url(r'^/section%d/item/(?P<id>\d+)$' % i, target))
+    return urls
+
+class LinearApplication(object):
+    ''' What a WSGI app without an index does: try every route '''
+    def __init__(self, urls):
+        self.routes = [(u.regex.match, u) for u in urls]
+
+    def __call__(self, environ, start_response):
+        path = environ['PATH_INFO']
+        for match, u in self.routes:
+            found = match(path)
+            if found is not None:
+                environ['wsgiorg.routing_args'] = ((), found.groupdict())
+                return u.target(environ, start_response)
+        start_response('404 Not Found', [])
+        return []
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+def routing_time(app, path, repeat=20000):
+    start_response = lambda status, headers: None
+    start = time.time()
+    for i in range(repeat):
+        app({'PATH_INFO': path}, start_response)
+    return (time.time() - start) / repeat
+
+def requests_per_second(app, path, requests):
+    server = make_server('127.0.0.1', 0, app, server_class=ThreadingWSGIServer,
+                         handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    port = server.server_address[1]
+
+    def client():
+        for i in range(requests // CLIENTS):
+            # wsgiref closes every connection, so each request connects
+            connection = HTTPConnection('127.0.0.1', port)
+            connection.request('GET', path)
+            connection.getresponse().read()
+            connection.close()
+
+    clients = [threading.Thread(target=client) for i in range(CLIENTS)]
+    start = time.time()
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    elapsed = time.time() - start
+    server.shutdown()
+    server.server_close()
+    return (requests // CLIENTS * CLIENTS) / elapsed
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 2000
+    requests = int(argv[2]) if len(argv) > 2 else 2000
+    urls = make_urls(count)
+    apps = [('linear', LinearApplication(urls)),
+            ('surly', SurlyWSGIApplication(Mapper(urls)))]
+    paths = [('static', '/page%d/' % (count // 2 - 1)),
+             ('dynamic', '/section%d/item/42' % (count // 2 - 1))]
+    print('%d routes, %d requests from %d clients'
+          % (count, requests, CLIENTS))
+    print('%-8s %-8s %12s %12s' % ('app', 'path', 'routing', 'req/s'))
+    for app_name, app in apps:
+        for path_name, path in paths:
+            app({'PATH_INFO': path}, lambda status, headers: None)
+            print('%-8s %-8s %10.1fus %12.0f'
+                  % (app_name, path_name, routing_time(app, path) * 1e6,
+                     requests_per_second(app, path, requests)))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,65 @@
+''' A small thread-safe LRU cache.
+'''
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    ''' A bounded mapping which evicts the least recently used entry once
+        ``maxsize`` entries are stored.  All operations take a lock, so one
+        cache can be shared by the threads of a thread-pool server.
+
+        ``clear`` bumps ``generation``.  A caller which computes a value
+        outside the lock should read the generation first and pass it to
+        ``put``, so that a value computed before a ``clear`` is never
+        stored after it.
+    '''
+    missing = object()
+
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        ''' Return the value stored for ``key``, or ``LRUCache.missing``
+        '''
+        with self._lock:
+            value = self._data.pop(key, self.missing)
+            if value is self.missing:
+                self.misses += 1
+            else:
+                self._data[key] = value
+                self.hits += 1
+            return value
+
+    def put(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def info(self):
+        ''' Return a dict of the cache's counters and sizes
+        '''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._data),
+                    'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,168 @@
+''' Attribute access-log lines to named routes.
+
+    Lines are streamed from the input in fixed-size chunks and farmed out
+    to a pool of worker processes.  Each worker builds the ``Mapper`` once,
+    when it starts, and returns a count of hits per route for each chunk.
+    Only a bounded number of chunks is ever in flight, so memory use does
+    not depend on the size of the input.
+
+    Routes are counted by name, or by pattern for urls without a name.
+    Paths which match no route are counted under ``UNMATCHED``, and lines
+    from which no path could be extracted under ``UNPARSED``.
+
+    Usage::
+
+        python -m surly.classify myapp.urls:mapper access.log [access.log.1.gz ...]
+
+    where ``myapp.urls:mapper`` names a ``Mapper``, a list of urls, or a
+    callable returning either.  Run with ``--help`` for the options.
+'''
+import argparse
+import collections
+import gzip
+import importlib
+import itertools
+import json
+import multiprocessing
+import re
+import sys
+
+from surly.instrument import UNMATCHED, route_key
+from surly.mapper import Mapper
+
+UNPARSED = '<unparsed>'
+
+#: Finds the request path in Common and Combined Log Format lines
+#: (``"GET /path?query HTTP/1.1"``).  The first group must be the path.
+DEFAULT_PATH_REGEX = r'"[A-Z]+ ([^ ?"]+)'
+
+def load_mapper(spec):
+    ''' Import the ``Mapper`` named by ``spec`` ("module.path:attribute").
+        The attribute may be a ``Mapper``, a list of urls, or a callable
+        returning either.
+    '''
+    module_name, sep, attribute = spec.partition(':')
+    if not sep:
+        raise ValueError('Mapper spec must look like "module:attribute": %s'
+                         % spec)
+    obj = getattr(importlib.import_module(module_name), attribute)
+    if callable(obj) and not isinstance(obj, Mapper):
+        obj = obj()
+    if not isinstance(obj, Mapper):
+        obj = Mapper(obj)
+    return obj
+
+def classify_lines(mapper, lines, path_regex=DEFAULT_PATH_REGEX):
+    ''' Count the routes hit by ``lines``.  Returns a ``Counter`` keyed by
+        ``route_key``, ``UNMATCHED`` and ``UNPARSED``.
+    '''
+    search = re.compile(path_regex).search
+    match = mapper.match
+    counts = collections.Counter()
+    for line in lines:
+        if not isinstance(line, str):
+            # Python 3 reads bytes; Python 2 can use the line as it is
+            line = line.decode('utf8', 'replace')
+        found = search(line)
+        if found is None:
+            counts[UNPARSED] += 1
+            continue
+        result = match(found.group(1))
+        if result is None:
+            counts[UNMATCHED] += 1
+        else:
+            counts[route_key(result.url)] += 1
+    return counts
+
+def chunked(lines, size):
+    ''' Yield lists of at most ``size`` consecutive items from ``lines`` '''
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            return
+        yield chunk
+
+# State of a worker process, set up once by _init_worker
+_worker_mapper = None
+_worker_path_regex = None
+
+def _init_worker(mapper_spec, path_regex):
+    global _worker_mapper, _worker_path_regex
+    _worker_mapper = load_mapper(mapper_spec)
+    _worker_path_regex = path_regex
+
+def _classify_chunk(chunk):
+    return classify_lines(_worker_mapper, chunk, _worker_path_regex)
+
+def classify(lines, mapper_spec, processes=None, chunk_size=10000,
+             path_regex=DEFAULT_PATH_REGEX):
+    ''' Count the routes hit by ``lines`` using a pool of ``processes``
+        workers (by default, one per CPU).  ``mapper_spec`` is passed to
+        ``load_mapper`` in each worker.  With ``processes=1`` everything
+        runs in this process.
+
+        Returns a ``Counter`` as for ``classify_lines``.
+    '''
+    if processes == 1:
+        return classify_lines(load_mapper(mapper_spec), lines, path_regex)
+    pool = multiprocessing.Pool(processes, _init_worker,
+                                (mapper_spec, path_regex))
+    try:
+        # Pool.imap would read the whole input ahead of the workers, so
+        # keep a fixed window of chunks in flight instead.
+        max_in_flight = 2 * (processes or multiprocessing.cpu_count())
+        in_flight = collections.deque()
+        counts = collections.Counter()
+        for chunk in chunked(lines, chunk_size):
+            if len(in_flight) >= max_in_flight:
+                counts.update(in_flight.popleft().get())
+            in_flight.append(pool.apply_async(_classify_chunk, (chunk,)))
+        while in_flight:
+            counts.update(in_flight.popleft().get())
+        pool.close()
+        return counts
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _read_lines(paths):
+    for path in paths:
+        if path == '-':
+            for line in getattr(sys.stdin, 'buffer', sys.stdin):
+                yield line
+            continue
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as f:
+            for line in f:
+                yield line
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m surly.classify',
+        description='Count access-log hits per named route.')
+    parser.add_argument('mapper', help='the Mapper, as "module:attribute"')
+    parser.add_argument('logs', nargs='*', default=['-'],
+                        help='log files (.gz is decompressed); '
+                             'default: standard input')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='lines sent to a worker at a time')
+    parser.add_argument('--path-regex', default=DEFAULT_PATH_REGEX,
+                        help='regex whose first group is the request path')
+    parser.add_argument('--json', action='store_true',
+                        help='print a JSON object instead of TSV')
+    args = parser.parse_args(argv)
+    counts = classify(_read_lines(args.logs), args.mapper,
+                      processes=args.processes, chunk_size=args.chunk_size,
+                      path_regex=args.path_regex)
+    if args.json:
+        json.dump(dict(counts), sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        for key, count in counts.most_common():
+            sys.stdout.write('%d\t%s\n' % (count, key))
+
+if __name__ == '__main__':
+    main()
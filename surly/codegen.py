@@ -0,0 +1,416 @@
+''' Ahead-of-time code generation of a route table's dispatcher.
+
+    ``generate`` turns a built ``Mapper`` into the source of a standalone
+    Python module holding:
+
+    * ``resolve(path)``, the table's first-match dispatch specialized to
+      it.  The literal prefixes of the dispatch index
+      (``surly.dispatch.PrefixTree``) become nested ``startswith`` tests,
+      routes which only match literal text become string comparisons, and
+      every other route has a regex of its own, compiled on first use.
+    * ``reverse(name, **kwargs)``, with one reverse function per name.
+    * the compiled form of every url, as a table cache holds it (see
+      ``surly.table_cache``).
+
+    Importing the module parses no pattern.  Given to ``Mapper`` as
+    ``generated``, the urls load their compiled form from it and it
+    resolves the paths of requests which are not partitioned by method or
+    host.  Mappers which mount others (see ``include``) are not supported.
+
+    ``write`` checks the module against the Mapper on sample paths before
+    putting it in place, as ``python -m surly.codegen`` does.
+'''
+import types
+
+from surly import table_cache
+from surly.converters import CONVERTERS, safe_fields
+from surly.dispatch import PrefixTree
+from surly.re_parse import _reverse_source
+
+class CodegenError(Exception):
+    pass
+
+# Children a node may have before its subtrees are looked up in a dict by
+# their first character rather than tried in turn
+FANOUT = 8
+
+# Tree levels nested in one function, well below the limit on indentation
+MAX_DEPTH = 12
+
+_HEADER = """\
+# Generated by surly.codegen from the route table with the fingerprint
+# below.  Do not edit.
+import re
+
+from surly import escape
+from surly.re_parse import _text, _missing_argument
+%(imports)s
+FINGERPRINT = %(fingerprint)r
+
+#: Per url: py_pattern, group_map items, literal_prefix
+COMPILED = [
+%(compiled)s
+]
+
+def _lazy(name, pattern):
+    # Stands in for the match method of ``pattern``, which is compiled
+    # on first use and takes its place
+    def match(path):
+        match = globals()[name] = re.compile(pattern).match
+        return match(path)
+    return match
+
+"""
+
+_RESOLVE = """\
+def resolve(path):
+    ''' Return ``(index, kwargs)`` for the first url matching ``path``,
+        where ``index`` is its position in the route table, or ``None``
+    '''
+    best = %(end)d
+    kwargs = None
+%(body)s
+    if kwargs is None:
+        return None
+%(convert)s    return best, kwargs
+"""
+
+_REVERSE = """\
+def reverse(name, _escape=True, **kwargs):
+    ''' The path of the url named ``name``, as ``Mapper.reverse`` '''
+    if _escape:
+%(safe)s        return REVERSE[name](kwargs, escape.memo.escape)
+    return REVERSE[name](kwargs)
+"""
+
+_REVERSE_SAFE = """\
+        safe = _SAFE.get(name)
+        if safe is not None:
+            kwargs = escape.escape_fields(kwargs, safe)
+"""
+
+def _literal(u):
+    ''' The text ``u`` matches, and whether its pattern ends with "$", or
+        ``None`` if its pattern is not plain literal text
+    '''
+    from surly.mapper import _LITERAL, _UNESCAPE
+    pattern = u.pattern
+    anchored = pattern.endswith('$') and not pattern.endswith('\\$')
+    if anchored:
+        pattern = pattern[:-1]
+    m = _LITERAL.match(pattern)
+    if m is None or not m.group(1):
+        return None
+    return _UNESCAPE.sub(r'\1', m.group(1)), anchored
+
+def _converter_names(u):
+    names = {}
+    for group, converter in sorted(u.converters.items()):
+        if converter.to_python is None:
+            continue
+        for name, registered in CONVERTERS.items():
+            if registered is converter:
+                names[group] = name
+                break
+        else:
+            raise CodegenError('url %r uses an unregistered converter'
+                               % (u.name or u.pattern))
+    return names
+
+class _Generator(object):
+    def __init__(self, mapper):
+        self.mapper = mapper
+        self.functions = []
+        self.tables = []
+        self.regexes = []
+        self.converters = []
+
+    def source(self):
+        mapper = self.mapper
+        if mapper._mounts:
+            raise CodegenError('Mappers which mount others are not supported')
+        tree = PrefixTree(enumerate(mapper.urls))
+        body = []
+        self._node(tree.root, 0, body, 1)
+        convert = ''
+        if self.converters:
+            convert = ('    converters = _CONVERTERS.get(best)\n'
+                       '    if converters is not None:\n'
+                       '        convert(kwargs, converters)\n')
+        resolve = _RESOLVE % {'end': len(mapper.urls),
+                              'body': '\n'.join(body) or '    pass',
+                              'convert': convert}
+        compiled = ['    (%r, %r, %r),' % (
+            u.py_pattern, tuple(sorted(u.group_map.items())),
+            u.literal_prefix) for u in mapper.urls]
+        imports = ''
+        if self.converters:
+            imports = 'from surly.converters import CONVERTERS, convert\n'
+        out = [_HEADER % {'imports': imports,
+                          'fingerprint': table_cache.fingerprint(mapper),
+                          'compiled': '\n'.join(compiled)}]
+        out.extend(self.regexes)
+        out.append('')
+        if self.converters:
+            out.append('_CONVERTERS = {')
+            for index, names in self.converters:
+                out.append('    %d: {%s},' % (index, ', '.join(
+                    '%r: CONVERTERS[%r]' % item
+                    for item in sorted(names.items()))))
+            out.append('}')
+            out.append('')
+        out.extend(self.functions)
+        out.extend(self.tables)
+        out.append(resolve)
+        names = sorted(mapper.reverse_patterns)
+        for number, name in enumerate(names):
+            out.append(_reverse_source(
+                mapper.reverse_patterns[name].py_pattern,
+                '_reverse%d' % number))
+            out.append('')
+        out.append('REVERSE = {')
+        for number, name in enumerate(names):
+            out.append('    %r: _reverse%d,' % (name, number))
+        out.append('}')
+        out.append('')
+        # The characters converters keep unescaped, by name and group
+        safe = [(name, safe_fields(mapper.reverse_patterns[name].converters))
+                for name in names]
+        safe = [(name, fields) for name, fields in safe if fields]
+        if safe:
+            out.append('_SAFE = {')
+            for name, fields in safe:
+                out.append('    %r: %r,' % (name, fields))
+            out.append('}')
+            out.append('')
+        out.append(_REVERSE % {'safe': _REVERSE_SAFE if safe else ''})
+        return '\n'.join(out)
+
+    def _node(self, node, pos, lines, depth):
+        ''' Append to ``lines`` the code trying the routes of ``node`` and
+            of its subtree, where ``pos`` characters of the path are known
+            to match
+        '''
+        indent = '    ' * depth
+        for order, u in zip(node.orders, node.urls):
+            self._route(order, u, lines, indent)
+        children = sorted(node.children.items())
+        if not children:
+            return
+        if len(children) > FANOUT:
+            number = len(self.tables)
+            table = '_children%d' % number
+            self.tables.append(None)
+            entries = ['%s = {' % table]
+            for char, child in children:
+                entries.append('    %r: %s,' % (
+                    char, self._subtree(child, pos, True)))
+            entries.append('}')
+            self.tables[number] = '\n'.join(entries) + '\n'
+            lines.append('%schild = %s.get(path[%d:%d])'
+                         % (indent, table, pos, pos + 1))
+            lines.append('%sif child is not None:' % indent)
+            lines.append('%s    best, kwargs = child(path, best, kwargs)'
+                         % indent)
+            return
+        keyword = 'if'
+        for char, child in children:
+            lines.append('%s%s best > %d and path.startswith(%r, %d):'
+                         % (indent, keyword, _lowest(child), child.label,
+                            pos))
+            if depth >= MAX_DEPTH:
+                lines.append('%s    best, kwargs = %s(path, best, kwargs)'
+                             % (indent, self._subtree(child, pos, False)))
+            else:
+                self._node(child, pos + len(child.label), lines, depth + 1)
+            keyword = 'elif'
+
+    def _subtree(self, node, pos, check):
+        ''' Generate a function for ``node``'s subtree; ``check`` makes it
+            test the node's label itself.  Returns its name.
+        '''
+        number = len(self.functions)
+        name = '_tree%d' % number
+        # Reserved now, so that the subtrees' functions come after it
+        self.functions.append(None)
+        lines = ['def %s(path, best, kwargs):' % name]
+        if check:
+            lines.append('    if best <= %d or not path.startswith(%r, %d):'
+                         % (_lowest(node), node.label, pos))
+            lines.append('        return best, kwargs')
+        self._node(node, pos + len(node.label), lines, 1)
+        lines.append('    return best, kwargs\n')
+        self.functions[number] = '\n'.join(lines)
+        return name
+
+    def _route(self, order, u, lines, indent):
+        literal = _literal(u)
+        if literal is not None:
+            text, anchored = literal
+            if anchored:
+                test = 'path == %r or path == %r' % (text, text + '\n')
+            else:
+                test = 'path.startswith(%r)' % text
+            lines.append('%sif best > %d and (%s):' % (indent, order, test))
+            lines.append('%s    best = %d' % (indent, order))
+            lines.append('%s    kwargs = {}' % indent)
+            return
+        regex = '_route%d' % order
+        self.regexes.append('%s = _lazy(%r, %r)' % (regex, regex, u.pattern))
+        names = _converter_names(u)
+        if names:
+            self.converters.append((order, names))
+        lines.append('%sif best > %d:' % (indent, order))
+        lines.append('%s    m = %s(path)' % (indent, regex))
+        lines.append('%s    if m is not None:' % indent)
+        lines.append('%s        best = %d' % (indent, order))
+        lines.append('%s        kwargs = m.groupdict()' % indent)
+
+def _lowest(node):
+    ''' The lowest order of the routes in ``node``'s subtree '''
+    lowest = node.orders[0] if node.orders else None
+    for child in node.children.values():
+        order = _lowest(child)
+        if lowest is None or order < lowest:
+            lowest = order
+    return lowest
+
+def generate(mapper):
+    ''' Return the source of the dispatcher module for ``mapper``
+
+        :raises CodegenError: if ``mapper`` mounts other Mappers
+    '''
+    return _Generator(mapper).source()
+
+def load_source(source, name='surly_generated'):
+    ''' Build a module from the ``source`` returned by ``generate`` '''
+    module = types.ModuleType(name)
+    exec(compile(source, '<%s>' % name, 'exec'), module.__dict__)
+    return module
+
+def _describe(result, urls):
+    if result is None:
+        return 'no match'
+    return '%r with %r' % (urls[result[0]].name or urls[result[0]].pattern,
+                           result[1])
+
+def check(module, mapper, paths):
+    ''' Check that ``module`` resolves each of ``paths`` exactly as
+        ``mapper``'s dispatch index does, and reverses the names of the urls
+        matched to the same paths.
+
+        :raises CodegenError: describing the first difference
+    '''
+    if module.FINGERPRINT != table_cache.fingerprint(mapper):
+        raise CodegenError('The module was generated for another route '
+                           'table')
+    tree = PrefixTree(enumerate(mapper.urls))
+    urls = mapper.urls
+    for path in paths:
+        expected = tree.match(path)
+        if expected is not None:
+            expected = expected[0], expected[2]
+        got = module.resolve(path)
+        if got != expected:
+            raise CodegenError('%r: %s from the module, %s from the Mapper'
+                               % (path, _describe(got, urls),
+                                  _describe(expected, urls)))
+        if expected is None:
+            continue
+        u = urls[expected[0]]
+        kwargs = dict((str(key), value) for key, value in got[1].items())
+        if u.name and None not in kwargs.values():
+            reversed_path = module.reverse(u.name, **kwargs)
+            if reversed_path != mapper.reverse(u.name, **kwargs):
+                raise CodegenError('%r reverses to %r from the module'
+                                   % (u.name, reversed_path))
+
+def static_paths(mapper):
+    ''' The paths of the urls without groups, which ``write`` always
+        checks
+    '''
+    return [u.reverse_function({}) for u in mapper.urls
+            if not u.is_mount and not u.group_map]
+
+def write(mapper, path, samples=()):
+    ''' Generate the module for ``mapper``, check it on ``samples`` and on
+        ``static_paths``, and write it to ``path``.  The file is written to
+        a temporary name and renamed into place.
+    '''
+    source = generate(mapper)
+    check(load_source(source), mapper,
+          list(samples) + static_paths(mapper))
+    table_cache.write_atomically(path, source)
+
+class GeneratedDispatcher(object):
+    ''' Stands in for the ``PrefixTree`` of a whole route table, resolving
+        paths with a generated module.  Once urls are added or removed it
+        builds the tree and hands everything to it.
+    '''
+    def __init__(self, module, urls):
+        self.resolve = module.resolve
+        self.urls = list(urls)
+        self.tree = None
+
+    def _fall_back(self):
+        if self.tree is None:
+            self.tree = PrefixTree(enumerate(self.urls))
+            self.resolve = None
+        return self.tree
+
+    def insert(self, order, u):
+        self._fall_back().insert(order, u)
+
+    def remove(self, u):
+        return self._fall_back().remove(u)
+
+    def compile(self):
+        if self.tree is not None:
+            self.tree.compile()
+
+    def match(self, path, method=None, host=None):
+        resolve = self.resolve
+        if resolve is None:
+            return self.tree.match(path, method, host)
+        result = resolve(path)
+        if result is None:
+            return None
+        return result[0], self.urls[result[0]], result[1]
+
+def install(mapper, module):
+    ''' Load the compiled form of ``mapper``'s urls from ``module`` and
+        resolve paths with it
+
+        :raises CodegenError: if ``module`` was generated for another \
+        route table
+    '''
+    if mapper._mounts or module.FINGERPRINT != table_cache.fingerprint(mapper):
+        raise CodegenError('%s was generated for another route table'
+                           % getattr(module, '__name__', module))
+    for u, record in zip(mapper.urls, module.COMPILED):
+        py_pattern, group_map, prefix = record
+        u._load_compiled(py_pattern, dict(group_map), prefix)
+    mapper._dispatcher = GeneratedDispatcher(module, mapper.urls)
+
+def main(argv=None):
+    import argparse
+    from surly.classify import load_mapper
+    parser = argparse.ArgumentParser(
+        prog='python -m surly.codegen',
+        description='Write a dispatcher module specialized to a route '
+                    'table.')
+    parser.add_argument('mapper', help='the Mapper, as "module:attribute"')
+    parser.add_argument('output', help='the module file to write')
+    parser.add_argument('--samples',
+                        help='a file of paths, one per line, to check the '
+                             'module on besides the static paths')
+    args = parser.parse_args(argv)
+    mapper = load_mapper(args.mapper)
+    samples = []
+    if args.samples:
+        with open(args.samples) as f:
+            samples = [line.rstrip('\r\n') for line in f if line.strip()]
+    write(mapper, args.output, samples)
+
+if __name__ == '__main__':
+    main()
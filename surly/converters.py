@@ -0,0 +1,147 @@
+''' Typed path converters: ``<int:id>``, ``<slug:name>``, ``<uuid:key>``,
+    ``<str:name>`` and ``<path:rest>`` in url patterns.
+
+    Each converter is expanded into a named group holding its regex, so
+    the rest of surly (the reversers, the JS mapper, the dispatch index)
+    sees an ordinary pattern.  The url remembers its converters, and
+    ``Mapper.match`` returns the captured values converted: an ``int`` for
+    ``<int:id>``, a ``uuid.UUID`` for ``<uuid:key>``.
+
+    A route whose path segments are all literals or single-segment
+    converters is matched segment by segment (see
+    ``surly.dispatch._SegmentMatcher``): the path is split on "/" once and
+    each segment is checked by its converter's validator.
+
+    Converter regexes contain no braces, so patterns using them can still
+    be formatted with ``replacements``.
+'''
+import re
+
+class Converter(object):
+    ''' :ivar regex: the regex a value must match, without groups
+        :ivar to_python: turns a matched string into the value returned
+        :ivar validate: tests a whole path segment against ``regex``
+        :ivar segment: whether values are single path segments, i.e.
+            ``regex`` never matches "/"
+        :ivar safe: the characters left unescaped in values when reversing
+    '''
+    def __init__(self, regex, to_python=None, validate=None, segment=True,
+                 safe=''):
+        self.regex = regex
+        self.to_python = to_python
+        if validate is None:
+            validate = re.compile('(?:%s)\\Z' % regex).match
+        self.validate = validate
+        self.segment = segment
+        self.safe = safe
+
+def _uuid(value):
+    # uuid is slow to import, notably on Python 2, and seldom needed
+    import uuid
+    return uuid.UUID(value)
+
+def _charset_validator(chars):
+    chars = frozenset(chars)
+    def validate(segment):
+        return segment != '' and chars.issuperset(segment)
+    return validate
+
+_DIGITS = '0123456789'
+_SLUG = _DIGITS + '-_abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+#: The converters available in patterns, by name
+CONVERTERS = {
+    'int': Converter('[0-9]+', int, _charset_validator(_DIGITS)),
+    'slug': Converter('[-a-zA-Z0-9_]+', None, _charset_validator(_SLUG)),
+    'str': Converter('[^/]+', None, lambda segment: segment != ''),
+    # Spelled out rather than with {n} repeats, which replacements would
+    # take for fields.  Validated by the regex: it has no alternatives to
+    # backtrack into.
+    'uuid': Converter('-'.join('[0-9a-fA-F]' * n for n in (8, 4, 4, 4, 12)),
+                      _uuid),
+    # Reversed with its slashes kept, so that it matches again
+    'path': Converter('.+', None, segment=False, safe='/'),
+}
+
+def register_converter(name, regex, to_python=None, validate=None,
+                       segment=True, safe=''):
+    ''' Make ``<name:...>`` available in patterns.  ``validate``, if given,
+        must accept exactly the path segments which ``regex`` matches in
+        full; by default it is derived from ``regex``.  Pass
+        ``segment=False`` if ``regex`` can match "/".  The characters in
+        ``safe`` are not escaped in values when reversing.
+    '''
+    CONVERTERS[name] = Converter(regex, to_python, validate, segment, safe)
+
+_CONVERTER_RE = re.compile(r'<(\w+):(\w+)>')
+
+def expand(pattern):
+    ''' Replace the converters in ``pattern`` with named groups.  Returns
+        the new pattern and a dict of group name to ``Converter``.
+    '''
+    if '<' not in pattern:
+        return pattern, {}
+    converters = {}
+    def replace(found):
+        kind, name = found.groups()
+        try:
+            converter = CONVERTERS[kind]
+        except KeyError:
+            raise ValueError('Unknown converter %r in %r' % (kind, pattern))
+        converters[name] = converter
+        return '(?P<%s>%s)' % (name, converter.regex)
+    return _CONVERTER_RE.sub(replace, pattern), converters
+
+# A segment of pattern text which is a plain literal: no unescaped
+# metacharacters
+_LITERAL_SEGMENT = re.compile(r'(?:[^\\.^$*+?{}\[\]|()\x00]|\\[^A-Za-z0-9])*\Z')
+_UNESCAPE = re.compile(r'\\(.)')
+
+def segments(pattern, converters):
+    ''' Split ``pattern`` into one entry per path segment: the literal text
+        of the segment, or ``(name, validate)`` for a segment holding just
+        a converter.  ``None`` unless the whole pattern (anchored at its
+        end by "$") is made of such segments.
+    '''
+    if not converters or not pattern.endswith('$') or pattern.endswith('\\$'):
+        return None
+    body = pattern[:-1]
+    if body.startswith('^'):
+        body = body[1:]
+    # Stand-ins for the converter groups, whose regexes may hold a "/"
+    groups = {}
+    for name, converter in converters.items():
+        if not converter.segment:
+            continue
+        marker = '\x00%d\x00' % len(groups)
+        group = '(?P<%s>%s)' % (name, converter.regex)
+        if group in body:
+            body = body.replace(group, marker)
+            groups[marker] = (name, converter.validate)
+    result = []
+    for text in body.split('/'):
+        if text in groups:
+            result.append(groups[text])
+        elif _LITERAL_SEGMENT.match(text):
+            result.append(_UNESCAPE.sub(r'\1', text))
+        else:
+            return None
+    return tuple(result)
+
+def safe_fields(converters):
+    ''' The characters to leave unescaped in the values of each group whose
+        converter has any (see ``escape.escape_fields``)
+    '''
+    return dict((name, converter.safe)
+                for name, converter in converters.items() if converter.safe)
+
+def convert(kwargs, converters):
+    ''' Convert the values captured for the groups with converters, in
+        place
+    '''
+    for name, converter in converters.items():
+        if converter.to_python is not None:
+            value = kwargs.get(name)
+            if value is not None:
+                kwargs[name] = converter.to_python(value)
+    return kwargs
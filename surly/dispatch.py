@@ -0,0 +1,486 @@
+''' Forward dispatch: resolving a request path to the ``url`` which
+    handles it.
+
+    Routes are indexed in a radix tree keyed on the literal text each
+    pattern must start with, so only the routes whose prefix matches the
+    path are ever tried.  Within a tree node the routes are compiled into
+    a small number of combined regular expressions: each route becomes one
+    tagged branch of an alternation, so a single ``re.match`` call both
+    finds the first matching route and captures its arguments.  Routes
+    made only of literal and converter segments (see ``surly.converters``)
+    skip the regex and are matched segment by segment instead.  A Mapper
+    mounted with ``include()`` is one entry of the tree, which hands it the
+    rest of the path.
+'''
+import bisect
+import re
+import sys
+from array import array
+
+from surly.converters import convert
+
+# Python < 3.5 refuses to compile a pattern with more than 100 groups,
+# counting the implicit group 0, so on those versions the alternation is
+# split into several chunks.
+if sys.version_info < (3, 5):
+    MAX_GROUPS = 99
+else:
+    MAX_GROUPS = None
+
+_GLOBAL_FLAG_CHARS = 'aiLmsux'
+
+#: Passed to ``PrefixTree.match`` as the method, makes a mounted Mapper
+#: whose prefix the path starts with count as matching, with the mount as
+#: the url and ``None`` as the kwargs, without loading the Mapper
+PEEK = object()
+
+class RouteMatch(object):
+    ''' The result of a successful ``Mapper.match``.
+
+        :ivar url: the winning ``url`` object
+        :ivar kwargs: a dict of the named groups captured from the path
+    '''
+    def __init__(self, url, kwargs):
+        self.url = url
+        self.kwargs = kwargs
+
+    @property
+    def target(self):
+        return self.url.target
+
+    @property
+    def extra_args(self):
+        return self.url.extra_args
+
+    def __repr__(self):
+        return 'RouteMatch(%r, %r)' % (self.url.pattern, self.kwargs)
+
+def _rename_groups(re_str, rename):
+    ''' Rewrite every named group (and named backreference) in ``re_str``
+        using the mapping ``rename``.  Returns the rewritten pattern and
+        the number of capturing groups it contains.
+
+        Returns ``None`` if the pattern cannot safely be embedded in a
+        larger expression: numbered backreferences and global inline flags
+        both change meaning once the pattern is one branch among many.
+    '''
+    out = []
+    i = 0
+    n = len(re_str)
+    in_class = False
+    groups = 0
+    while i < n:
+        char = re_str[i]
+        if char == '\\':
+            if i + 1 < n and re_str[i + 1].isdigit() and not in_class:
+                if re_str[i + 1] != '0':
+                    return None
+            out.append(re_str[i:i + 2])
+            i += 2
+            continue
+        if in_class:
+            if char == ']':
+                in_class = False
+            out.append(char)
+            i += 1
+            continue
+        if char == '[':
+            in_class = True
+            out.append(char)
+            i += 1
+            # A leading ']' (or '^]') is a literal, not the end of the class
+            if i < n and re_str[i] == '^':
+                out.append('^')
+                i += 1
+            if i < n and re_str[i] == ']':
+                out.append(']')
+                i += 1
+            continue
+        if re_str.startswith('(?P<', i) or re_str.startswith('(?P=', i):
+            opener = re_str[i:i + 4]
+            closer = '>' if opener == '(?P<' else ')'
+            end = re_str.index(closer, i + 4)
+            name = re_str[i + 4:end]
+            out.append(opener + rename[name] + closer)
+            if opener == '(?P<':
+                groups += 1
+            i = end + 1
+            continue
+        if re_str.startswith('(?(', i):
+            end = re_str.index(')', i + 3)
+            name = re_str[i + 3:end]
+            if name not in rename:
+                return None
+            out.append('(?(' + rename[name] + ')')
+            i = end + 1
+            continue
+        if re_str.startswith('(?', i):
+            j = i + 2
+            while j < n and re_str[j] in _GLOBAL_FLAG_CHARS:
+                j += 1
+            if j > i + 2 and j < n and re_str[j] == ')':
+                return None
+        elif char == '(':
+            groups += 1
+        out.append(char)
+        i += 1
+    return ''.join(out), groups
+
+# Group maps as sorted tuples of items, one per distinct map: route tables
+# use few of them
+_group_maps = {}
+
+def _shared_items(group_map):
+    items = tuple(sorted(group_map.items()))
+    return _group_maps.setdefault(items, items)
+
+class _SingleMatcher(object):
+    ''' Matches one route with its own compiled regex.  Used for patterns
+        which cannot be combined with others.
+    '''
+    __slots__ = ('index', 'regex')
+
+    def __init__(self, index, url):
+        self.index = index
+        self.regex = url.regex
+
+    def match(self, path, method=None, host=None):
+        m = self.regex.match(path)
+        if m is None:
+            return None
+        return self.index, m.groupdict()
+
+class _MountMatcher(object):
+    ''' Matches the routes of a mounted Mapper (``mapper._Mount``), to which
+        it passes the path without the mount's prefix.  Returns the url
+        matched as well as the kwargs.
+    '''
+    __slots__ = ('index', 'mount', 'start')
+
+    def __init__(self, index, mount):
+        self.index = index
+        self.mount = mount
+        self.start = len(mount.literal_prefix)
+
+    def match(self, path, method=None, host=None):
+        if method is PEEK:
+            return self.index, None, self.mount
+        result = self.mount.mapper().match(path[self.start:], method, host)
+        if result is None:
+            return None
+        return self.index, result.kwargs, result.url
+
+class _AlternationMatcher(object):
+    ''' Matches a run of routes with one combined regex.  Each route is a
+        tagged branch ``(?P<_sN>...)``, and the branch which matched is the
+        last group to close, so ``m.lastindex`` identifies the route.
+
+        The routes are looked up by ``m.lastindex`` in two arrays: the
+        route's index, and its group map.  A route's groups are numbered
+        from its tag's group on, so the group map (shared by the routes
+        which have the same) is all that is needed to read them.
+    '''
+    __slots__ = ('regex', 'indexes', 'group_maps')
+
+    def __init__(self, branches):
+        ''' :param branches: a list of ``(tag, index, renamed_pattern,
+            group_map)`` tuples, where ``group_map`` pairs the index of each
+            group in the route's own pattern with its name
+        '''
+        self.regex = re.compile('|'.join('(?P<%s>%s)' % (tag, pattern)
+                                         for tag, index, pattern, group_map
+                                         in branches))
+        groupindex = self.regex.groupindex
+        self.indexes = array('l', [-1]) * (self.regex.groups + 1)
+        self.group_maps = [None] * (self.regex.groups + 1)
+        for tag, index, pattern, group_map in branches:
+            self.indexes[groupindex[tag]] = index
+            self.group_maps[groupindex[tag]] = group_map
+
+    def match(self, path, method=None, host=None):
+        m = self.regex.match(path)
+        if m is None:
+            return None
+        tag = m.lastindex
+        group = m.group
+        return self.indexes[tag], dict((name, group(tag + number))
+                                       for number, name
+                                       in self.group_maps[tag])
+
+class _SegmentMatcher(object):
+    ''' Matches a run of routes given as ``url.segments``.  The path is
+        split on "/" once; only the routes with as many segments are tried,
+        comparing the literal segments first and then validating the
+        converter segments, with no regex involved.
+    '''
+    __slots__ = ('routes',)
+
+    def __init__(self, entries):
+        ''' :param entries: a list of ``(index, segments)`` pairs
+        '''
+        self.routes = {}
+        for index, segments in entries:
+            literals = tuple((position, segment)
+                             for position, segment in enumerate(segments)
+                             if not isinstance(segment, tuple))
+            captures = tuple((position,) + segment
+                             for position, segment in enumerate(segments)
+                             if isinstance(segment, tuple))
+            self.routes.setdefault(len(segments), []).append(
+                (index, literals, captures))
+
+    def match(self, path, method=None, host=None):
+        parts = path.split('/')
+        routes = self.routes.get(len(parts))
+        if routes is None:
+            return None
+        # "$" also matches before a trailing newline, so a route failing on
+        # the whole path is retried without it, as its regex would be
+        if path[-1:] == '\n':
+            attempts = (parts, parts[:-1] + [parts[-1][:-1]])
+        else:
+            attempts = (parts,)
+        for index, literals, captures in routes:
+            for parts in attempts:
+                for position, literal in literals:
+                    if parts[position] != literal:
+                        break
+                else:
+                    kwargs = {}
+                    for position, name, validate in captures:
+                        value = parts[position]
+                        if not validate(value):
+                            break
+                        kwargs[name] = value
+                    else:
+                        return index, kwargs
+        return None
+
+class CombinedMatcher(object):
+    ''' First-match-wins matcher over an ordered list of ``url`` objects
+    '''
+    __slots__ = ('matchers',)
+
+    def __init__(self, urls):
+        self.matchers = []
+        pending = []
+        pending_groups = 0
+        segmented = []
+        for count, u in enumerate(urls):
+            if u.is_mount:
+                self._flush(pending)
+                pending, pending_groups = [], 0
+                if segmented:
+                    self.matchers.append(_SegmentMatcher(segmented))
+                    segmented = []
+                self.matchers.append(_MountMatcher(count, u))
+                continue
+            if u.converters and u.segments is not None:
+                self._flush(pending)
+                pending, pending_groups = [], 0
+                segmented.append((count, u.segments))
+                continue
+            if segmented:
+                self.matchers.append(_SegmentMatcher(segmented))
+                segmented = []
+            # group_map is index -> name; every group gets a name unique to
+            # this branch so that routes sharing group names can coexist.
+            tag = '_s%d' % count
+            rename = dict((name, '%s_%d' % (tag, index))
+                          for index, name in u.group_map.items())
+            renamed = _rename_groups(u.pattern, rename)
+            if renamed is not None:
+                pattern, groups = renamed
+                groups += 1
+                if MAX_GROUPS is not None and groups > MAX_GROUPS:
+                    renamed = None
+            if renamed is None:
+                self._flush(pending)
+                pending, pending_groups = [], 0
+                self.matchers.append(_SingleMatcher(count, u))
+                continue
+            if MAX_GROUPS is not None and pending_groups + groups > MAX_GROUPS:
+                self._flush(pending)
+                pending, pending_groups = [], 0
+            pending.append((tag, count, pattern, _shared_items(u.group_map)))
+            pending_groups += groups
+        self._flush(pending)
+        if segmented:
+            self.matchers.append(_SegmentMatcher(segmented))
+
+    def _flush(self, pending):
+        if pending:
+            self.matchers.append(_AlternationMatcher(pending))
+
+    def match(self, path, method=None, host=None):
+        ''' Return ``(index, kwargs)`` for the first route matching
+            ``path``, where ``index`` is the route's position in ``urls``,
+            or ``None``.  For a route of a mounted Mapper, which gets
+            ``method`` and ``host``, the url matched comes third.
+        '''
+        for matcher in self.matchers:
+            result = matcher.match(path, method, host)
+            if result is not None:
+                return result
+        return None
+
+class _Node(object):
+    ''' A radix tree node.  ``label`` is the text on the edge leading to
+        this node.  ``urls`` are the routes whose literal prefix ends exactly
+        here, kept sorted by their ``orders``, an array of the same length.
+    '''
+    __slots__ = ('label', 'children', 'orders', 'urls', 'matcher')
+
+    def __init__(self, label):
+        self.label = label
+        self.children = {}
+        self.orders = array('l')
+        self.urls = []
+        self.matcher = None
+
+    def compile(self):
+        self.matcher = CombinedMatcher(self.urls)
+        return self.matcher
+
+    def match(self, path, method=None, host=None):
+        matcher = self.matcher
+        if matcher is None:
+            matcher = self.compile()
+        result = matcher.match(path, method, host)
+        if result is None:
+            return None
+        order = self.orders[result[0]]
+        u = self.urls[result[0]]
+        if len(result) == 3:
+            # From a mounted Mapper, which converted the values itself
+            return order, result[2], result[1]
+        kwargs = result[1]
+        if u.converters:
+            convert(kwargs, u.converters)
+        return order, u, kwargs
+
+class PrefixTree(object):
+    ''' Radix tree dispatch index over the leading literal run of every
+        route's pattern (``url.literal_prefix``).
+
+        Only the nodes along the path being resolved are visited, and only
+        the routes stored on those nodes are ever matched, so the cost of a
+        lookup depends on the length of the path rather than on the number
+        of routes.  Each node keeps its routes in their original order, and
+        when routes on several nodes match, the one which came first in the
+        route table wins.
+    '''
+    def __init__(self, entries=()):
+        ''' :param entries: an iterable of ``(order, url)`` pairs
+        '''
+        self.root = _Node('')
+        for order, u in entries:
+            self.insert(order, u)
+
+    def insert(self, order, u):
+        node = self.root
+        key = u.literal_prefix
+        pos = 0
+        while pos < len(key):
+            child = node.children.get(key[pos])
+            if child is None:
+                child = _Node(key[pos:])
+                node.children[key[pos]] = child
+                node = child
+                break
+            label = child.label
+            common = 0
+            limit = min(len(label), len(key) - pos)
+            while common < limit and label[common] == key[pos + common]:
+                common += 1
+            if common < len(label):
+                # Split the edge, moving the existing child below a new
+                # node holding the shared part of the label.
+                middle = _Node(label[:common])
+                child.label = label[common:]
+                middle.children[child.label[0]] = child
+                node.children[key[pos]] = middle
+                child = middle
+            node = child
+            pos += common
+        orders = node.orders
+        if orders and order < orders[-1]:
+            index = bisect.bisect(orders, order)
+            orders.insert(index, order)
+            node.urls.insert(index, u)
+        else:
+            orders.append(order)
+            node.urls.append(u)
+        node.matcher = None
+
+    def remove(self, u):
+        ''' Remove ``u``.  Only the node holding it is recompiled, on its
+            next use.  Returns whether ``u`` was found.
+        '''
+        node = self.root
+        key = u.literal_prefix
+        pos = 0
+        while pos < len(key):
+            child = node.children.get(key[pos])
+            if child is None or not key.startswith(child.label, pos):
+                return False
+            pos += len(child.label)
+            node = child
+        for index, v in enumerate(node.urls):
+            if v is u:
+                del node.orders[index]
+                del node.urls[index]
+                node.matcher = None
+                return True
+        return False
+
+    def compile(self):
+        ''' Build the matchers of every node now rather than on first use
+        '''
+        pending = [self.root]
+        while pending:
+            node = pending.pop()
+            if node.urls and node.matcher is None:
+                node.compile()
+            pending.extend(node.children.values())
+
+    def match(self, path, method=None, host=None, best=None):
+        ''' Return ``(order, url, kwargs)`` for the first route matching
+            ``path``, or ``None``.  ``method`` and ``host`` are only passed
+            on to mounted Mappers.  ``best``, if given, is the result of
+            another tree, returned unless a route of this one comes first:
+            routes after it are not even tried.
+        '''
+        node = self.root
+        pos = 0
+        while True:
+            orders = node.orders
+            if orders and (best is None or orders[0] < best[0]):
+                result = node.match(path, method, host)
+                if result is not None and (best is None
+                                           or result[0] < best[0]):
+                    best = result
+            child = node.children.get(path[pos:pos + 1])
+            if child is None or not path.startswith(child.label, pos):
+                return best
+            pos += len(child.label)
+            node = child
+
+class SplitTree(object):
+    ''' Resolves paths as one ``PrefixTree`` would over the routes of two
+        trees holding different routes: ``shared``, which several
+        ``SplitTree`` objects may hold, and ``own``.
+    '''
+    __slots__ = ('shared', 'own')
+
+    def __init__(self, shared, own):
+        self.shared = shared
+        self.own = own
+
+    def compile(self):
+        self.shared.compile()
+        self.own.compile()
+
+    def match(self, path, method=None, host=None):
+        return self.own.match(path, method, host,
+                              self.shared.match(path, method, host))
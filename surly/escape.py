@@ -0,0 +1,95 @@
+''' Escaping of values interpolated into reversed URLs.
+'''
+try:
+    from urllib import quote
+except ImportError:
+    # Python 3
+    from urllib.parse import quote
+
+_text = type(u'')
+
+try:
+    _MEMO_TYPES = frozenset([bytes, _text, int, long])
+except NameError:
+    # Python 3
+    _MEMO_TYPES = frozenset([bytes, _text, int])
+
+class Escaped(str):
+    ''' A value which is escaped already: ``url_escape`` returns it as is '''
+    __slots__ = ()
+
+def url_escape(value, safe=''):
+    ''' Convert ``value`` to a string if necessary, encode it as utf8 and
+        url-escape it.  Every reserved character, including "/", is escaped,
+        except those in ``safe``.
+    '''
+    if type(value) is int:
+        # Digits never need escaping
+        return str(value)
+    if isinstance(value, Escaped):
+        return str(value)
+    if not isinstance(value, (bytes, _text)):
+        value = _text(value)
+    if isinstance(value, _text):
+        value = value.encode('utf8')
+    return str(quote(value, safe=safe))
+
+def escape_fields(kwargs, safe):
+    ''' Return a copy of ``kwargs`` in which the values named in ``safe``, a
+        dict of name to the characters to leave unescaped in that value,
+        are escaped already (as ``Escaped`` strings)
+    '''
+    kwargs = dict(kwargs)
+    for name, characters in safe.items():
+        if name in kwargs:
+            kwargs[name] = Escaped(url_escape(kwargs[name], characters))
+    return kwargs
+
+class EscapeMemo(object):
+    ''' A bounded memo of ``url_escape`` results.  IDs and slugs repeat
+        heavily within a request, and a dict lookup is much cheaper than
+        escaping the value again.
+
+        Entries live in two generations of at most ``maxsize / 2`` each.
+        New entries go into the young generation.  When it is full, it
+        becomes the old generation and the previous old generation is
+        dropped.  A hit in the old generation promotes the entry back into
+        the young one, so the memo approximates LRU eviction with plain
+        dict operations.  It needs no lock: a race between threads can at
+        worst lose an entry, never return a wrong one.
+
+        Only ``str``, ``unicode`` and ``int`` values are memoized, so values
+        which are equal but escape differently (``True`` and ``1``, say)
+        never share an entry.
+    '''
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.clear()
+
+    def clear(self):
+        self._young = {}
+        self._old = {}
+
+    def escape(self, value):
+        ''' Return ``url_escape(value)``, from the memo if possible '''
+        if type(value) not in _MEMO_TYPES:
+            return url_escape(value)
+        try:
+            return self._young[value]
+        except KeyError:
+            pass
+        escaped = self._old.get(value)
+        if escaped is None:
+            escaped = url_escape(value)
+        young = self._young
+        if len(young) >= self.maxsize // 2:
+            self._old = young
+            self._young = young = {}
+        young[value] = escaped
+        return escaped
+
+    def __len__(self):
+        return len(self._young) + len(self._old)
+
+#: The memo used by ``url.reverse`` and ``Mapper.reverse``
+memo = EscapeMemo()
@@ -0,0 +1,252 @@
+''' Per-route instrumentation for a ``Mapper`` (see ``Mapper.instrument``).
+
+    Instrumenting a mapper shadows its ``match``, ``reverse`` and
+    ``reverse_many`` methods with wrappers stored on the instance, and
+    removing the instrumentation deletes them again.  A mapper which is not
+    instrumented therefore runs exactly the same code as before, at no
+    cost at all.
+
+    Every call is counted, per route.  Timing a call costs more than the
+    count, so only one call in ``1 / sample_rate`` is timed.  Resolution
+    latencies go into a histogram with fixed bucket bounds for each route.
+    Between timed calls, ``match`` only appends the matched url to a list,
+    which the timed call then counts into ``matches``.  Counters are plain
+    dicts, and are not locked: concurrent threads may occasionally lose an
+    increment.
+'''
+import bisect
+import threading
+import time
+
+from surly import escape
+from surly.dispatch import RouteMatch
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    # Python 2
+    clock = time.time
+
+UNMATCHED = '<unmatched>'
+
+#: Upper bounds, in seconds, of the latency histogram buckets.  A last
+#: bucket holds everything slower.
+DEFAULT_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5,
+                   1e-4, 2.5e-4, 5e-4, 1e-3, 1e-2)
+
+def route_key(u):
+    ''' The key under which calls resolving to ``u`` (or to nothing, when
+        ``u`` is ``None``) are reported
+    '''
+    if u is None:
+        return UNMATCHED
+    return u.name or u.pattern
+
+def _by_route(counters):
+    # Unnamed urls with the same pattern share a key, so values are added
+    out = {}
+    for u, value in list(counters.items()):
+        key = route_key(u)
+        previous = out.get(key)
+        if isinstance(value, list):
+            if previous is None:
+                previous = [0] * len(value)
+            value = [a + b for a, b in zip(previous, value)]
+        elif previous is not None:
+            value += previous
+        out[key] = value
+    return out
+
+class Instrumentation(object):
+    ''' Counters and latency histograms for one mapper.
+
+        :param sample_rate: the fraction of ``match`` calls which are timed
+        :param buckets: increasing latency bucket bounds, in seconds
+        :param hook: a callable which is passed ``reset()`` every
+            ``interval`` seconds, to export the counters.  It is called
+            from whichever thread makes the timed call which finds the
+            interval has passed.
+    '''
+    def __init__(self, mapper, sample_rate=0.01, buckets=DEFAULT_BUCKETS,
+                 hook=None, interval=60.0):
+        if not 0 < sample_rate <= 1:
+            raise ValueError('sample_rate must be in (0, 1]: %r'
+                             % sample_rate)
+        self.mapper = mapper
+        self.sample_rate = sample_rate
+        self.buckets = tuple(buckets)
+        self.hook = hook
+        self.interval = interval
+        self._every = int(round(1.0 / sample_rate))
+        # The urls (or None) of the match calls not yet counted, see _fold
+        self._pending = []
+        self._fold_lock = threading.Lock()
+        self._clear()
+        self._next_export = None
+        if hook is not None:
+            self._next_export = time.time() + interval
+
+    def _clear(self):
+        # Emptied in place, as the instrumented match appends to it
+        del self._pending[:]
+        self.matches = {}
+        self.reverses = {}
+        self.latencies = {}
+        self.since = time.time()
+
+    def install(self):
+        ''' Shadow the mapper's methods with instrumented ones '''
+        mapper = self.mapper
+        cls = type(mapper)
+        match = cls.match.__get__(mapper, cls)
+        reverse = cls.reverse.__get__(mapper, cls)
+        reverse_many = cls.reverse_many.__get__(mapper, cls)
+        reverse_patterns = mapper.reverse_patterns
+        memo_escape = escape.memo.escape
+        from surly.mapper import _escape_safe
+        record = self._record
+        fold = self._fold
+        pending = self._pending
+        append = pending.append
+        untimed = self._every - 1
+        bucket_key = mapper._bucket_key
+        get_dispatcher = mapper._get_dispatcher
+
+        # Counters are keyed by url (or None) here, and only turned into
+        # route keys by snapshot().
+        def timed_match(path, method, host):
+            start = clock()
+            result = match(path, method, host)
+            elapsed = clock() - start
+            append(result and result.url)
+            fold()
+            record(result, elapsed)
+            return result
+
+        def instrumented_match(path, method=None, host=None):
+            if len(pending) >= untimed:
+                return timed_match(path, method, host)
+            # Mapper.match without a cache, inlined to keep the overhead
+            # down
+            key = None
+            if method is not None or host is not None:
+                key = bucket_key(method, host)
+            found = get_dispatcher(key).match(path, method, host)
+            if found is None:
+                append(None)
+                return None
+            append(found[1])
+            return RouteMatch(found[1], found[2])
+
+        def instrumented_cached_match(path, method=None, host=None):
+            if len(pending) >= untimed:
+                return timed_match(path, method, host)
+            result = match(path, method, host)
+            append(result and result.url)
+            return result
+
+        def instrumented_reverse(name, _escape=True, _absolute=False,
+                                 _scheme='http', **kwargs):
+            # Mapper.reverse, inlined to keep the overhead down
+            u = reverse_patterns.get(name)
+            if u is None:
+                # Unknown, or in a mounted Mapper
+                link = reverse(name, _escape, _absolute, _scheme, **kwargs)
+                u = mapper._find_mounted(name)[0]
+                reverses = self.reverses
+                reverses[u] = reverses.get(u, 0) + 1
+                return link
+            reverses = self.reverses
+            reverses[u] = reverses.get(u, 0) + 1
+            if _absolute:
+                return u.reverse(_escape, _absolute, _scheme, **kwargs)
+            if _escape:
+                return u.reverse_function(_escape_safe(u, kwargs),
+                                          memo_escape)
+            return u.reverse_function(kwargs)
+
+        def count_links(u, links):
+            for link in links:
+                reverses = self.reverses
+                reverses[u] = reverses.get(u, 0) + 1
+                yield link
+
+        def instrumented_reverse_many(name, kwargs_iterable, _escape=True,
+                                      _absolute=False, _scheme='http'):
+            # reverse_many checks the name before returning
+            links = reverse_many(name, kwargs_iterable, _escape, _absolute,
+                                 _scheme)
+            u = reverse_patterns.get(name)
+            if u is None:
+                u = mapper._find_mounted(name)[0]
+            return count_links(u, links)
+
+        if mapper._cache is None:
+            mapper.match = instrumented_match
+        else:
+            mapper.match = instrumented_cached_match
+        mapper.reverse = instrumented_reverse
+        mapper.reverse_many = instrumented_reverse_many
+
+    def uninstall(self):
+        ''' Restore the mapper's own methods '''
+        mapper = self.mapper
+        for name in ('match', 'reverse', 'reverse_many'):
+            mapper.__dict__.pop(name, None)
+
+    def _fold(self):
+        ''' Count the urls appended to ``_pending`` into ``matches`` '''
+        with self._fold_lock:
+            pending = self._pending
+            done = len(pending)
+            matches = self.matches
+            for u in pending[:done]:
+                matches[u] = matches.get(u, 0) + 1
+            # Calls made meanwhile have appended after these
+            del pending[:done]
+
+    def _record(self, result, elapsed):
+        u = result and result.url
+        histogram = self.latencies.get(u)
+        if histogram is None:
+            histogram = self.latencies[u] = [0] * (len(self.buckets) + 1)
+        histogram[bisect.bisect_left(self.buckets, elapsed)] += 1
+        if self._next_export is not None:
+            now = time.time()
+            if now >= self._next_export:
+                self._next_export = now + self.interval
+                self.export()
+
+    def snapshot(self):
+        ''' Return a copy of the counters as a dict of plain data:
+
+            * ``matches``: route key (name, or pattern for unnamed urls) to
+              number of ``match`` calls which resolved to it, with
+              ``'<unmatched>'`` for the calls which resolved to nothing
+            * ``reverses``: route name to number of URLs reversed
+            * ``latencies``: route key to a list of counts, one per bucket
+              in ``buckets`` plus one for anything slower
+            * ``buckets``, ``sample_rate``: as configured
+            * ``since``, ``until``: the time span covered, as timestamps
+        '''
+        self._fold()
+        return {
+            'matches': _by_route(self.matches),
+            'reverses': _by_route(self.reverses),
+            'latencies': _by_route(self.latencies),
+            'buckets': list(self.buckets),
+            'sample_rate': self.sample_rate,
+            'since': self.since,
+            'until': time.time(),
+        }
+
+    def reset(self):
+        ''' Return a ``snapshot()`` and zero the counters '''
+        snapshot = self.snapshot()
+        self._clear()
+        return snapshot
+
+    def export(self):
+        ''' Pass ``reset()`` to the hook now '''
+        if self.hook is not None:
+            self.hook(self.reset())
@@ -0,0 +1,292 @@
+''' Generation of the JavaScript reverse mapper (see ``Mapper.js_mapper``).
+
+    Both forms are built from lists of parts joined once, so generation is
+    linear in the size of the output.  The minified form also stores the
+    literal prefixes which several routes share (typically the prefixes
+    given to ``include()``) once, in variables, instead of repeating them in
+    every route.  The chunked form splits the routes into one file per
+    top-level ``include()``, loaded on demand.
+'''
+import hashlib
+import json
+import re
+import string
+
+from surly.re_parse import JavascriptReverser
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_$][\w$]*$')
+
+# Prefixes shorter than this cost more to reference than to repeat
+MIN_SHARED_PREFIX = 4
+
+class _Mounted(object):
+    ''' A url of a mounted Mapper, as reversed through the Mapper mounting
+        it: its paths start with ``prefix``
+    '''
+    def __init__(self, u, prefix):
+        self.py_pattern = (prefix.replace('{', '{{').replace('}', '}}')
+                           + u.py_pattern)
+
+    @property
+    def js_pattern(self):
+        return js_from_template(self.py_pattern)
+
+def _routes(mapper):
+    ''' ``(name, url, section)`` for every name ``mapper`` reverses, those
+        of mounted Mappers included (see ``Mapper._named_routes``)
+    '''
+    return [(name, _Mounted(u, prefix) if prefix else u, section)
+            for name, u, prefix, section in mapper._named_routes()]
+
+def mapper_source(mapper, var_name):
+    ''' The readable form of the mapper: each route's ``js_pattern`` in a
+        mapping keyed by name.
+    '''
+    parts = ['%s = function(name, args){' % var_name, 'var mapping = {']
+    routes = [(name, u) for name, u, section in _routes(mapper)]
+    for count, (name, u) in enumerate(routes):
+        if count != 0:
+            parts.append(',')
+        parts.append('"%s":%s' % (name, u.js_pattern))
+    parts.append('};') # end mapping
+    parts.append('return mapping[name](args);')
+    parts.append('};') # end function
+    return ''.join(parts)
+
+_MAPPER_END = '};return mapping[name](args);};'
+
+def with_route(source, name, u):
+    ''' ``source`` from ``mapper_source`` with a route added to the end of
+        its mapping
+    '''
+    head = source[:-len(_MAPPER_END)]
+    separator = '' if head.endswith('{') else ','
+    return '%s%s"%s":%s%s' % (head, separator, name, u.js_pattern,
+                              _MAPPER_END)
+
+def without_route(source, name, u):
+    ''' ``source`` from ``mapper_source`` with a route taken out of its
+        mapping
+    '''
+    entry = '"%s":%s' % (name, u.js_pattern)
+    start = source.find(',' + entry)
+    if start != -1:
+        return source[:start] + source[start + 1 + len(entry):]
+    # The first route: drop the comma after it instead, if any
+    start = source.index('{' + entry) + 1
+    end = start + len(entry)
+    if source.startswith(',', end):
+        end += 1
+    return source[:start] + source[end:]
+
+def js_from_template(template):
+    ''' Build the JS function ``reverse_template_js`` returns from the
+        python format string ``reverse_template`` returns for the same
+        pattern, without parsing the pattern again
+    '''
+    reverser = JavascriptReverser()
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        for char in literal:
+            reverser.add_literal(char)
+        if field is not None:
+            reverser.add_named_group(field)
+    return reverser.value()
+
+def _template_parts(template):
+    ''' Split a python format string from ``reverse_template`` into a list
+        of ``(literal, field)`` pairs
+    '''
+    return [(literal, field) for literal, field, spec, conversion
+            in string.Formatter().parse(template)]
+
+def _candidate_prefixes(literal):
+    ''' The prefixes of ``literal`` which end just after a "/", longest
+        first, plus ``literal`` itself
+    '''
+    candidates = [literal]
+    end = literal.rfind('/', 0, len(literal) - 1)
+    while end > 0:
+        candidates.append(literal[:end + 1])
+        end = literal.rfind('/', 0, end)
+    return candidates
+
+def _shared_prefixes(literals):
+    ''' Choose the prefixes worth storing once.  Returns a dict mapping
+        each chosen prefix to the longest chosen prefix it extends (or
+        ``None``), and a dict mapping each literal to the prefix it uses.
+    '''
+    counts = {}
+    for literal in literals:
+        for candidate in _candidate_prefixes(literal):
+            counts[candidate] = counts.get(candidate, 0) + 1
+
+    def best(literal, shorter_than):
+        for candidate in _candidate_prefixes(literal):
+            if (len(candidate) < shorter_than
+                    and len(candidate) >= MIN_SHARED_PREFIX
+                    and counts[candidate] > 1):
+                return candidate
+        return None
+
+    uses = {}
+    for literal in literals:
+        prefix = best(literal, len(literal) + 1)
+        if prefix is not None:
+            uses[literal] = prefix
+    chosen = {}
+    pending = list(set(uses.values()))
+    while pending:
+        prefix = pending.pop()
+        if prefix in chosen:
+            continue
+        parent = best(prefix, len(prefix))
+        chosen[prefix] = parent
+        if parent is not None:
+            pending.append(parent)
+    # A prefix only extended by one other prefix, and used by no route
+    # directly, is not worth a variable of its own.
+    direct = set(uses.values())
+    children = {}
+    for prefix, parent in chosen.items():
+        if parent is not None:
+            children.setdefault(parent, []).append(prefix)
+    for prefix in sorted(chosen, key=len):
+        if prefix not in direct and len(children.get(prefix, ())) == 1:
+            child = children[prefix][0]
+            parent = chosen.pop(prefix)
+            chosen[child] = parent
+            if parent is not None:
+                siblings = children[parent]
+                siblings[siblings.index(prefix)] = child
+    return chosen, uses
+
+def _minified_table(routes):
+    ''' Build the minified mapping for ``routes``, a list of ``(name, url)``
+        pairs.  Returns the prefix variable declarations (possibly empty)
+        and the object literal mapping each name to its function.
+    '''
+    routes = [(name, _template_parts(u.py_pattern)) for name, u in routes]
+    literals = [parts[0][0] for name, parts in routes if parts and parts[0][0]]
+    chosen, uses = _shared_prefixes(literals)
+
+    variables = {}
+    definitions = []
+    for prefix in sorted(chosen, key=lambda prefix: (len(prefix), prefix)):
+        parent = chosen[prefix]
+        variable = 'p%d' % len(variables)
+        if parent is None:
+            value = json.dumps(prefix)
+        else:
+            value = '%s+%s' % (variables[parent],
+                               json.dumps(prefix[len(parent):]))
+        variables[prefix] = variable
+        definitions.append('%s=%s' % (variable, value))
+    declarations = ''
+    if definitions:
+        declarations = 'var %s;' % ','.join(definitions)
+
+    out = ['{']
+    for count, (name, parts) in enumerate(routes):
+        if count != 0:
+            out.append(',')
+        terms = []
+        for index, (literal, field) in enumerate(parts):
+            if index == 0 and literal in uses:
+                prefix = uses[literal]
+                terms.append(variables[prefix])
+                literal = literal[len(prefix):]
+            if literal:
+                terms.append(json.dumps(literal))
+            if field is not None:
+                if _IDENTIFIER.match(field):
+                    terms.append('f.' + field)
+                else:
+                    terms.append('f[%s]' % json.dumps(field))
+        if not terms or terms[0].startswith('f'):
+            # Make sure the result is a string concatenation
+            terms.insert(0, '""')
+        out.append('%s:function(f){return %s}'
+                   % (json.dumps(name), '+'.join(terms)))
+    out.append('}')
+    return declarations, ''.join(out)
+
+def minified_source(mapper, var_name):
+    ''' The minified form of the mapper.  Routes are emitted in name order,
+        so the output depends only on the route table.
+    '''
+    declarations, table = _minified_table(
+        sorted((name, u) for name, u, section in _routes(mapper)))
+    return ''.join(['%s=(function(){' % var_name, declarations,
+                    'var m=', table,
+                    ';return function(n,a){return m[n](a)}})();'])
+
+# The loader: ``m`` holds the loaded routes, ``c`` the chunk URLs and ``n``
+# the chunk index of every route not yet loaded, built from ``s``, the
+# list of names in each chunk.  ``l[i]`` is 1 once chunk ``i`` has run, or
+# the callbacks waiting for it while its script tag loads.  Chunks call
+# ``register`` themselves.  Reversing a name whose chunk is not loaded
+# throws rather than blocking: ``prefetch(name, cb)`` or ``load(name)``,
+# which returns a Promise, must have loaded it first.
+_LOADER = (
+    '%(var)s=(function(){%(declarations)s'
+    'var m=%(table)s,c=%(urls)s,s=%(names)s,n={},l={},i,j;'
+    'for(i=0;i<s.length;i++)for(j=0;j<s[i].length;j++)n[s[i][j]]=i;'
+    'function r(o){for(var k in o)m[k]=o[k]}'
+    'function f(name,args){var i=n[name];'
+    'if(!(name in m)&&i!==undefined)throw new Error("surly: "+name+'
+    '" is in "+c[i]+", which is not loaded; use %(var)s.prefetch or '
+    '%(var)s.load first");'
+    'return m[name](args)}'
+    'function p(name,cb){var i=n[name],w=l[i],t;'
+    'if(i===undefined||w===1){if(cb)cb(null);return}'
+    'if(!w){w=l[i]=[];t=document.createElement("script");'
+    't.src=c[i];t.async=true;'
+    't.onload=t.onerror=function(v){var e=null,k;'
+    'if(v.type==="load")l[i]=1;'
+    'else{l[i]=0;e=new Error("surly: cannot load "+c[i])}'
+    'for(k=0;k<w.length;k++)w[k](e)};'
+    'document.head.appendChild(t)}'
+    'if(cb)w.push(cb)}'
+    'f.register=r;f.prefetch=p;'
+    'f.load=function(name){return new Promise(function(y,e){'
+    'p(name,function(v){if(v)e(v);else y()})})};'
+    'return f})();')
+
+def chunked_source(mapper, var_name, base_url=''):
+    ''' The mapper split into one chunk per top-level ``include()`` (see
+        ``Mapper.js_chunks``).  Returns ``(loader, chunks)``.
+    '''
+    main = []
+    sections = {}
+    for name, u, section in sorted(_routes(mapper), key=lambda r: r[0]):
+        if section is None:
+            main.append((name, u))
+        else:
+            sections.setdefault(section, []).append((name, u))
+
+    chunks = {}
+    urls = []
+    names = []
+    for section in sorted(sections):
+        declarations, table = _minified_table(sections[section])
+        source = '(function(){%s%s.register(%s)})();' % (declarations,
+                                                         var_name, table)
+        filename = 'surly-%s.js' % content_hash(source)[:16]
+        chunks[filename] = source
+        urls.append(base_url + filename)
+        names.append([name for name, u in sections[section]])
+
+    declarations, table = _minified_table(main)
+    loader = _LOADER % {'var': var_name, 'declarations': declarations,
+                        'table': table,
+                        'urls': json.dumps(urls, separators=(',', ':')),
+                        'names': json.dumps(names, separators=(',', ':'))}
+    return loader, chunks
+
+def content_hash(source):
+    ''' A stable hex digest of generated JS, for ETags and cache-busting
+        file names
+    '''
+    if not isinstance(source, bytes):
+        source = source.encode('utf8')
+    return hashlib.sha1(source).hexdigest()
@@ -1,103 +1,1230 @@
-from surly.re_parse import reverse_template, reverse_template_js, reverse_group_map
+from surly.re_parse import compile_pattern, reverse_function, share
+from surly.dispatch import PrefixTree, SplitTree, RouteMatch, PEEK
+from surly.cache import LRUCache
+from surly import escape
+from surly import converters as _converters
+from array import array
+import copy
+import re
+import threading
+import weakref
 
 class MapperError(Exception):
     pass
 
+_text = type(u'')
+
+def _normalize_methods(methods):
+    if methods is None:
+        return None
+    if isinstance(methods, (str, _text)):
+        methods = [methods]
+    methods = frozenset(method.upper() for method in methods)
+    if 'GET' in methods:
+        # A HEAD request is answered like a GET
+        methods |= frozenset(['HEAD'])
+    return methods
+
+def _normalize_host(host):
+    ''' Lower-case ``host`` and drop its port, if any '''
+    host = host.lower()
+    if host.startswith('['):
+        # An IPv6 address
+        return host[:host.find(']') + 1] or host
+    return host.partition(':')[0]
+
+def _merge_constraints(methods, host, inner_methods, inner_host, what):
+    ''' Combine an include's constraints with those of something in it.
+        Methods are intersected; hosts must agree.
+    '''
+    if host is None:
+        host = inner_host
+    elif inner_host is not None and inner_host != host:
+        raise MapperError('%s is bound to host %s inside an include() for '
+                          'host %s' % (what, inner_host, host))
+    if methods is None:
+        methods = inner_methods
+    elif inner_methods is not None:
+        methods = methods & inner_methods
+        if not methods:
+            raise MapperError('%s allows none of the methods of the '
+                              'include() it is in' % what)
+    return methods, host
+
+# A pattern which only matches some literal text, after an optional "^"
+_LITERAL = re.compile(r'\^?((?:[^\\.^$*+?{}\[\]|()]|\\[^A-Za-z0-9])*)\Z')
+_UNESCAPE = re.compile(r'\\(.)')
+
+# Shared by the urls without converters or groups
+_EMPTY = {}
+
+def _share_group_map(group_map):
+    if not group_map:
+        return _EMPTY
+    return dict((index, share(name)) for index, name in group_map.items())
+
+def _base_url(scheme, host, u):
+    ''' ``scheme://host``, for the URL of ``u`` '''
+    if host is None:
+        raise MapperError('url %r is not bound to a host'
+                          % (u.name or u.pattern))
+    return '%s://%s' % (scheme, host)
+
+def _escape_safe(u, kwargs):
+    ''' ``kwargs``, with the values of ``u``'s groups whose converter keeps
+        some characters unescaped escaped already
+    '''
+    if u.converters:
+        safe = _converters.safe_fields(u.converters)
+        if safe:
+            return escape.escape_fields(kwargs, safe)
+    return kwargs
+
+def _allows(u, method, host):
+    return ((host is None or u.host is None or u.host == host)
+            and (method is None or u.methods is None or method in u.methods))
+
+def _restricted(u):
+    return u.methods is not None or u.host is not None
+
+# The key of the shared dispatch index in Mapper._trees
+_SHARED = 'shared'
+
+def _belongs(u, key):
+    ''' Whether the dispatch index for ``key`` (see ``Mapper._trees``)
+        holds ``u``
+    '''
+    if key is None:
+        return True
+    if key is _SHARED:
+        return not _restricted(u)
+    host, method = key
+    return _restricted(u) and _allows(u, method, host)
+
 class Mapper(object):
     ''' The mapper is the framework-agnostic way of defining 
         URL mappings.  
     '''
-    def __init__(self, urls, replacements={}, prefix=''):
+    #: Whether this is a snapshot made by ``freeze``
+    frozen = False
+
+    def __init__(self, urls, replacements=None, prefix='', cache_size=None,
+                 table_cache=None, profile=None, generated=None,
+                 lazy=False):
         ''' :param urls: a list of ``url`` objects.  See ``url`` \
             for details
+            :param cache_size: if given, ``match`` results are kept in an \
+            LRU cache of at most this many paths
+            :param table_cache: path of a file holding the compiled form \
+            of this route table (see ``surly.table_cache``).  It is loaded \
+            when it matches ``urls`` and ``replacements``, and rewritten \
+            otherwise.
+            :param profile: path of a JSON file of hit counts per route. \
+            The urls are reordered with ``reorder`` accordingly.
+            :param generated: a module written by ``surly.codegen`` for \
+            this route table, or its name.  The urls load their compiled \
+            form from it, and it resolves paths for requests not \
+            partitioned by method or host.
+            :param lazy: if true, each url is compiled the first time it \
+            is reversed or matched rather than here, so building a Mapper \
+            only to reverse a few names stays cheap.  Errors in a pattern \
+            are then only raised on its first use.  Ignored with \
+            ``generated`` or ``table_cache``.
         '''
-        self.replacements = replacements
+        self.replacements = dict(replacements or {})
         self.urls = []
         self.reverse_patterns = {}
+        # name -> prefix of the outermost include() the url came from
+        self._sections = {}
+        # The hosts and methods which some url is restricted to
+        self._hosts = set()
+        self._methods = set()
+        self._dispatcher = None
+        # The dispatch index of the urls restricted to no host or method,
+        # which the buckets share
+        self._shared = None
+        # Dispatch indexes and static routes for each (host, method)
+        # bucket, see _bucket_key.  Each bucket's own index only holds the
+        # restricted urls which apply to it.
+        self._buckets = {}
+        self._statics = {}
+        # bucket key -> paths of urls without groups which do not resolve
+        # to a url capturing nothing, see _static_routes
+        self._shadowed = {}
+        # Above every order in the dispatch indexes, see add
+        self._order_end = 0
+        # The order each url has in the dispatch indexes, in step with
+        # urls, or None while that is just its position (until a remove)
+        self._orders = None
+        # namespace -> _Mount, and name -> (url, prefix) for the names
+        # found in mounted Mappers, see _find_mounted
+        self._namespaces = {}
+        self._mounted_names = {}
+        # The Mappers which mount this one, whose caches hold its results
+        self._parents = weakref.WeakSet()
+        # How many urls are mounts
+        self._mounts = 0
+        self._js_cache = {}
+        self._cache = None
+        self.instrumentation = None
+        if cache_size is not None:
+            self._cache = LRUCache(cache_size)
         self._add_urls(urls, prefix=prefix)
+        if generated is not None:
+            from surly import codegen
+            if isinstance(generated, (str, _text)):
+                import importlib
+                generated = importlib.import_module(generated)
+            codegen.install(self, generated)
+        elif table_cache is not None:
+            from surly import table_cache as table_cache_module
+            table_cache_module.load_or_build(self, table_cache)
+        elif not lazy:
+            for u in self.urls:
+                u._ensure_compiled()
+        if profile is not None:
+            from surly.reorder import load_profile
+            self.reorder(load_profile(profile))
+
+    def _add_urls(self, urls, prefix='', section=None, methods=None,
+                  host=None):
+        self._check_mutable()
+        self._register(urls, prefix, section, methods, host)
+        self._invalidate()
 
-    def _add_urls(self, urls, prefix=''):
+    def _register(self, urls, prefix='', section=None, methods=None,
+                  host=None, touched=None):
+        ''' Append ``urls`` to the table and ``reverse_patterns``, without
+            touching anything derived from them.  If given, ``touched``
+            receives each url with its state before registering, see
+            ``url._state``.
+        '''
         for u in urls:
             if isinstance(u, include):
-                self._add_urls(u.urls, prefix=prefix+u.prefix)
+                inner_methods, inner_host = _merge_constraints(
+                    methods, host, u.methods, u.host,
+                    'include(%r)' % u.prefix)
+                if u.lazy:
+                    self._add_mount(_Mount(
+                        self, prefix + u.prefix, u.urls, u.namespace,
+                        inner_methods, inner_host))
+                    continue
+                self._register(u.urls, prefix=prefix+u.prefix,
+                               section=section or prefix+u.prefix,
+                               methods=inner_methods, host=inner_host,
+                               touched=touched)
+                continue
+            if u.is_mount:
+                # From the Mapper being frozen
+                self._add_mount(u)
                 continue
+            if touched is not None:
+                touched.append((u, u._state()))
             u.apply_prefix(prefix)
+            u.apply_constraints(methods, host)
+            if u.host is not None:
+                self._hosts.add(u.host)
+            if u.methods is not None:
+                self._methods.update(u.methods)
             self.urls.append(u)
             if self.replacements:
                 u.apply_replacements(**self.replacements)
+            # Only now, so that applying the prefix and replacements does
+            # not invalidate this Mapper over and over
+            u._attach(self)
             if not u.name:
                 continue
             if u.name in self.reverse_patterns:
                 raise MapperError('Duplicate reversal name: %s' % u.name)
             self.reverse_patterns[u.name] = u
+            self._sections[u.name] = section
+
+    def _add_mount(self, mount):
+        if mount._mapper is not None:
+            self._check_mountable(mount._mapper)
+        if mount.namespace is not None:
+            if mount.namespace in self._namespaces:
+                raise MapperError('Duplicate namespace: %s' % mount.namespace)
+            self._namespaces[mount.namespace] = mount
+        mount._owners.add(self)
+        if mount._mapper is not None:
+            mount._mapper._parents.add(self)
+        self._mounts += 1
+        if mount.host is not None:
+            self._hosts.add(mount.host)
+        if mount.methods is not None:
+            self._methods.update(mount.methods)
+        self.urls.append(mount)
+
+    def add(self, urls, prefix=''):
+        ''' Append ``urls`` (``url`` and ``include`` objects, as for the
+            constructor) to the route table, under ``prefix``.
+
+            Unlike building a new Mapper, this updates what was already
+            built in place: the new urls are inserted into the dispatch
+            index, where only the nodes receiving them are recompiled, into
+            the static routes and into the cached readable ``js_mapper``
+            output.  The minified and chunked JS, which depend on the
+            prefixes shared by the whole table, are rebuilt on next use, as
+            are the host and method buckets when the urls bring a host or
+            method the table did not have.  If a name is already taken, or
+            a url cannot be added (a replacement missing from its pattern,
+            say), the error is raised and the table and the urls are left
+            as they were.
+        '''
+        self._check_mutable()
+        start = len(self.urls)
+        hosts, methods = set(self._hosts), set(self._methods)
+        touched = []
+        try:
+            self._register(urls, prefix=prefix, touched=touched)
+        except Exception:
+            for u in self.urls[start:]:
+                if u.is_mount:
+                    self._forget_mount(u)
+                    continue
+                if u.name and self.reverse_patterns.get(u.name) is u:
+                    del self.reverse_patterns[u.name]
+                    del self._sections[u.name]
+                u._detach(self)
+            del self.urls[start:]
+            for u, state in touched:
+                u._restore(state)
+            self._hosts, self._methods = hosts, methods
+            raise
+        finally:
+            if self._hosts != hosts or self._methods != methods:
+                # The bucket keys have changed
+                self._buckets = {}
+                self._statics = {}
+                self._shadowed = {}
+        added = self.urls[start:]
+        self._clear_cache()
+        for key, tree in self._trees():
+            for order, u in enumerate(added, self._order_end):
+                if _belongs(u, key):
+                    tree.insert(order, u)
+        if self._orders is not None:
+            self._orders.extend(
+                range(self._order_end, self._order_end + len(added)))
+        self._order_end += len(added)
+        for key, static in self._statics.items():
+            for u in added:
+                if not u.is_mount and not u.group_map:
+                    self._recheck_static(key, u.reverse_function({}))
+        self._update_js([u for u in added if u.name], [])
+
+    def remove(self, target):
+        ''' Remove a url, given as itself or by name, from the route table.
+            Like ``add``, this updates the dispatch index, static routes and
+            readable JS in place.
+        '''
+        self._check_mutable()
+        if isinstance(target, url):
+            u = target
+        else:
+            u = self.reverse_patterns.get(target)
+        try:
+            # url has no __eq__, so this finds u itself
+            position = self.urls.index(u)
+        except ValueError:
+            position = None
+        if u is None or position is None:
+            raise MapperError('No such url: %r' % (target,))
+        del self.urls[position]
+        if self._orders is None:
+            self._orders = array('l', range(len(self.urls) + 1))
+        del self._orders[position]
+        if u.is_mount:
+            self._forget_mount(u)
+        else:
+            u._detach(self)
+        if u.name and self.reverse_patterns.get(u.name) is u:
+            del self.reverse_patterns[u.name]
+            del self._sections[u.name]
+            self._update_js([], [u])
+        self._clear_cache()
+        for key, tree in self._trees():
+            tree.remove(u)
+        for key, static in self._statics.items():
+            if u.is_mount or u.group_map:
+                # Paths it shadowed may now resolve to a static url
+                for path in list(self._shadowed[key]):
+                    self._recheck_static(key, path)
+            else:
+                # Usually just its own path, but a pattern such as ^/a
+                # also wins for the paths of later urls
+                for path in [path for path, v in static.items() if v is u]:
+                    del static[path]
+                    self._recheck_static(key, path)
+
+    def _check_mountable(self, mapper):
+        ''' Raise ``MapperError`` if mounting ``mapper`` here would make a
+            cycle, ``mapper`` being this Mapper or one which mounts it.
+        '''
+        pending, seen = [self], set()
+        while pending:
+            ancestor = pending.pop()
+            if ancestor is mapper:
+                raise MapperError('A Mapper cannot be included in itself')
+            if ancestor not in seen:
+                seen.add(ancestor)
+                pending.extend(ancestor._parents)
+
+    def _forget_mount(self, mount):
+        if self._namespaces.get(mount.namespace) is mount:
+            del self._namespaces[mount.namespace]
+        mount._owners.discard(self)
+        if mount._mapper is not None:
+            mount._mapper._parents.discard(self)
+        self._mounts -= 1
+
+    def _trees(self):
+        ''' The dispatch indexes built so far, with their keys: ``None``
+            for the whole table, ``_SHARED`` for the urls restricted to no
+            host or method, or the bucket key of the restricted urls of a
+            bucket
+        '''
+        trees = [(key, split.own) for key, split in self._buckets.items()]
+        if self._shared is not None:
+            trees.append((_SHARED, self._shared))
+        if self._dispatcher is not None:
+            trees.append((None, self._dispatcher))
+        return trees
+
+    def _recheck_static(self, key, path):
+        ''' Resolve ``path``, the path of a url without groups, and record
+            it in the static routes of bucket ``key`` as appropriate
+        '''
+        static = self._statics[key]
+        shadowed = self._shadowed[key]
+        if path in static:
+            return
+        result = self._get_dispatcher(key).match(path, PEEK)
+        if result is not None and not result[2] and not result[1].is_mount:
+            static[path] = result[1]
+            shadowed.discard(path)
+        else:
+            shadowed.add(path)
+
+    def _update_js(self, added, removed):
+        ''' Splice named urls into (or out of) the cached readable JS; drop
+            the other cached forms
+        '''
+        if not added and not removed:
+            return
+        if self._mounts:
+            # Names may shadow those of mounted Mappers
+            self._js_cache = {}
+            return
+        from surly import js
+        for key, source in list(self._js_cache.items()):
+            if key[0] == 'chunks' or key[1]:
+                del self._js_cache[key]
+                continue
+            for u in removed:
+                source = js.without_route(source, u.name, u)
+            for u in added:
+                source = js.with_route(source, u.name, u)
+            self._js_cache[key] = source
+
+    def _check_mutable(self):
+        if self.frozen:
+            raise MapperError('The route table of a frozen Mapper cannot '
+                              'change')
+
+    @property
+    def current(self):
+        ''' The mapper itself.  ``LiveMapper.current`` is the snapshot it
+            serves, so code accepting either reads ``current`` once per
+            request.
+        '''
+        return self
+
+    def freeze(self):
+        ''' Return a frozen snapshot of the mapper, which any number of
+            threads can read without locking.
+
+            The snapshot holds copies of the urls, so replacing, prefixing
+            or reordering the original's urls later leaves it unchanged, and
+            its dispatch index, static routes and reverse functions are all
+            built before it is returned.  Changing its own route table raises
+            ``MapperError``.  Mounted Mappers are frozen too, those not yet
+            loaded when they are.  Targets and ``extra_args`` are shared with
+            the original.
+        '''
+        if self.frozen:
+            return self
+        cache_size = self._cache.maxsize if self._cache is not None else None
+        snapshot = Mapper([u._clone() for u in self.urls], self.replacements,
+                          cache_size=cache_size)
+        snapshot._sections = dict(self._sections)
+        snapshot.prepare()
+        for u in snapshot.urls:
+            if not u.is_mount:
+                u.reverse_function
+        snapshot.frozen = True
+        return snapshot
+
+    def _invalidate(self):
+        ''' Drop everything derived from the route table.  Called whenever
+            the table changes or one of its urls is recompiled.
+        '''
+        self._dispatcher = None
+        self._shared = None
+        self._buckets = {}
+        self._statics = {}
+        self._shadowed = {}
+        self._order_end = len(self.urls)
+        self._orders = None
+        self._js_cache = {}
+        self._clear_cache()
+
+    def _clear_cache(self):
+        ''' Forget the results of resolving paths and names, here and in
+            the Mappers which mount this one
+        '''
+        self._mounted_names = {}
+        if self._cache is not None:
+            self._cache.clear()
+        for parent in list(self._parents):
+            # The JS of the parent holds this Mapper's names
+            parent._js_cache = {}
+            parent._clear_cache()
+
+    def _bucket_key(self, method, host):
+        ''' The key of the bucket of urls which may apply to a request for
+            ``method`` on ``host``: ``None`` for the whole table, otherwise
+            ``(host, method)``.  Each part is ``None`` when it does not
+            filter anything, or ``''`` when it matches none of the hosts
+            (or methods) which urls are restricted to.
+        '''
+        hosts = self._hosts
+        if host is None or not hosts:
+            host = None
+        else:
+            host = _normalize_host(host)
+            if host not in hosts:
+                host = ''
+        methods = self._methods
+        if method is None or not methods:
+            method = None
+        else:
+            # As url() does with its methods
+            method = method.upper()
+            if method not in methods:
+                method = ''
+        if host is None and method is None:
+            return None
+        return host, method
+
+    def _bucket_keys(self):
+        hosts = [None]
+        if self._hosts:
+            hosts = list(self._hosts) + ['']
+        methods = [None]
+        if self._methods:
+            methods = list(self._methods) + ['']
+        keys = [None]
+        for host in hosts:
+            for method in methods:
+                if host is not None or method is not None:
+                    keys.append((host, method))
+        return keys
+
+    def _ordered(self, key=None):
+        ''' ``(order, url)`` for the urls belonging to ``key``, numbered as
+            in the indexes already built so that they can be merged.
+        '''
+        if self._orders is None:
+            pairs = enumerate(self.urls)
+        else:
+            pairs = zip(self._orders, self.urls)
+        return [(order, u) for order, u in pairs if _belongs(u, key)]
+
+    def _get_dispatcher(self, key=None):
+        if key is None:
+            dispatcher = self._dispatcher
+            if dispatcher is None:
+                dispatcher = self._dispatcher = PrefixTree(self._ordered())
+            return dispatcher
+        dispatcher = self._buckets.get(key)
+        if dispatcher is None:
+            if self._shared is None:
+                self._shared = PrefixTree(self._ordered(_SHARED))
+            dispatcher = self._buckets[key] = SplitTree(
+                self._shared, PrefixTree(self._ordered(key)))
+        return dispatcher
+
+    def prepare(self):
+        ''' Build the whole dispatch index, for every host and method, now.
+            ``match`` otherwise builds parts of it on first use, which makes
+            the first requests after startup (or after the table changes)
+            slower than the rest.  When some urls are restricted to a host
+            or method, the index of the whole table, only used for calls
+            to ``match`` which give neither, is left to be built on first
+            use.  Mounted Mappers are prepared too, unless they are still
+            to be loaded on first use.
+        '''
+        keys = self._bucket_keys()
+        if len(keys) > 1:
+            del keys[0]
+        for key in keys:
+            self._get_dispatcher(key).compile()
+            self._static_routes(key)
+        for u in self.urls:
+            # Mappers to be loaded on first use are left to it
+            if u.is_mount and u._mapper is not None:
+                u._mapper.prepare()
+
+    def static_routes(self, method=None, host=None):
+        ''' Return a dict mapping the paths matched by urls without
+            capturing groups to the url which ``match`` resolves them to,
+            for a request with ``method`` and ``host`` (see ``match``).
+            A path is only included when that resolution captures nothing,
+            so looking it up here gives the same answer as ``match``.  The
+            dict is built once and kept until the route table changes.
+        '''
+        return self._static_routes(self._bucket_key(method, host))
+
+    def static_route(self, path, method=None, host=None):
+        ''' The url which ``match`` resolves ``path`` to, for a request with
+            ``method`` and ``host``, when it captures nothing from the path
+            (see ``static_routes``), otherwise ``None``.  Servers try this
+            single lookup before ``match``.  While the Mapper is
+            instrumented it always returns ``None``, so that every request
+            goes through the instrumented ``match`` and is counted.
+        '''
+        if self.instrumentation is not None:
+            return None
+        key = self._bucket_key(method, host)
+        static = self._statics.get(key)
+        if static is None:
+            static = self._static_routes(key)
+        return static.get(path)
+
+    @property
+    def binds_hosts(self):
+        ''' Whether any url is bound to a host.  If not, the host of a
+            request makes no difference to ``match``.
+        '''
+        return bool(self._hosts)
+
+    def _static_routes(self, key):
+        static = self._statics.get(key)
+        if static is None:
+            static = {}
+            shadowed = set()
+            dispatcher = self._get_dispatcher(key)
+            for u in self.urls:
+                if u.is_mount or u.group_map:
+                    continue
+                path = u.reverse_function({})
+                if path in static:
+                    continue
+                # A path under an earlier mount is never static: its
+                # Mapper, which is not loaded for this, might claim it
+                result = dispatcher.match(path, PEEK)
+                if (result is not None and not result[2]
+                        and not result[1].is_mount):
+                    static[path] = result[1]
+                else:
+                    shadowed.add(path)
+            self._shadowed[key] = shadowed
+            self._statics[key] = static
+        return static
 
-    def js_mapper(self, var_name):
+    def reorder(self, hits):
+        ''' Move the urls with the most ``hits`` (a dict of route key, the
+            url's name or its pattern, to count) earlier in the match order.
+            A url only moves ahead of urls whose patterns provably never
+            match the same path as its own, so ``match`` returns the same
+            result for every path as before.  See ``surly.reorder``.
+        '''
+        from surly import reorder
+        self._check_mutable()
+        self.urls = reorder.reorder(self.urls, hits)
+        self._invalidate()
+
+    def js_mapper(self, var_name, minify=False):
         ''' Return a JS function which is the equivalent of the python 
             reverse mapper.  The reverse function is assigned to
             ``var_name``.  (e.g. if ``var_name`` is "Foo.Bar", the generated
             code will be "Foo.Bar = function(){...}")
+
+            With ``minify``, the output is compacted and literal prefixes
+            shared by several routes are only written out once.  The output
+            is cached until the route table changes.
         '''
-        ret = '{var_name} = function(name, args){{'.format(var_name=var_name)
-        ret += 'var mapping = {'
-        for count, (name, u) in enumerate(self.reverse_patterns.items()):
-            if count != 0:
-                ret += ','
-            function = u.js_pattern
-            ret += '"{name}":{function}'.format(**vars())
-        ret += '};' # end mapping
-        ret += '''return mapping[name](args);'''
-        ret += '};' # end function
-        return ret
+        key = (var_name, bool(minify))
+        source = self._js_cache.get(key)
+        if source is None:
+            from surly import js
+            if minify:
+                source = js.minified_source(self, var_name)
+            else:
+                source = js.mapper_source(self, var_name)
+            self._js_cache[key] = source
+        return source
 
-    def reverse(self, name, **kwargs):
-        ''' return the URL for a name, interpolated with **kwargs '''
-        if name not in self.reverse_patterns:
-            raise MapperError('No reverse found for name: %s' % name)
-        return self.reverse_patterns[name].reverse(**kwargs)
+    def js_chunks(self, var_name, base_url=''):
+        ''' Split the JS mapper into one lazily loaded chunk per top-level
+            ``include()``.
+
+            Returns ``(loader, chunks)``.  ``loader`` is the JS to ship with
+            every page: it assigns the usual ``var_name(name, args)``
+            function and holds the routes which are not in any include.
+            ``var_name.prefetch(name, callback)`` and
+            ``var_name.load(name)``, which returns a Promise, load the chunk
+            holding ``name`` with a script tag, from ``base_url`` + its
+            file name.  Reversing a name whose chunk is not loaded yet
+            throws an Error.  ``chunks`` maps each chunk's file name, which
+            contains a hash of its content, to its JS.
+        '''
+        key = ('chunks', var_name, base_url)
+        result = self._js_cache.get(key)
+        if result is None:
+            from surly import js
+            result = js.chunked_source(self, var_name, base_url)
+            self._js_cache[key] = result
+        return result
+
+    def js_mapper_hash(self, var_name, minify=False):
+        ''' Return a stable content hash of ``js_mapper(var_name, minify)``,
+            suitable for an ETag or a cache-busting file name.
+        '''
+        from surly import js
+        return js.content_hash(self.js_mapper(var_name, minify))
+
+    def match(self, path, method=None, host=None):
+        ''' Return a ``RouteMatch`` for the first url whose pattern matches
+            ``path``, or ``None`` if no url matches.
+
+            When ``method`` or ``host`` (the request's Host, with or without
+            a port) is given, urls restricted to other methods or hosts are
+            skipped.  Urls are partitioned by host and method, so they are
+            not even tried.  A path under the prefix of a mounted Mapper
+            (see ``include``) is resolved by that Mapper, loading it first
+            if need be, and its result is returned.
+        '''
+        key = None
+        if method is not None or host is not None:
+            key = self._bucket_key(method, host)
+        cache = self._cache
+        if cache is not None:
+            if self._mounts:
+                # Mounted Mappers tell hosts and methods apart by their own
+                # sets of them, not this one's
+                cache_key = (path, method, host)
+            elif key is None:
+                cache_key = path
+            else:
+                cache_key = (path, key)
+            generation = cache.generation
+            result = cache.get(cache_key)
+            if result is not LRUCache.missing:
+                if result is None:
+                    return None
+                return RouteMatch(result[0], dict(result[1]))
+        result = self._get_dispatcher(key).match(path, method, host)
+        if cache is None:
+            if result is None:
+                return None
+            return RouteMatch(result[1], result[2])
+        if result is None:
+            cache.put(cache_key, None, generation)
+            return None
+        cache.put(cache_key, (result[1], result[2]), generation)
+        return RouteMatch(result[1], dict(result[2]))
+
+    def cache_info(self):
+        ''' Return the hit, miss and eviction counters of the resolution
+            cache as a dict, or ``None`` if the cache is not enabled.
+        '''
+        if self._cache is None:
+            return None
+        return self._cache.info()
+
+    def instrument(self, sample_rate=0.01, hook=None, interval=60.0,
+                   buckets=None):
+        ''' Start counting ``match`` and ``reverse`` calls per route, and
+            timing a ``sample_rate`` fraction of the ``match`` calls.
+            Returns the ``surly.instrument.Instrumentation``, also kept as
+            ``self.instrumentation``, whose ``snapshot`` and ``reset``
+            methods read the counters.  If ``hook`` is given it is passed
+            the counters, which are then reset, every ``interval`` seconds.
+        '''
+        from surly.instrument import Instrumentation, DEFAULT_BUCKETS
+        self.uninstrument()
+        instrumentation = Instrumentation(
+            self, sample_rate, buckets or DEFAULT_BUCKETS, hook, interval)
+        instrumentation.install()
+        self.instrumentation = instrumentation
+        return instrumentation
+
+    def uninstrument(self):
+        ''' Stop instrumenting.  The mapper runs exactly the code it ran
+            before ``instrument`` was called.
+        '''
+        if self.instrumentation is not None:
+            self.instrumentation.uninstall()
+            self.instrumentation = None
+
+    def reverse(self, name, _escape=True, _absolute=False, _scheme='http',
+                **kwargs):
+        ''' return the URL for a name, interpolated with **kwargs.  Values
+            are escaped as described in ``url.reverse``; pass
+            ``_escape=False`` for values which are already safe.  With
+            ``_absolute``, the URL of a url bound to a host is returned in
+            full, as ``_scheme://host/path``.  Names not in this Mapper are
+            looked for in the Mappers it mounts, see ``include``.
+        '''
+        try:
+            u = self.reverse_patterns[name]
+        except KeyError:
+            u, prefix, host = self._find_mounted(name)
+            path = prefix + u.reverse(_escape, **kwargs)
+            if _absolute:
+                return _base_url(_scheme, host, u) + path
+            return path
+        if _absolute:
+            return u.reverse(_escape, _absolute, _scheme, **kwargs)
+        if _escape:
+            return u.reverse_function(_escape_safe(u, kwargs),
+                                      escape.memo.escape)
+        return u.reverse_function(kwargs)
+
+    def reverse_many(self, name, kwargs_iterable, _escape=True,
+                     _absolute=False, _scheme='http'):
+        ''' Return an iterator of the URLs for ``name``, one for each dict
+            of kwargs in ``kwargs_iterable``.  The name is looked up once,
+            up front.  ``_escape``, ``_absolute`` and ``_scheme`` are as for
+            ``reverse``.
+        '''
+        u = self.reverse_patterns.get(name)
+        prefix = ''
+        host = None if u is None else u.host
+        if u is None:
+            u, prefix, host = self._find_mounted(name)
+        function = u.reverse_function
+        if _escape:
+            convert = escape.memo.escape
+            if u.converters and _converters.safe_fields(u.converters):
+                kwargs_iterable = (_escape_safe(u, kwargs)
+                                   for kwargs in kwargs_iterable)
+            links = (function(kwargs, convert) for kwargs in kwargs_iterable)
+        else:
+            links = (function(kwargs) for kwargs in kwargs_iterable)
+        if _absolute:
+            prefix = _base_url(_scheme, host, u) + prefix
+        if prefix:
+            links = (prefix + link for link in links)
+        return links
+
+    def _find_mounted(self, name):
+        ''' Return the url named ``name`` in a mounted Mapper, the prefix
+            of its paths and the host it is bound to (by its ``include()``
+            or itself), loading mounted Mappers as need be
+        '''
+        found = self._mounted_names.get(name)
+        if found is None:
+            found = self._search_mounts(name)
+            self._mounted_names[name] = found
+        return found
+
+    def _search_mounts(self, name):
+        namespace, colon, inner = name.partition(':')
+        if colon and namespace in self._namespaces:
+            candidates = [(self._namespaces[namespace], inner)]
+        elif self._mounts:
+            candidates = [(u, name) for u in self.urls
+                          if u.is_mount and u.namespace is None]
+        else:
+            candidates = []
+        for mount, inner in candidates:
+            mapper = mount.mapper()
+            u = mapper.reverse_patterns.get(inner)
+            if u is not None:
+                return u, mount.literal_prefix, mount.host or u.host
+            try:
+                u, prefix, host = mapper._find_mounted(inner)
+            except MapperError:
+                continue
+            return u, mount.literal_prefix + prefix, mount.host or host
+        raise MapperError('No reverse found for name: %s' % name)
+
+    def _named_routes(self):
+        ''' Return ``(name, url, prefix, section)`` for every name
+            ``reverse`` resolves, including those of mounted Mappers (which
+            are loaded), in the order it looks for them.  ``prefix`` is
+            added to the url's paths; ``section`` is the prefix of the
+            outermost ``include()`` the url came from, or ``None``.
+        '''
+        routes = [(name, u, '', self._sections.get(name))
+                  for name, u in self.reverse_patterns.items()]
+        seen = set(self.reverse_patterns)
+        mounts = [u for u in self.urls if u.is_mount]
+        # Namespaced mounts are looked in first, see _search_mounts
+        mounts.sort(key=lambda mount: mount.namespace is None)
+        for mount in mounts:
+            for name, u, prefix, section in mount.mapper()._named_routes():
+                if mount.namespace is not None:
+                    name = '%s:%s' % (mount.namespace, name)
+                elif name.partition(':')[0] in self._namespaces:
+                    continue
+                if name in seen:
+                    continue
+                seen.add(name)
+                routes.append((name, u, mount.literal_prefix + prefix,
+                               mount.literal_prefix))
+        return routes
 
 class url(object):
     ''' class for defining urls in the surly dsl.  Shouldn't be used 
         independently.
     '''
-    def __init__(self, pattern, target, extra_args=None, name=None):
-        ''' :param pattern: The URL pattern. Use named matching groups
+    is_mount = False
+
+    # Route tables can hold hundreds of thousands of urls, so they keep
+    # no per-instance dict
+    __slots__ = ('pattern', 'target', 'extra_args', 'name', 'methods',
+                 'host', 'converters', 'replacements_applied',
+                 '_prefix_applied', 'frozen', '_mappers', 'py_pattern',
+                 'group_map', 'literal_prefix', 'regex', 'reverse_function',
+                 'segments')
+
+    # Attributes derived from the final pattern.  They are built together,
+    # by a single parse, the first time any of them is needed.  ``regex``
+    # is listed separately since it is all a url loaded from a table cache
+    # still needs to build.  It is only kept once something asks for it:
+    # the dispatch index matches most urls with combined regexes.
+    _COMPILED = ('py_pattern', 'group_map', 'literal_prefix')
+    _DERIVED = _COMPILED + ('regex', 'reverse_function', 'segments')
+
+    def __init__(self, pattern, target, extra_args=None, name=None,
+                 methods=None, host=None):
+        ''' :param pattern: The URL pattern. Use named matching groups, or \
+            converters such as ``<int:id>`` (see ``surly.converters``)
             :type pattern: regular expression as a string
             :param target: An object which the url is mapped to.  
             :type target: Determined by the adapter being used.
+            :param methods: if given, the HTTP methods (a name or a list of \
+            names) the url applies to.  Allowing GET also allows HEAD.
+            :param host: if given, the host name the url applies to
         '''
         self.extra_args = extra_args
         self.name = name
+        self.methods = _normalize_methods(methods)
+        self.host = _normalize_host(host) if host else None
+        pattern, converters = _converters.expand(pattern)
         self.pattern = pattern
+        self.converters = converters or _EMPTY
         self.target = target
         self.replacements_applied = False
-        self._compile()
+        self._prefix_applied = False
+        #: Whether this is a copy held by a frozen Mapper
+        self.frozen = False
+        # Weak references to the Mappers holding the url
+        self._mappers = ()
+
+    def __getattr__(self, name):
+        # Only called for the derived attributes not built yet
+        if name in url._COMPILED:
+            self._compile()
+            return getattr(self, name)
+        if name == 'regex':
+            self.regex = re.compile(self.pattern)
+            return self.regex
+        if name == 'reverse_function':
+            self.reverse_function = reverse_function(self.py_pattern)
+            return self.reverse_function
+        if name == 'segments':
+            self.segments = _converters.segments(self.pattern,
+                                                 self.converters)
+            return self.segments
+        raise AttributeError(name)
+
+    @property
+    def js_pattern(self):
+        ''' The JS function reversing the url, built on demand '''
+        from surly.js import js_from_template
+        return js_from_template(self.py_pattern)
 
     def apply_replacements(self, **replacements):
         if self.replacements_applied:
             return
-        self.pattern = self.pattern.format(**replacements)
-        self._compile()
+        self._set_pattern(self.pattern.format(**replacements))
         self.replacements_applied = True
-    _prefix_applied = False
     def apply_prefix(self, prefix):
         if self._prefix_applied:
             return
-        self.pattern = prefix + self.pattern
-        self._compile()
+        if prefix:
+            self._set_pattern(prefix + self.pattern)
         self._prefix_applied = True
+    def apply_constraints(self, methods=None, host=None):
+        ''' Restrict the url to the methods and host of an include() '''
+        self.methods, self.host = _merge_constraints(
+            _normalize_methods(methods), host, self.methods, self.host,
+            'url %r' % (self.name or self.pattern))
+    def _set_pattern(self, pattern):
+        if self.frozen:
+            raise MapperError('url %r belongs to a frozen Mapper'
+                              % (self.name or self.pattern))
+        pattern, converters = _converters.expand(pattern)
+        if converters:
+            converters.update(self.converters)
+            self.converters = converters
+        self.pattern = pattern
+        self._changed()
+    # What registering a url with a Mapper may change, see Mapper.add
+    _STATE = ('pattern', 'converters', 'methods', 'host',
+              'replacements_applied', '_prefix_applied')
+    def _state(self):
+        return tuple(getattr(self, name) for name in url._STATE)
+    def _restore(self, state):
+        pattern = self.pattern
+        for name, value in zip(url._STATE, state):
+            setattr(self, name, value)
+        if self.pattern != pattern:
+            self._changed()
+    def _built(self, name):
+        ''' Whether the derived attribute ``name`` has been built '''
+        try:
+            getattr(url, name).__get__(self, url)
+        except AttributeError:
+            return False
+        return True
+    def _clone(self):
+        ''' A frozen copy, compiled, and known to no mapper yet '''
+        self._ensure_compiled()
+        clone = url.__new__(url)
+        for name in url.__slots__:
+            if self._built(name):
+                setattr(clone, name, getattr(self, name))
+        clone._mappers = ()
+        clone.frozen = True
+        return clone
+    def _attach(self, mapper):
+        self._mappers = tuple(ref for ref in self._mappers
+                              if ref() is not None) + (weakref.ref(mapper),)
+    def _detach(self, mapper):
+        self._mappers = tuple(ref for ref in self._mappers
+                              if ref() not in (None, mapper))
+    def _changed(self):
+        ''' The pattern has changed: drop its compiled form, which will be
+            rebuilt on next use, and everything mappers derived from it.
+        '''
+        for attr in url._DERIVED:
+            try:
+                delattr(self, attr)
+            except AttributeError:
+                # Not built
+                pass
+        for ref in self._mappers:
+            mapper = ref()
+            if mapper is not None:
+                mapper._invalidate()
+    def _ensure_compiled(self):
+        if not self._built('py_pattern'):
+            self._compile()
+    def _load_compiled(self, py_pattern, group_map, literal_prefix):
+        self.py_pattern = py_pattern
+        self.group_map = _share_group_map(group_map)
+        self.literal_prefix = share(literal_prefix)
     def _compile(self):
-        self.js_pattern = reverse_template_js(self.pattern)
-        self.py_pattern = reverse_template(self.pattern)
-        self.group_map = reverse_group_map(self.pattern)
-    def reverse(self, **kwargs):
-        ''' python-based reversal for this URL
+        compiled = compile_pattern(self.pattern)
+        self._load_compiled(compiled.py_pattern, compiled.group_map,
+                            compiled.literal_prefix)
+    def _base_url(self, scheme):
+        return _base_url(scheme, self.host, self)
+    def reverse(self, _escape=True, _absolute=False, _scheme='http',
+                **kwargs):
+        ''' python-based reversal for this URL.  Values are converted to
+            strings if necessary, encoded as utf8, and url-escaped (see
+            ``surly.escape``), except for the characters their converter
+            keeps, such as the slashes of ``<path:...>``.  Pass
+            ``_escape=False`` to interpolate values which are already safe
+            as they are.  With ``_absolute``, the URL of a url bound to a
+            host is returned in full, as ``_scheme://host/path``.
         '''
-        return self.py_pattern.format(**kwargs)
+        if _escape:
+            path = self.reverse_function(_escape_safe(self, kwargs),
+                                         escape.memo.escape)
+        else:
+            path = self.reverse_function(kwargs)
+        if _absolute:
+            return self._base_url(_scheme) + path
+        return path
 
 class include(object):
-    def __init__(self, prefix, urls):
-        assert not isinstance(urls, Mapper), ('Mappers cannot currently be ' 
-                                              'passed into include()')
+    def __init__(self, prefix, urls, methods=None, host=None,
+                 namespace=None):
+        ''' Mount ``urls`` under ``prefix``.  ``methods`` and ``host``, if
+            given, restrict every url in the include as they do for
+            ``url``.
+
+            ``urls`` may also be a ``Mapper``, or a callable taking no
+            arguments which returns one (or a list of urls).  Such a Mapper
+            is mounted as it is, neither copied nor flattened into the
+            including one: paths starting with ``prefix``, which must be
+            literal text, are resolved by it with the prefix taken off, so
+            its patterns are written as if it were on its own.  A callable
+            is only called, and its table only compiled, when a path under
+            ``prefix`` is first resolved or one of its names first
+            reversed.  Its names are reversed as ``namespace:name`` if
+            ``namespace`` is given, and otherwise as plain names, which
+            are looked for in the mounted Mappers in order, loading them
+            until one has the name.
+        '''
         self.urls = urls
+        self.lazy = isinstance(urls, Mapper) or callable(urls)
+        if namespace is not None and not self.lazy:
+            raise MapperError('Only an include() of a Mapper takes a '
+                              'namespace')
+        self.namespace = namespace
         self.prefix = prefix
+        self.methods = _normalize_methods(methods)
+        self.host = _normalize_host(host) if host else None
+
+
+class _Mount(object):
+    ''' An include() of a Mapper (or of a callable returning one) in a route
+        table.  It stands in the table's urls, and the dispatch index hands
+        it the paths starting with ``literal_prefix``.
+    '''
+    is_mount = True
+    name = None
+    target = None
+    extra_args = None
+    converters = {}
+    group_map = {}
+
+    def __init__(self, owner, pattern, source, namespace, methods, host):
+        if owner.replacements:
+            pattern = pattern.format(**owner.replacements)
+        literal = _LITERAL.match(pattern)
+        if literal is None:
+            raise MapperError('A Mapper can only be included under a '
+                              'literal prefix, not %r' % pattern)
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+        self.literal_prefix = _UNESCAPE.sub(r'\1', literal.group(1))
+        self.namespace = namespace
+        self.methods = methods
+        self.host = host
+        self._source = source
+        self._replacements = owner.replacements
+        self._mapper = source if isinstance(source, Mapper) else None
+        self._owners = weakref.WeakSet()
+        self._lock = threading.Lock()
+        # Whether the Mapper is frozen as it is loaded, see _clone
+        self._freeze = False
+
+    def mapper(self):
+        ''' The mounted Mapper, loaded on first use '''
+        mapper = self._mapper
+        if mapper is None:
+            with self._lock:
+                if self._mapper is None:
+                    mapper = self._source()
+                    if not isinstance(mapper, Mapper):
+                        mapper = Mapper(mapper, self._replacements)
+                    if self._freeze:
+                        mapper = mapper.freeze()
+                    for owner in self._owners:
+                        owner._check_mountable(mapper)
+                    for owner in self._owners:
+                        mapper._parents.add(owner)
+                    self._mapper = mapper
+                mapper = self._mapper
+        return mapper
+
+    def _ensure_compiled(self):
+        pass
+
+    def _clone(self):
+        ''' A mount of a frozen snapshot of the mounted Mapper, for
+            ``Mapper.freeze``.  Until the Mapper is loaded, the copy loads
+            it through this mount, so the loader runs once, and freezes it.
+        '''
+        clone = copy.copy(self)
+        clone._owners = weakref.WeakSet()
+        clone._lock = threading.Lock()
+        if self._mapper is not None:
+            clone._mapper = self._mapper.freeze()
+        else:
+            clone._source = self.mapper
+            clone._freeze = True
+        return clone
+
+class LiveMapper(object):
+    ''' Serves frozen ``Mapper`` snapshots (see ``Mapper.freeze``) and
+        replaces them while requests are being served.
+
+        ``current`` is the snapshot to serve.  A new table is frozen, which
+        builds its whole dispatch index, before it is published with a
+        single reference assignment, so a request never sees a partly built
+        table.  A request should read ``current`` once and use that
+        snapshot throughout, so its ``match`` and ``reverse`` calls agree.
+        Readers take no lock; publishing takes one, so that concurrent
+        swaps return the right previous snapshot.  The read-only ``Mapper``
+        methods and attributes are available here as well, each answering
+        from ``current`` at the time of the call.
+    '''
+    def __init__(self, mapper):
+        self.current = mapper.freeze()
+        self._lock = threading.Lock()
+
+    def swap(self, mapper):
+        ''' Publish a snapshot of ``mapper`` and return the previous one
+        '''
+        snapshot = mapper.freeze()
+        with self._lock:
+            previous = self.current
+            self.current = snapshot
+        return previous
+
+    def reload(self, build):
+        ''' Call ``build``, which returns a ``Mapper``, in a background
+            thread and ``swap`` its result in.  Returns the started thread.
+            If ``build`` raises, the current snapshot stays in place.
+        '''
+        thread = threading.Thread(target=lambda: self.swap(build()))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def match(self, path, method=None, host=None):
+        return self.current.match(path, method, host)
+
+    def reverse(self, name, **kwargs):
+        return self.current.reverse(name, **kwargs)
+
+    def reverse_many(self, name, kwargs_iterable, **options):
+        return self.current.reverse_many(name, kwargs_iterable, **options)
+
+    def static_routes(self, method=None, host=None):
+        return self.current.static_routes(method, host)
+
+    def static_route(self, path, method=None, host=None):
+        return self.current.static_route(path, method, host)
+
+    def js_mapper(self, var_name, minify=False):
+        return self.current.js_mapper(var_name, minify)
+
+    def js_chunks(self, var_name, base_url=''):
+        return self.current.js_chunks(var_name, base_url)
+
+    def js_mapper_hash(self, var_name, minify=False):
+        return self.current.js_mapper_hash(var_name, minify)
+
+    def cache_info(self):
+        return self.current.cache_info()
+
+    @property
+    def reverse_patterns(self):
+        return self.current.reverse_patterns
 
+    @property
+    def binds_hosts(self):
+        return self.current.binds_hosts
@@ -1,10 +1,28 @@
-import sre_parse
 import re
+import string
+import sys
+import types
+
+from surly._sre import (LITERAL, SUBPATTERN, AT, AT_BEGINNING, AT_END,
+                        MAX_REPEAT, sre_parse)
+
+try:
+    unichr
+except NameError:
+    # Python 3
+    unichr = chr
 
 
 class ReverseParseError(Exception):
     pass
 
+class MissingArgumentError(KeyError):
+    ''' Raised when reversing a URL without a value for one of its groups.
+        A ``KeyError`` subclass, since that is what formatting the template
+        with ``str.format`` raises.
+    '''
+    pass
+
 class PythonReverser(object):
     '''
     Python format string reverser.  Generates a python format string
@@ -38,21 +56,29 @@ class JavascriptReverser(object):
     URLs are not user generated, there is no effort to stop cross-site
     scripting
     '''
+    # Characters which cannot appear unescaped in a JS string literal
+    _escapes = {'\\': '\\\\', '\n': '\\n', '\r': '\\r',
+                u'\u2028': '\\u2028', u'\u2029': '\\u2029'}
+
     def __init__(self):
-        self.s = ''
-        self.last_literal = False
+        self.parts = []
+        self.literal = []
+
+    def _end_literal(self):
+        if self.literal:
+            self.parts.append('+"%s"' % ''.join(self.literal))
+            self.literal = []
 
     def add_literal(self, char):
         ''' Append a literal character to the JS expression.  The function 
-            handles single and double quotes.
+            handles single and double quotes.  Consecutive literals are
+            collected into one JS string.
         '''
         if char == '"':
-            self.s += "+'%s'" % char
-        elif self.last_literal:
-            self.s = self.s[:-1] + char + '"'
+            self._end_literal()
+            self.parts.append("+'%s'" % char)
         else:
-            self.s += '+"%s"' % char
-        self.last_literal = True
+            self.literal.append(self._escapes.get(char, char))
 
     def add_named_group(self, name):
         ''' Add a named group to the JS expression, having it append
@@ -61,8 +87,8 @@ class JavascriptReverser(object):
             :param name: the name of the capture group
             :type name: string
         '''
-        self.last_literal = False
-        self.s += '+fields["%s"]' % name
+        self._end_literal()
+        self.parts.append('+fields["%s"]' % name)
 
     def value(self):
         ''' Returns the anonymous JS function built up over the course of 
@@ -70,7 +96,8 @@ class JavascriptReverser(object):
 
             :rtype: string
         '''
-        return '''function(fields){return ""%s;}''' % self.s
+        self._end_literal()
+        return '''function(fields){return ""%s;}''' % ''.join(self.parts)
 
 def _recursive_parse(ast, group_index_map, *reversers):
     '''
@@ -88,38 +115,340 @@ def _recursive_parse(ast, group_index_map, *reversers):
     '''
     for item in ast:
         item_type = item[0]
-        if item_type == 'literal':
+        if item_type == LITERAL:
             # This is a matched literal; keep it
             for r in reversers:
                 r.add_literal(unichr(item[1]))
-        elif item_type == 'subpattern':
+        elif item_type == SUBPATTERN:
             subpattern = item[1]
             subpattern_index = subpattern[0]
 
             if subpattern_index is None:
                 # This is a non-capturing group.  Parse it out recursively.
-                _recursive_parse(subpattern[1], group_index_map, *reversers)
+                # (The group's contents are the last element; Python 3.6+
+                # inserts inline flags before them.)
+                _recursive_parse(subpattern[-1], group_index_map, *reversers)
             else:
                 # Otherwise, we've found a capture group.  Fill in our value.
                 # s += kwargs[group_index_map[subpattern_index]]
                 for r in reversers:
                     r.add_named_group(group_index_map[subpattern_index])
-        elif item_type == 'at' and item[1] == 'at_end':
+        elif item_type == AT and item[1] == AT_END:
             pass
-        elif item_type == 'at' and item[1] == 'at_beginning':
+        elif item_type == AT and item[1] == AT_BEGINNING:
             pass
-        elif item_type == 'max_repeat':
+        elif item_type == MAX_REPEAT:
             min_repeat = item[1][0]
             max_repeat = item[1][1]
             subpattern = item[1][2]
             for i in range(min_repeat):
                 _recursive_parse(subpattern, group_index_map, *reversers)
-        # elif item_type == 'any':
-        #     pass
         else:
             raise ReverseParseError('Unsupported regex expression: %s'
                                     % item_type)
 
+class _Unsupported(Exception):
+    ''' Raised by ``_Scanner`` for a pattern outside the subset it parses '''
+
+# Characters with a meaning of their own outside character classes
+_SPECIAL = frozenset('\\.^$*+?{}[]|()')
+_CATEGORIES = frozenset('dDwWsS')
+_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*\Z')
+_REPEAT = re.compile(r'\{(\d{0,4})(?:(,)(\d{0,4}))?\}')
+# Python 3.7 and later splice non-capturing groups into the enclosing
+# sequence when parsing
+_INLINE_GROUPS = sys.version_info >= (3, 7)
+# Patterns with more groups are left to re, which refuses them on Python
+# 2 (see surly.dispatch.MAX_GROUPS)
+_MAX_GROUPS = 99 if sys.version_info < (3, 5) else None
+
+class _Scanner(object):
+    ''' A single-pass parser for the regex subset url patterns use.
+
+        Outside capturing groups, a pattern may hold literal characters
+        (escaped when special), "^", "$", non-capturing groups and the
+        repeats "?", "*", "+" and "{m,n}"; those parts are reversed.  The
+        contents of capturing groups are only checked: literals, ".",
+        character classes, the classes "\\d", "\\w", "\\s" and their
+        negations, groups, alternatives and (lazy) repeats.  Anything else
+        raises ``_Unsupported``, and the pattern is left to ``sre_parse``.
+
+        The AST built has the shape ``sre_parse`` gives the reversed parts:
+        the contents of capturing groups are left out.  Since everything
+        accepted is valid, the pattern need not be compiled.
+    '''
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.pos = 0
+        self.groups = 0
+        self.group_map = {}
+
+    def parse(self):
+        ''' Returns the AST and the map of group index to group name '''
+        ast = self.sequence(True)
+        if self.pos != len(self.pattern):
+            # An unbalanced ")"
+            raise _Unsupported()
+        return ast, self.group_map
+
+    def sequence(self, reversed_):
+        ''' Parse up to the end of the pattern or the current group.  With
+            ``reversed_``, return the items (outside capturing groups, where
+            alternatives are not supported); otherwise only check them.
+        '''
+        pattern = self.pattern
+        end = len(pattern)
+        items = []
+        # Whether the last item can be repeated
+        repeatable = False
+        while self.pos < end:
+            char = pattern[self.pos]
+            if char not in _SPECIAL:
+                self.pos += 1
+                items.append((LITERAL, ord(char)))
+                repeatable = True
+            elif char == '\\':
+                escaped = pattern[self.pos + 1:self.pos + 2]
+                self.pos += 2
+                if escaped in _CATEGORIES and escaped and not reversed_:
+                    items.append(None)
+                elif escaped and not escaped.isalnum():
+                    items.append((LITERAL, ord(escaped)))
+                else:
+                    raise _Unsupported()
+                repeatable = True
+            elif char == '(':
+                self.group(items, reversed_)
+                repeatable = True
+            elif char == ')':
+                break
+            elif char in '*+?{':
+                if not repeatable:
+                    raise _Unsupported()
+                self.repeat(items, reversed_)
+                repeatable = False
+            elif char == '^' or char == '$':
+                self.pos += 1
+                items.append((AT, AT_BEGINNING if char == '^' else AT_END))
+                repeatable = False
+            elif reversed_:
+                raise _Unsupported()
+            elif char == '.':
+                self.pos += 1
+                items.append(None)
+                repeatable = True
+            elif char == '[':
+                self.character_class()
+                items.append(None)
+                repeatable = True
+            elif char == '|':
+                self.pos += 1
+                repeatable = False
+            else:
+                raise _Unsupported()
+        return items
+
+    def group(self, items, reversed_):
+        pattern = self.pattern
+        name = None
+        if pattern.startswith('(?:', self.pos):
+            self.pos += 3
+            index = None
+        elif pattern.startswith('(?P<', self.pos):
+            close = pattern.find('>', self.pos)
+            name = pattern[self.pos + 4:close]
+            if (close < 0 or not _NAME.match(name)
+                    or name in self.group_map.values()):
+                raise _Unsupported()
+            self.pos = close + 1
+        elif pattern.startswith('(?', self.pos) or reversed_:
+            # Other extensions; an unnamed group cannot be reversed
+            raise _Unsupported()
+        else:
+            self.pos += 1
+        if name is not None or pattern[self.pos - 1] == '(':
+            self.groups += 1
+            index = self.groups
+            if _MAX_GROUPS is not None and index >= _MAX_GROUPS:
+                raise _Unsupported()
+            if name is not None:
+                self.group_map[index] = name
+            contents = self.sequence(False)
+        else:
+            contents = self.sequence(reversed_)
+        if not pattern.startswith(')', self.pos):
+            raise _Unsupported()
+        self.pos += 1
+        if index is not None:
+            items.append((SUBPATTERN, (index, None)))
+        elif _INLINE_GROUPS:
+            # Marks where the contents go, unless they are repeated
+            items.append((SUBPATTERN, (None, contents, True)))
+        else:
+            items.append((SUBPATTERN, (None, contents)))
+
+    def repeat(self, items, reversed_):
+        pattern = self.pattern
+        char = pattern[self.pos]
+        if char == '{':
+            m = _REPEAT.match(pattern, self.pos)
+            if m is None or not (m.group(1) or m.group(3)):
+                raise _Unsupported()
+            low = int(m.group(1) or 0)
+            if m.group(2) and m.group(3) and int(m.group(3)) < low:
+                raise _Unsupported()
+            self.pos = m.end()
+        else:
+            low = 1 if char == '+' else 0
+            self.pos += 1
+        if pattern.startswith('?', self.pos) and not reversed_:
+            # Lazy
+            self.pos += 1
+        if pattern[self.pos:self.pos + 1] in ('*', '+', '?', '{'):
+            raise _Unsupported()
+        item = items.pop()
+        if (_INLINE_GROUPS and item is not None and item[0] == SUBPATTERN
+                and item[1][0] is None):
+            contents = item[1][1]
+        else:
+            contents = [item]
+        items.append((MAX_REPEAT, (low, None, contents)))
+
+    def character_class(self):
+        pattern = self.pattern
+        self.pos += 1
+        if pattern.startswith('^', self.pos):
+            self.pos += 1
+        first = True
+        while True:
+            low = self.class_character(first)
+            first = False
+            if low is None:
+                return
+            if (pattern.startswith('-', self.pos)
+                    and not pattern.startswith('-]', self.pos)):
+                self.pos += 1
+                high = self.class_character(False)
+                if not low or not high or high < low:
+                    raise _Unsupported()
+
+    def class_character(self, first):
+        ''' Consume one member of a character class.  Returns it, ``''`` for
+            a category such as "\\d", or ``None`` at the closing "]".
+        '''
+        pattern = self.pattern
+        char = pattern[self.pos:self.pos + 1]
+        following = pattern[self.pos + 1:self.pos + 2]
+        if not char or char == '[':
+            raise _Unsupported()
+        if char == ']' and not first:
+            self.pos += 1
+            return None
+        if char in '-&~|' and following == char:
+            # Reserved for set operations; re warns about them
+            raise _Unsupported()
+        if char != '\\':
+            self.pos += 1
+            return char
+        self.pos += 2
+        if following in _CATEGORIES and following:
+            return ''
+        if following and not following.isalnum():
+            return following
+        raise _Unsupported()
+
+def _splice(items):
+    ''' Splice the non-capturing groups ``_Scanner`` marked into ``items``,
+        recursively, as ``sre_parse`` does on Python 3.7 and later
+    '''
+    out = []
+    for item in items:
+        if item[0] == SUBPATTERN and len(item[1]) == 3:
+            out.extend(_splice(item[1][1]))
+        elif item[0] == MAX_REPEAT:
+            low, high, contents = item[1]
+            out.append((MAX_REPEAT, (low, high, _splice(contents))))
+        else:
+            out.append(item)
+    return out
+
+def _scan(re_str):
+    ''' Parse ``re_str`` with ``_Scanner``.  Returns the AST and the group
+        map.  Raises ``_Unsupported`` if it cannot.
+    '''
+    if isinstance(re_str, bytes) and bytes is not str:
+        raise _Unsupported()
+    try:
+        _text(re_str)
+    except UnicodeDecodeError:
+        # Python 2 bytes, which re reads as latin-1
+        raise _Unsupported()
+    ast, group_map = _Scanner(re_str).parse()
+    if _INLINE_GROUPS:
+        ast = _splice(ast)
+    return ast, group_map
+
+def _parse(re_str):
+    ''' Parse ``re_str`` once.  Returns its flags, its AST as far as surly
+        reads it (as ``sre_parse`` gives it) and a map of group index to
+        group name.  Patterns which ``_scan`` does not handle are compiled
+        and parsed by ``re``.
+    '''
+    try:
+        ast, group_map = _scan(re_str)
+        return 0, ast, group_map
+    except _Unsupported:
+        return _parse_with_re(re_str)
+
+def _parse_with_re(re_str):
+    r = re.compile(re_str)
+    ast = sre_parse.parse(re_str)
+    group_index_map = dict((index, group)
+                           for (group, index) in r.groupindex.items())
+    return r.flags, ast, group_index_map
+
+class CompiledPattern(object):
+    ''' Everything surly derives from a URL regex, computed from a single
+        parse of the pattern.
+
+        :ivar regex: the compiled regular expression, compiled when asked \
+        for
+        :ivar py_pattern: the python format string (see ``reverse_template``)
+        :ivar js_pattern: the JS function (see ``reverse_template_js``), \
+        built from ``py_pattern`` when asked for
+        :ivar group_map: group index to group name \
+        (see ``reverse_group_map``)
+        :ivar literal_prefix: see ``literal_prefix``
+    '''
+    def __init__(self, pattern, py_pattern, group_map, literal_prefix):
+        self.pattern = pattern
+        self.py_pattern = py_pattern
+        self.group_map = group_map
+        self.literal_prefix = literal_prefix
+
+    @property
+    def regex(self):
+        return re.compile(self.pattern)
+
+    @property
+    def js_pattern(self):
+        from surly.js import js_from_template
+        return js_from_template(self.py_pattern)
+
+def compile_pattern(re_str):
+    ''' Parse ``re_str`` once and derive all of its reversers, its group
+        map and its literal prefix from that one parse.
+
+        :param re_str: the regular expression
+        :type re_str: string
+        :rtype: ``CompiledPattern``
+    '''
+    flags, ast, group_index_map = _parse(re_str)
+    python_reverser = PythonReverser()
+    _recursive_parse(ast, group_index_map, python_reverser)
+    return CompiledPattern(re_str, python_reverser.value(), group_index_map,
+                           _literal_prefix(flags, ast))
+
 def reverse_template(re_str):
     ''' Turn a regular expression into a python format string
 
@@ -150,12 +479,7 @@ def _reverse_template(re_str, reverser):
     representing the regular expression to be reversed.
     '''
 
-    r = re.compile(re_str)
-    ast = sre_parse.parse(re_str)
-    group_indices = r.groupindex
-    group_index_map = dict((index, group) 
-                           for (group, index) in r.groupindex.items())
-
+    flags, ast, group_index_map = _parse(re_str)
     _recursive_parse(ast, group_index_map, reverser)
 
 
@@ -170,20 +494,148 @@ def reverse(re_str, kwargs):
     value that should be interpolated into the capture expression.
     '''
 
-    r = re.compile(re_str)
-    ast = sre_parse.parse(re_str)
-    group_indices = r.groupindex
-    group_index_map = dict((index, group) 
-                           for (group, index) in r.groupindex.items())
+    flags, ast, group_index_map = _parse(re_str)
     python_reverser = PythonReverser()
     _recursive_parse(ast, group_index_map, python_reverser)
     s = python_reverser.value().format(**kwargs)
     return s
 
+def literal_prefix(re_str):
+    ''' Return the run of literal characters which every string matched by
+        ``re_str`` must start with.  The run ends at the first element of
+        the pattern which is not a plain literal (a group, a repeat, a
+        character class, ...).
+
+        :param re_str: the regular expression
+        :type re_str: string
+    '''
+    flags, ast, group_index_map = _parse(re_str)
+    return _literal_prefix(flags, ast)
+
+def _literal_prefix(flags, ast):
+    if flags & re.IGNORECASE:
+        return ''
+    prefix = []
+    for item in ast:
+        item_type = item[0]
+        if item_type == LITERAL:
+            prefix.append(unichr(item[1]))
+        elif item_type == AT and item[1] == AT_BEGINNING and not prefix:
+            pass
+        else:
+            break
+    return u''.join(prefix)
+
 def reverse_group_map(re_str):
-    r = re.compile(re_str)
-    ast = sre_parse.parse(re_str)
-    group_indices = r.groupindex
-    group_index_map = dict((index, group) 
-                           for (group, index) in r.groupindex.items())
+    flags, ast, group_index_map = _parse(re_str)
     return group_index_map
+
+_text = type(u'')
+
+try:
+    _intern = intern
+except NameError:
+    # Python 3
+    from sys import intern as _intern
+
+def share(text):
+    ''' Return the interned copy of ``text``, so that equal strings held
+        by many urls (group names, literal prefixes) are stored once.
+        Python 2 cannot intern unicode strings, which are returned as is.
+    '''
+    try:
+        return _intern(text)
+    except TypeError:
+        return text
+
+def _missing_argument(template, kwargs):
+    fields = [field for literal, field, spec, conversion
+              in string.Formatter().parse(template) if field is not None]
+    missing = [field for field in fields if field not in kwargs]
+    return MissingArgumentError('Missing argument %r for URL template %r'
+                                % (missing[0], template))
+
+def _reverse_parts(template):
+    ''' Split ``template`` into its literal parts and its fields, as a list
+        of ``(is_field, text)`` pairs
+    '''
+    parts = []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        if literal:
+            parts.append((False, _text(literal)))
+        if field is not None:
+            parts.append((True, str(field)))
+    if not any(is_field for is_field, text in parts):
+        return [(False, _text(template.format()))]
+    return parts
+
+def _reverse_source(template, name='reverse'):
+    ''' The source of a function equivalent to ``reverse_function``'s,
+        named ``name``.  It refers to ``_text`` and ``_missing_argument``.
+    '''
+    parts = _reverse_parts(template)
+    source = ['def %s(kwargs, _text=_text):' % name]
+    if len(parts) == 1 and not parts[0][0]:
+        source.append('    return %r' % parts[0][1])
+        return '\n'.join(source)
+    source.extend([
+        '    try:',
+        '        return %s' % ' + '.join(
+            '_text(kwargs[%r])' % text if is_field else repr(text)
+            for is_field, text in parts),
+        '    except KeyError:',
+        '        raise _missing_argument(%r, kwargs)' % template])
+    return '\n'.join(source)
+
+# Code objects of reverse functions, by the shape of their template: the
+# fields, with None in place of each literal part
+_reverse_code = {}
+_reverse_globals = {'_missing_argument': _missing_argument,
+                    '__builtins__': __builtins__}
+
+def reverse_function(template):
+    ''' Generate a function equivalent to ``template.format(**kwargs)`` for
+        a python format string produced by ``reverse_template``.  The
+        function takes the kwargs as a single dict and concatenates the
+        literal parts of the template with the argument values directly.
+        An optional second argument replaces the function used to turn each
+        value into text (e.g. to escape it).
+
+        Templates with the same fields in the same places share one code
+        object; the literal parts are the defaults of the other arguments.
+
+        :param template: the python format string
+        :type template: string
+        :raises MissingArgumentError: (from the generated function) if a \
+        value is missing
+    '''
+    parts = _reverse_parts(template)
+    shape = tuple(text if is_field else None for is_field, text in parts)
+    code = _reverse_code.get(shape)
+    if code is None:
+        literals = []
+        terms = []
+        for is_field, text in parts:
+            if is_field:
+                terms.append('_text(kwargs[%r])' % text)
+            else:
+                terms.append('_l%d' % len(literals))
+                literals.append('_l%d=None' % len(literals))
+        source = ['def reverse(%s):' % ', '.join(
+            ['kwargs', '_text=None', '_template=None'] + literals)]
+        if shape == (None,):
+            source.append('    return _l0')
+        else:
+            source.extend(['    try:',
+                           '        return %s' % ' + '.join(terms),
+                           '    except KeyError:',
+                           '        raise _missing_argument(_template, '
+                           'kwargs)'])
+        namespace = dict(_reverse_globals)
+        exec(compile('\n'.join(source), '<surly reverse>', 'exec'),
+             namespace)
+        code = _reverse_code[shape] = namespace['reverse'].__code__
+    defaults = [_text, template]
+    defaults.extend(share(text) for is_field, text in parts if not is_field)
+    return types.FunctionType(code, _reverse_globals, 'reverse',
+                              tuple(defaults))
@@ -0,0 +1,329 @@
+''' Profile-guided reordering of a route table.
+
+    ``match`` returns the first url, in table order, whose pattern matches
+    the path.  Moving a url ahead of another therefore only preserves the
+    result of every match if the two patterns can never match the same
+    path.  ``reorder`` moves frequently hit urls as early as that allows:
+    it only lets a url overtake urls which ``can_overlap`` proves disjoint
+    from it, so the reordered table resolves every path exactly as the
+    original one did.
+
+    The proof works on the patterns' ``sre_parse`` ASTs.  Each pattern is
+    reduced to the sequence of character sets its matches must start with
+    (and, where the pattern ends with ``$``, where they must end).  Two
+    patterns are disjoint if, at some position, their sets cannot share a
+    character, or one must end where the other needs another character.
+    Anything the analysis does not understand (alternations, lookarounds,
+    case-insensitive patterns, ...) ends the sequence, and two patterns
+    are only declared disjoint on positive proof.
+
+    A profile is a JSON object mapping route keys (the url's name, or its
+    pattern if unnamed) to hit counts, such as the output of
+    ``python -m surly.classify --json`` or the ``matches`` of an
+    ``Instrumentation`` snapshot.  Apply one at startup with
+    ``Mapper(urls, profile='profile.json')`` or ``Mapper.reorder``, or
+    preview its effect with::
+
+        python -m surly.reorder myapp.urls:mapper profile.json
+'''
+import bisect
+import heapq
+import json
+import re
+import sys
+
+from surly._sre import (LITERAL, NOT_LITERAL, IN, ANY, RANGE, NEGATE,
+                        CATEGORY, SUBPATTERN, AT, AT_BEGINNING, AT_END,
+                        MAX_REPEAT, MIN_REPEAT, sre_constants, sre_parse)
+from surly.instrument import route_key
+
+try:
+    unichr
+except NameError:
+    # Python 3
+    unichr = chr
+
+# Flags which change what literals, "." or "$" match
+_UNSUPPORTED_FLAGS = re.IGNORECASE | re.MULTILINE | re.LOCALE
+
+# A fixed repeat longer than this ends the analysed sequence
+_MAX_EXPANSION = 64
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: r'\d',
+    sre_constants.CATEGORY_NOT_DIGIT: r'\D',
+    sre_constants.CATEGORY_SPACE: r'\s',
+    sre_constants.CATEGORY_NOT_SPACE: r'\S',
+    sre_constants.CATEGORY_WORD: r'\w',
+    sre_constants.CATEGORY_NOT_WORD: r'\W',
+}
+
+class _Charset(object):
+    ''' The characters allowed at one position.  ``literal`` is set when
+        exactly one character is allowed, and ``ranges`` when the set is a
+        plain union of characters and ranges (as ``(low, high)`` code
+        points).  ``contains`` tests a single character.
+    '''
+    def __init__(self, contains, literal=None, ranges=None):
+        self.contains = contains
+        self.literal = literal
+        self.ranges = ranges
+
+# Marks the position where a pattern ending in "$" ends
+_END = object()
+
+_literal_sets = {}
+
+def _literal_set(code):
+    charset = _literal_sets.get(code)
+    if charset is None:
+        char = unichr(code)
+        charset = _Charset(lambda c: c == char, char, [(code, code)])
+        _literal_sets[code] = charset
+    return charset
+
+def _in_set(items, flags):
+    tests = []
+    ranges = []
+    negate = False
+    for op, value in items:
+        if op == LITERAL:
+            ranges.append((value, value))
+        elif op == RANGE:
+            ranges.append(value)
+        elif op == NEGATE:
+            negate = True
+        elif op == CATEGORY and value in _CATEGORIES:
+            tests.append(re.compile(_CATEGORIES[value], flags).match)
+        else:
+            return None
+    plain = ranges
+    def contains(c):
+        code = ord(c)
+        found = (any(low <= code <= high for low, high in plain)
+                 or any(test(c) for test in tests))
+        return found != negate
+    if negate or tests:
+        return _Charset(contains)
+    if len(plain) == 1 and plain[0][0] == plain[0][1]:
+        return _Charset(contains, unichr(plain[0][0]), plain)
+    return _Charset(contains, ranges=plain)
+
+def _single(item, flags):
+    ''' The charset of an AST item matching exactly one character, or
+        ``None``
+    '''
+    op, value = item
+    if op == LITERAL:
+        return _literal_set(value)
+    if op == NOT_LITERAL:
+        char = unichr(value)
+        return _Charset(lambda c: c != char)
+    if op == ANY:
+        if flags & re.DOTALL:
+            return _Charset(lambda c: True)
+        return _Charset(lambda c: c != '\n')
+    if op == IN:
+        return _in_set(value, flags)
+    return None
+
+def _flatten(ast, out, flags):
+    ''' Append the positions required by ``ast`` to ``out``.  Returns
+        ``False`` where the sequence must end.
+    '''
+    for item in ast:
+        op, value = item
+        charset = _single(item, flags)
+        if charset is not None:
+            out.append(charset)
+        elif op == SUBPATTERN:
+            # (group, [add_flags, del_flags,] pattern)
+            if len(value) > 2 and (value[1] or value[2]):
+                return False
+            if not _flatten(value[-1], out, flags):
+                return False
+        elif op == AT and value == AT_BEGINNING and not out:
+            pass
+        elif op == AT and value == AT_END:
+            out.append(_END)
+            return False
+        elif op in (MAX_REPEAT, MIN_REPEAT):
+            low, high, subpattern = value
+            if low == 0:
+                return False
+            inner = []
+            complete = _flatten(subpattern, inner, flags)
+            if _END in inner:
+                return False
+            if complete and low == high and low * len(inner) <= _MAX_EXPANSION:
+                out.extend(inner * low)
+                continue
+            # The first repetition, at least, is certain
+            out.extend(inner)
+            return False
+        else:
+            return False
+    return True
+
+def shape(u):
+    ''' The sequence of ``_Charset`` (and ``_END``) which every path matched
+        by ``u`` must follow, from its start.  Paths may continue past the
+        end of the sequence unless it ends with ``_END``.  ``None`` if the
+        pattern cannot be analysed at all.
+    '''
+    flags = u.regex.flags
+    if flags & _UNSUPPORTED_FLAGS:
+        return None
+    out = []
+    _flatten(sre_parse.parse(u.pattern), out, flags)
+    return out
+
+def _disjoint_sets(a, b):
+    if a.literal is not None:
+        return not b.contains(a.literal)
+    if b.literal is not None:
+        return not a.contains(b.literal)
+    if a.ranges is not None and b.ranges is not None:
+        for low, high in a.ranges:
+            for other_low, other_high in b.ranges:
+                if low <= other_high and other_low <= high:
+                    return False
+        return True
+    return False
+
+def _ends_before(position, other):
+    ''' A pattern ends at ``position``: is ``other`` sure to need more?
+        ("$" also matches before a final newline.)
+    '''
+    if position >= len(other):
+        return False
+    charset = other[position]
+    if charset is _END:
+        return False
+    if not charset.contains('\n'):
+        return True
+    # other needs "\n" here; it is disjoint if it needs more after that
+    following = position + 1
+    return following < len(other) and other[following] is not _END
+
+def shapes_overlap(a, b, start=0):
+    ''' Whether patterns with shapes ``a`` and ``b`` might match the same
+        path.  ``False`` is a proof that they cannot.  Positions before
+        ``start`` are known to agree.
+    '''
+    if a is None or b is None:
+        return True
+    for position in range(start, min(len(a), len(b))):
+        x = a[position]
+        y = b[position]
+        if x is _END and y is _END:
+            return True
+        if x is _END:
+            return not _ends_before(position, b)
+        if y is _END:
+            return not _ends_before(position, a)
+        if _disjoint_sets(x, y):
+            return False
+    return True
+
+def can_overlap(a, b):
+    ''' Whether urls ``a`` and ``b`` might match the same path.  ``False``
+        means they provably cannot, so their relative order does not matter.
+    '''
+    return shapes_overlap(shape(a), shape(b))
+
+def _overlapping_pairs(urls):
+    ''' Yield ``(i, j)``, ``i < j``, for every pair of urls which might
+        overlap.  Urls can only overlap when one's literal prefix starts
+        with the other's, so only those pairs are analysed.
+    '''
+    shapes = {}
+    def shape_of(index):
+        if index not in shapes:
+            shapes[index] = shape(urls[index])
+        return shapes[index]
+
+    prefixes = sorted((u.literal_prefix, index)
+                      for index, u in enumerate(urls))
+    keys = [prefix for prefix, index in prefixes]
+    for prefix, i in prefixes:
+        position = bisect.bisect_left(keys, prefix)
+        while position < len(keys) and keys[position].startswith(prefix):
+            j = prefixes[position][1]
+            position += 1
+            if j == i or (keys[position - 1] == prefix and j < i):
+                # Equal prefixes: each pair is seen from both sides
+                continue
+            # Both shapes start with the literal prefix
+            if shapes_overlap(shape_of(i), shape_of(j), len(prefix)):
+                yield min(i, j), max(i, j)
+
+def reorder(urls, hits):
+    ''' Return ``urls`` reordered so that urls with more ``hits`` (a dict
+        of route key to count) come as early as possible, while every url
+        stays behind all the earlier urls which it might overlap.  Urls
+        with equal counts keep their relative order.
+    '''
+    followers = [[] for u in urls]
+    waiting = [0] * len(urls)
+    for i, j in _overlapping_pairs(urls):
+        followers[i].append(j)
+        waiting[j] += 1
+    ready = [(-hits.get(route_key(u), 0), index)
+             for index, u in enumerate(urls) if not waiting[index]]
+    heapq.heapify(ready)
+    ordered = []
+    while ready:
+        count, index = heapq.heappop(ready)
+        ordered.append(urls[index])
+        for j in followers[index]:
+            waiting[j] -= 1
+            if not waiting[j]:
+                heapq.heappush(ready, (-hits.get(route_key(urls[j]), 0), j))
+    return ordered
+
+def load_profile(path):
+    ''' Read a profile: a JSON object of route key to hit count, or an
+        ``Instrumentation`` snapshot (whose ``matches`` are used)
+    '''
+    with open(path) as f:
+        profile = json.load(f)
+    if isinstance(profile.get('matches'), dict):
+        profile = profile['matches']
+    return profile
+
+def mean_position(urls, hits):
+    ''' The mean position in ``urls`` of the url hit, weighted by ``hits``:
+        roughly how many urls a linear scan tries per request
+    '''
+    total = weighted = 0
+    for position, u in enumerate(urls):
+        count = hits.get(route_key(u), 0)
+        total += count
+        weighted += count * (position + 1)
+    return float(weighted) / total if total else 0.0
+
+def main(argv=None):
+    import argparse
+    from surly.classify import load_mapper
+    parser = argparse.ArgumentParser(
+        prog='python -m surly.reorder',
+        description='Show the effect of reordering routes by a profile.')
+    parser.add_argument('mapper', help='the Mapper, as "module:attribute"')
+    parser.add_argument('profile', help='JSON hit counts per route')
+    args = parser.parse_args(argv)
+    mapper = load_mapper(args.mapper)
+    hits = load_profile(args.profile)
+    ordered = reorder(mapper.urls, hits)
+    before = dict((id(u), index) for index, u in enumerate(mapper.urls))
+    for index, u in enumerate(ordered):
+        if before[id(u)] != index:
+            sys.stdout.write('%6d -> %6d  %8d  %s\n'
+                             % (before[id(u)], index,
+                                hits.get(route_key(u), 0), route_key(u)))
+    sys.stdout.write('mean position of a hit: %.1f -> %.1f\n'
+                     % (mean_position(mapper.urls, hits),
+                        mean_position(ordered, hits)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+''' On-disk cache of a ``Mapper``'s compiled route table.
+
+    Building a large ``Mapper`` means parsing every url pattern to produce
+    its Python reverse template, its group map and its literal prefix (from
+    which the dispatch index is built).  Pre-fork servers do this once per
+    worker.  This module saves those artifacts to a JSON
+    file so that later constructions of the same table can load them
+    instead.
+
+    The file records a fingerprint of the final url patterns and names,
+    the replacements, and the surly and Python versions.  It is only used
+    when the fingerprint matches the table being built; otherwise the
+    table is compiled normally and the file rewritten.  Only strings and
+    ints are stored.  Targets and ``extra_args`` always come from the live
+    ``url`` objects.
+'''
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import surly
+
+FORMAT_VERSION = 2
+
+class TableCacheError(Exception):
+    pass
+
+def fingerprint(mapper):
+    ''' Return a hex digest identifying ``mapper``'s url definitions.  The
+        url patterns have already had their prefix and replacements applied
+        at this point, so those are covered too.
+    '''
+    h = hashlib.sha1()
+    header = [FORMAT_VERSION, surly.__version__, list(sys.version_info[:2]),
+              sorted((mapper.replacements or {}).items())]
+    h.update(json.dumps(header).encode('utf8'))
+    for u in mapper.urls:
+        h.update(json.dumps([u.pattern, u.name]).encode('utf8'))
+    return h.hexdigest()
+
+def _compiled_urls(mapper):
+    # Mounted Mappers (see include) have table caches of their own
+    return [u for u in mapper.urls if not u.is_mount]
+
+# Unlike os.rename, replaces an existing file on Windows too
+_replace = getattr(os, 'replace', os.rename)
+
+def write_atomically(path, text):
+    ''' Write ``text`` to a temporary file next to ``path`` and rename it
+        into place, so that readers never see a partial file
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        _replace(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+def dump(mapper, path):
+    ''' Write the compiled artifacts of ``mapper`` to ``path``.  The file is
+        written to a temporary name and renamed into place, so concurrent
+        workers never read a partial file.
+    '''
+    routes = []
+    for u in _compiled_urls(mapper):
+        routes.append([u.pattern, u.py_pattern, sorted(u.group_map.items()),
+                       u.literal_prefix])
+    data = {'format': FORMAT_VERSION,
+            'fingerprint': fingerprint(mapper),
+            'routes': routes}
+    write_atomically(path, json.dumps(data, separators=(',', ':')))
+
+def load(mapper, path):
+    ''' Load compiled artifacts from ``path`` into ``mapper``'s urls.
+
+        :raises TableCacheError: if the file cannot be read or was not \
+        built from the same route table
+    '''
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        raise TableCacheError('Cannot read table cache %s: %s' % (path, e))
+    urls = _compiled_urls(mapper)
+    if (not isinstance(data, dict)
+            or data.get('format') != FORMAT_VERSION
+            or data.get('fingerprint') != fingerprint(mapper)
+            or len(data.get('routes', ())) != len(urls)):
+        raise TableCacheError('Table cache %s is stale' % path)
+    for u, record in zip(urls, data['routes']):
+        pattern, py_pattern, group_map, prefix = record
+        if pattern != u.pattern:
+            raise TableCacheError('Table cache %s is stale' % path)
+        u._load_compiled(py_pattern,
+                         dict((index, name) for index, name in group_map),
+                         prefix)
+
+def load_or_build(mapper, path):
+    ''' Load ``mapper``'s compiled artifacts from ``path`` if it is current,
+        otherwise compile them and rewrite ``path``.  Rewriting is best
+        effort: if ``path`` cannot be written, the table is still compiled.
+    '''
+    try:
+        load(mapper, path)
+        return
+    except TableCacheError:
+        pass
+    for u in mapper.urls:
+        u._ensure_compiled()
+    try:
+        dump(mapper, path)
+    except (IOError, OSError):
+        # A read-only or full disk only costs the next build its head start
+        pass
@@ -0,0 +1,139 @@
+import unittest
+
+from surly.mapper import Mapper, url, include
+from surly import adapters
+
+try:
+    from tornado.testing import AsyncHTTPTestCase
+    from tornado.web import RequestHandler
+except ImportError:
+    AsyncHTTPTestCase = unittest.TestCase
+    RequestHandler = object
+    tornado = False
+else:
+    tornado = True
+
+
+class ItemHandler(adapters.SurlyTornadoMixin, RequestHandler):
+    def initialize(self, label):
+        self.label = label
+
+    def get(self, id, slug=None):
+        self.write('%s %s %s %s' % (self.label, id, slug,
+                                    self.reverse('item', id=id, slug=slug)))
+
+
+class HomeHandler(adapters.SurlyTornadoMixin, RequestHandler):
+    def get(self):
+        self.write(self.reverse_url('item', 5, 'x y'))
+
+
+class ShopHandler(adapters.SurlyTornadoMixin, RequestHandler):
+    def get(self, id):
+        # Names of a mounted Mapper
+        self.write('%s %s' % (self.reverse('shop:item', id=id),
+                              self.reverse_url('shop:item', 4)))
+
+
+class PlainHandler(adapters.SurlyTornadoMixin, RequestHandler):
+    def get(self, id):
+        # A plain Tornado rule, reversed by the application
+        self.write(self.reverse('plain', int(id) + 1))
+
+
+@unittest.skipIf(not tornado, 'Tornado is not installed')
+class TornadoRouterTestCase(AsyncHTTPTestCase):
+    def get_app(self):
+        mapper = Mapper([
+            url(r'^/$', HomeHandler, name='home'),
+            include(r'^/items/', [
+                url(r'(?P<id>\d+)/(?P<slug>[^/]+)$', ItemHandler,
+                    extra_args={'label': 'item'}, name='item'),
+            ]),
+            include(r'^/shop/', Mapper([
+                url(r'items/(?P<id>\d+)$', ShopHandler, name='item'),
+            ]), namespace='shop'),
+        ])
+        return adapters.tornado_application(mapper, [
+            (r'/plain/(\d+)', PlainHandler, None, 'plain')])
+
+    def test_dispatch(self):
+        response = self.fetch('/items/3/a%20b')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b'item 3 a b /items/3/a%20b')
+
+    def test_reverse_url(self):
+        response = self.fetch('/')
+        self.assertEqual(response.body, b'/items/5/x%20y')
+
+    def test_not_found(self):
+        self.assertEqual(self.fetch('/items/x').code, 404)
+
+    def test_reverse_mounted(self):
+        response = self.fetch('/shop/items/3')
+        self.assertEqual(response.body, b'/shop/items/3 /shop/items/4')
+
+    def test_reverse_plain(self):
+        self.assertEqual(self.fetch('/plain/3').body, b'/plain/4')
+
+
+def wsgi_target(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    body = '%s %s %s' % (environ['surly.url'].name,
+                         sorted(environ['surly.kwargs'].items()),
+                         sorted(environ['surly.extra_args'].items()))
+    return [body.encode('utf8')]
+
+
+class WSGIApplicationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = adapters.SurlyWSGIApplication(Mapper([
+            url(r'^/$', wsgi_target, name='home'),
+            include(r'^/items/', [
+                url(r'(?P<id>\d+)$', wsgi_target, extra_args={'n': 1},
+                    name='item'),
+            ]),
+            url(r'^/new$', wsgi_target, name='new', methods=['POST'],
+                host='admin.example.com'),
+        ]))
+
+    def call(self, path, method='GET', host='www.example.com'):
+        response = {}
+        def start_response(status, headers):
+            response['status'] = status
+        environ = {'PATH_INFO': path, 'REQUEST_METHOD': method,
+                   'HTTP_HOST': host}
+        body = b''.join(self.app(environ, start_response))
+        return response['status'], body.decode('utf8'), environ
+
+    def test_static(self):
+        status, body, environ = self.call('/')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(body, 'home [] []')
+        self.assertEqual(environ['wsgiorg.routing_args'], ((), {}))
+
+    def test_dynamic(self):
+        status, body, environ = self.call('/items/7')
+        self.assertEqual(body, "item [('id', '7')] [('n', 1)]")
+        self.assertEqual(environ['wsgiorg.routing_args'], ((), {'id': '7'}))
+
+    def test_not_found(self):
+        status, body, environ = self.call('/items/x')
+        self.assertEqual(status, '404 Not Found')
+        self.assertTrue('surly.url' not in environ)
+
+    def test_instrumented(self):
+        mapper = self.app.mapper
+        instrumentation = mapper.instrument(interval=3600)
+        mapper.prepare()
+        self.call('/')
+        self.call('/')
+        self.assertEqual(instrumentation.snapshot()['matches'], {'home': 2})
+        mapper.uninstrument()
+
+    def test_method_and_host(self):
+        self.assertEqual(self.call('/new', 'POST', 'admin.example.com')[1],
+                         'new [] []')
+        self.assertEqual(self.call('/new', 'GET', 'admin.example.com')[0],
+                         '404 Not Found')
+        self.assertEqual(self.call('/new', 'POST')[0], '404 Not Found')
@@ -0,0 +1,95 @@
+import sys
+import unittest
+
+from surly.mapper import Mapper, url, include
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from surly.asgi import SurlyASGIApplication
+
+
+def done(value=None):
+    future = asyncio.Future()
+    future.set_result(value)
+    return future
+
+
+def target(scope, receive, send):
+    body = '%s %s %s' % (scope['surly.url'].name,
+                         sorted(scope['path_params'].items()),
+                         sorted(scope['surly.extra_args'].items()))
+    send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    return send({'type': 'http.response.body', 'body': body.encode('utf8')})
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'ASGI needs Python 3.5')
+class ASGIApplicationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.mapper = Mapper([
+            url(r'^/$', target, name='home'),
+            include(r'^/items/', [
+                url(r'(?P<id>\d+)$', target, extra_args={'n': 1},
+                    name='item'),
+            ]),
+        ])
+        self.app = SurlyASGIApplication(self.mapper)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def call(self, scope, incoming=()):
+        incoming = list(incoming)
+        sent = []
+        def receive():
+            return done(incoming.pop(0))
+        def send(message):
+            sent.append(message)
+            return done()
+        self.loop.run_until_complete(self.app(scope, receive, send))
+        return sent
+
+    def get(self, path):
+        scope = {'type': 'http', 'path': path}
+        sent = self.call(scope)
+        return sent[0]['status'], sent[1]['body'].decode('utf8'), scope
+
+    def test_prepared(self):
+        assert self.mapper._dispatcher is not None
+        assert self.mapper._dispatcher.root.children['/'].matcher is not None
+        assert None in self.mapper._statics
+
+    def test_static(self):
+        status, body, scope = self.get('/')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, 'home [] []')
+        self.assertTrue('path_params' not in scope)
+
+    def test_instrumented(self):
+        instrumentation = self.mapper.instrument(interval=3600)
+        self.mapper.prepare()
+        self.get('/')
+        self.assertEqual(instrumentation.snapshot()['matches'], {'home': 1})
+        self.mapper.uninstrument()
+
+    def test_dynamic(self):
+        status, body, scope = self.get('/items/7')
+        self.assertEqual(body, "item [('id', '7')] [('n', 1)]")
+
+    def test_not_found(self):
+        status, body, scope = self.get('/items/x')
+        self.assertEqual(status, 404)
+
+    def test_websocket_not_found(self):
+        sent = self.call({'type': 'websocket', 'path': '/items/x'})
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': 1000}])
+
+    def test_lifespan(self):
+        sent = self.call({'type': 'lifespan'},
+                         [{'type': 'lifespan.startup'},
+                          {'type': 'lifespan.shutdown'}])
+        self.assertEqual([message['type'] for message in sent],
+                         ['lifespan.startup.complete',
+                          'lifespan.shutdown.complete'])
@@ -0,0 +1,25 @@
+import json
+import unittest
+
+from surly.bench import suite
+from surly.mapper import Mapper
+
+
+class BenchSuiteTestCase(unittest.TestCase):
+    def test_make_urls(self):
+        for count in (1, 10, 57):
+            m = Mapper(suite.make_urls(count), replacements=suite.REPLACEMENTS)
+            assert len(m.urls) == count, (count, len(m.urls))
+            for u in m.urls:
+                path = u.reverse(**suite.sample_kwargs(u))
+                assert m.match(path) is not None, path
+
+    def test_run(self):
+        results = json.loads(json.dumps(suite.run([10], calls=50)))
+        result = results['results'][0]
+        assert result['routes'] == 10
+        assert result['js_mapper']['minified']['bytes'] > 0
+        assert 'p99' in result['match_latency_us']
+        compared = list(suite.compare(results, results))
+        assert (10, 'reverse_per_second', result['reverse_per_second'],
+                result['reverse_per_second']) in compared
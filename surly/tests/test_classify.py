@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from surly.mapper import url
+from surly import classify
+
+urls = [
+    url(r'^/$', None, name='home'),
+    url(r'^/items/(?P<id>\d+)$', None, name='item'),
+    url(r'^/about$', None),
+]
+
+LINES = [
+    '127.0.0.1 - - [10/Oct/2012:13:55:36 -0700] "GET / HTTP/1.1" 200 2326',
+    '127.0.0.1 - - [10/Oct/2012:13:55:37 -0700] "GET /items/5?x=1 HTTP/1.1" '
+    '200 100 "-" "Mozilla/5.0"',
+    '127.0.0.1 - - [10/Oct/2012:13:55:38 -0700] "POST /items/6 HTTP/1.1" 201 0',
+    '127.0.0.1 - - [10/Oct/2012:13:55:39 -0700] "GET /about HTTP/1.1" 200 7',
+    '127.0.0.1 - - [10/Oct/2012:13:55:40 -0700] "GET /missing HTTP/1.1" 404 0',
+    'garbage',
+]
+
+EXPECTED = {'home': 1, 'item': 2, r'^/about$': 1,
+            classify.UNMATCHED: 1, classify.UNPARSED: 1}
+
+
+class ClassifyTestCase(unittest.TestCase):
+    spec = __name__ + ':urls'
+
+    def test_in_process(self):
+        counts = classify.classify(LINES, self.spec, processes=1)
+        self.assertEqual(dict(counts), EXPECTED)
+
+    def test_process_pool(self):
+        counts = classify.classify(LINES * 50, self.spec, processes=2,
+                                   chunk_size=7)
+        self.assertEqual(dict(counts),
+                         dict((key, count * 50)
+                              for key, count in EXPECTED.items()))
+
+    def test_chunked(self):
+        chunks = list(classify.chunked(range(5), 2))
+        self.assertEqual(chunks, [[0, 1], [2, 3], [4]])
+
+    def test_main(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'access.log')
+            with open(path, 'w') as f:
+                f.write('\n'.join(LINES) + '\n')
+            out_path = os.path.join(directory, 'out.json')
+            import sys
+            stdout = sys.stdout
+            sys.stdout = open(out_path, 'w')
+            try:
+                classify.main([self.spec, path, '-p', '1', '--json'])
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            import json
+            with open(out_path) as f:
+                self.assertEqual(json.load(f), EXPECTED)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,126 @@
+import sys
+import unittest
+
+from surly.mapper import Mapper, url, include
+from surly.re_parse import literal_prefix
+from surly.dispatch import PrefixTree, _SegmentMatcher
+from surly.converters import convert, expand
+
+
+class LiteralPrefixTestCase(unittest.TestCase):
+    prefixes = [
+        (r'^/api/v2/accounts/(?P<id>\d+)$', u'/api/v2/accounts/'),
+        (r'/home', u'/home'),
+        (r'^/foo$', u'/foo'),
+        (r'^/fo+', u'/f'),
+        # Python 3.7 and later splice the group into the pattern
+        (r'^/(?:a)b', u'/ab' if sys.version_info >= (3, 7) else u'/'),
+        (r'^/[ab]', u'/'),
+        (r'(?P<x>.)', u''),
+        (r'(?i)^/abc', u''),
+        (r'^/a|^/b', u'/'),
+        (r'^/a|/b', u''),
+    ]
+
+    def test_prefixes(self):
+        for re_str, expected in self.prefixes:
+            self.assertEqual(literal_prefix(re_str), expected)
+
+
+class PrefixTreeTestCase(unittest.TestCase):
+    def test_split_edges(self):
+        urls = [url(r'^/api/v2/accounts/(?P<id>\d+)$', 'account'),
+                url(r'^/api/v2/users/(?P<id>\d+)$', 'user'),
+                url(r'^/api/v1/(?P<rest>.*)$', 'v1'),
+                url(r'^/api/(?P<rest>.*)$', 'api')]
+        tree = PrefixTree(enumerate(urls))
+        order, u, kwargs = tree.match('/api/v2/users/4')
+        assert u.target == 'user' and kwargs == {'id': '4'}
+        assert tree.match('/api/v1/x')[1].target == 'v1'
+        assert tree.match('/api/v2/accounts/x')[1].target == 'api'
+        assert tree.match('/other') is None
+
+    def test_order_across_nodes(self):
+        m = Mapper([
+            url(r'^/(?P<any>.*)$', 'catchall'),
+            url(r'^/static/(?P<path>.*)$', 'static'),
+        ])
+        assert m.match('/static/x').target == 'catchall'
+        m = Mapper([
+            url(r'^/static/(?P<path>.*)$', 'static'),
+            url(r'^/(?P<any>.*)$', 'catchall'),
+        ])
+        assert m.match('/static/x').target == 'static'
+        assert m.match('/x').target == 'catchall'
+
+    def test_include_prefix(self):
+        m = Mapper([
+            include('/app', [url(r'/item/(?P<id>\d+)', 'item'),
+                             url(r'/item/(?P<slug>\w+)', 'slug')]),
+            url(r'/app/item/(?P<other>\w+)', 'outer'),
+        ])
+        result = m.match('/app/item/5')
+        assert result.target == 'item' and result.kwargs == {'id': '5'}
+        assert m.match('/app/item/abc').target == 'slug'
+        assert m.urls[0].literal_prefix == u'/app/item/'
+
+
+class SegmentMatcherTestCase(unittest.TestCase):
+    patterns = [
+        r'^/items/new$',
+        r'^/items/<int:id>$',
+        r'^/items/<int:id>/\.json$',
+        r'^/items/<slug:name>/$',
+        r'^/items/(?P<any>\w+)$',
+        r'^/<str:page>$',
+        r'^/files/<path:rest>$',
+        r'^/u/<uuid:key>$',
+    ]
+    paths = ['/items/new', '/items/12', '/items/12\n', '/items/12/.json',
+             '/items/12/xjson', '/items/a-b/', '/items/a-b/\n',
+             '/items/a_b', '/items/', '/x', '/x\n', '/', '/files/a/b',
+             '/u/12345678-1234-5678-1234-567812345678',
+             '/u/12345678-1234-5678-1234-56781234567',
+             '/u/12345678-1234-5678-1234-567812345678\n', '/items/12/x/y']
+
+    def test_segments(self):
+        urls = [url(pattern, pattern) for pattern in self.patterns]
+        self.assertEqual(
+            [u.segments is not None for u in urls],
+            [False, True, True, True, False, True, False, True])
+        self.assertEqual(urls[2].segments[:2], ('', 'items'))
+        self.assertEqual(urls[2].segments[3], '.json')
+
+    def test_same_as_regex(self):
+        typed = Mapper([url(pattern, pattern) for pattern in self.patterns])
+        plain = Mapper([url(expand(pattern)[0], pattern)
+                        for pattern in self.patterns])
+        matchers = set(type(matcher) for node in [
+            typed._get_dispatcher().root.children['/']]
+            for matcher in node.compile().matchers)
+        assert _SegmentMatcher in matchers
+        for path in self.paths:
+            expected = plain.match(path)
+            result = typed.match(path)
+            if expected is None:
+                assert result is None, path
+                continue
+            assert result.target == expected.target, path
+            self.assertEqual(result.kwargs,
+                             convert(expected.kwargs, result.url.converters))
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_eviction_order(self):
+        from surly.cache import LRUCache
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1
+        cache.put('c', 3)
+        assert cache.get('b') is LRUCache.missing
+        assert cache.get('a') == 1 and cache.get('c') == 3
+        generation = cache.generation
+        cache.clear()
+        cache.put('d', 4, generation)
+        assert cache.get('d') is LRUCache.missing
@@ -17,4 +17,8 @@ class JSTestCase(unittest.TestCase):
         expected = '''function(fields){return ""+fields["foo"]+"aa";}'''
         print '>', expected, '<'
         print '>', value, '<'
-        assert value == expected, value
\ No newline at end of file
+        assert value == expected, value
+    def test_literal_after_quote(self):
+        value = reverse_template_js(r'"a\\')
+        expected = '''function(fields){return ""+'"'+"a\\\\";}'''
+        assert value == expected, value
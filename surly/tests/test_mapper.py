@@ -56,3 +56,663 @@ class MapperTestCase(unittest.TestCase):
         m.urls[0].apply_replacements(**{'home':'bar'})
         expected = '/foo'
         assert expected == m.reverse('home1')
+
+    def test_match(self):
+        result = self.m.match('/foo/12')
+        assert result.url is self.m.urls[3], result
+        assert result.kwargs == {'foo': '12'}, result.kwargs
+        assert self.m.match('/foo').url is self.m.urls[2]
+        assert self.m.match('/nothing') is None
+
+    def test_match_first_wins(self):
+        m = Mapper([
+            url(r'^/a/(?P<x>\w+)$', 'first', extra_args={'n': 1}),
+            url(r'^/a/(?P<y>\d+)$', 'second'),
+            url(r'^/b/(?P<x>\d+)/(?P<y>\d+)$', 'third'),
+        ])
+        result = m.match('/a/5')
+        assert result.target == 'first', result
+        assert result.extra_args == {'n': 1}
+        assert result.kwargs == {'x': '5'}, result.kwargs
+        result = m.match('/b/1/2')
+        assert result.target == 'third'
+        assert result.kwargs == {'x': '1', 'y': '2'}, result.kwargs
+
+    def test_match_many_groups(self):
+        urls = [url(r'^/r%d/(?P<a>\d+)/(?P<b>\d+)$' % i, i)
+                for i in range(200)]
+        m = Mapper(urls)
+        result = m.match('/r150/1/2')
+        assert result.target == 150, result
+        assert result.kwargs == {'a': '1', 'b': '2'}
+
+    def test_match_backreference(self):
+        m = Mapper([
+            url(r'^/(?P<a>\w)/(?P<b>(?P=a))$', 'named'),
+            url(r'^/(?P<c>(\w)-\2)$', 'numbered'),
+            url(r'^/(?P<a>\w)-(?P<b>\w)$', 'plain'),
+        ])
+        assert m.match('/x/x').target == 'named'
+        assert m.match('/x/y') is None
+        assert m.match('/x-x').kwargs == {'c': 'x-x'}
+        assert m.match('/x-y').kwargs == {'a': 'x', 'b': 'y'}
+
+    def test_static_routes(self):
+        m = Mapper([
+            url(r'^/about/$', 'about'),
+            url(r'^/(?P<page>\w+)\.html$', 'page'),
+            url(r'^/index\.html$', 'index'),
+            url(r'^/a\.b/$', 'dotted'),
+            url(r'^/(?P<id>\d+)?$', 'optional'),
+        ])
+        static = m.static_routes()
+        assert sorted(static) == ['/a.b/', '/about/'], static
+        assert static['/about/'].target == 'about'
+        assert m.static_routes() is static
+        assert m.static_route('/about/') is static['/about/']
+        assert m.static_route('/index.html') is None
+        assert not m.binds_hosts
+        m._add_urls([url(r'^/new$', 'new')])
+        assert m.static_routes()['/new'].target == 'new'
+
+    def test_methods_and_hosts(self):
+        m = Mapper([
+            url(r'^/items/$', 'create', methods=['post'], name='create'),
+            include(r'^/api/', [
+                url(r'items/$', 'api-list', name='api-list'),
+                url(r'items/(?P<id>\d+)$', 'api-item', methods='GET'),
+            ], host='API.example.com'),
+            url(r'^/items/$', 'list', methods='GET', name='list'),
+            url(r'^/api/items/$', 'fallback'),
+        ], cache_size=10)
+        assert m.match('/items/', 'POST').target == 'create'
+        assert m.match('/items/', 'GET').target == 'list'
+        assert m.match('/items/', 'HEAD').target == 'list'
+        assert m.match('/items/', 'PUT') is None
+        # Without a method or host, nothing is filtered out
+        assert m.match('/items/').target == 'create'
+        assert m.match('/api/items/').target == 'api-list'
+        assert m.match('/api/items/', 'GET', 'api.example.com:8080'
+                       ).target == 'api-list'
+        assert m.match('/api/items/', 'GET', 'www.example.com'
+                       ).target == 'fallback'
+        assert m.match('/api/items/1', 'GET', 'api.example.com'
+                       ).kwargs == {'id': '1'}
+        assert m.match('/api/items/1', 'POST', 'api.example.com') is None
+        assert m.static_routes('GET', 'api.example.com') == {
+            '/items/': m.reverse_patterns['list'],
+            '/api/items/': m.reverse_patterns['api-list']}
+        assert m.static_route('/items/', 'POST') is \
+            m.reverse_patterns['create']
+        assert m.binds_hosts
+        assert m.match('/items/', 'post').target == 'create'
+        m._invalidate()
+        m.prepare()
+        for key in m._bucket_keys():
+            assert key is None or key in m._buckets, key
+        # The unrestricted urls are indexed once, for every bucket, and
+        # each bucket's own index only holds restricted urls
+        assert m._dispatcher is None
+        def held(tree):
+            nodes, urls = [tree.root], set()
+            while nodes:
+                node = nodes.pop()
+                urls.update(node.urls)
+                nodes.extend(node.children.values())
+            return urls
+        restricted = set(u for u in m.urls if u.methods or u.host)
+        assert held(m._shared) == set(m.urls) - restricted
+        for key, split in m._buckets.items():
+            assert split.shared is m._shared
+            assert held(split.own) <= restricted
+        m.add([url(r'^/items/$', 'put', methods='PUT'),
+               url(r'^/api/items/(?P<id>\d+)$', 'api-put', methods='PUT',
+                   host='api.example.com')])
+        m.prepare()
+        m.add([url(r'^/later$', 'later', methods='PUT')])
+        assert m.match('/items/', 'put').target == 'put'
+        assert m.match('/later', 'PUT').target == 'later'
+        assert m.match('/later', 'GET') is None
+        assert m.match('/api/items/', 'PUT', 'api.example.com'
+                       ).target == 'api-list'
+        assert m.match('/api/items/2', 'PUT', 'api.example.com'
+                       ).target == 'api-put'
+        static = m.static_routes('PUT')
+        assert dict((path, u.target) for path, u in static.items()) == {
+            '/items/': 'put', '/api/items/': 'api-list', '/later': 'later'}
+        # A bucket built after a remove merges with the shared index
+        # by the orders it was built with, not the new positions
+        m = Mapper([url(r'^/x$', 'x'),
+                    url(r'^/a/(?P<x>\w+)$', 'any'),
+                    url(r'^/a/b$', 'get', methods='GET')])
+        m.prepare()
+        m.remove(m.urls[0])
+        m.add([url(r'^/a/c$', 'post', methods='POST')])
+        assert m.match('/a/b', 'GET').target == 'any'
+        assert m.match('/a/c', 'POST').target == 'any'
+
+    def test_constraint_conflicts(self):
+        assert_raises(MapperError, Mapper, [
+            include(r'^/a/', [url(r'b$', None, host='b.example.com')],
+                    host='a.example.com')])
+        assert_raises(MapperError, Mapper, [
+            include(r'^/a/', [url(r'b$', None, methods=['POST'])],
+                    methods=['GET'])])
+        m = Mapper([include(r'^/a/', [url(r'b$', None, methods=['GET', 'PUT'],
+                                          name='b')],
+                            methods=['PUT', 'DELETE'])])
+        assert m.reverse_patterns['b'].methods == frozenset(['PUT'])
+
+    def test_reverse_absolute(self):
+        m = Mapper([
+            include(r'^/api/', [
+                url(r'items/(?P<id>\d+)$', None, name='item'),
+            ], host='api.example.com'),
+            url(r'^/$', None, name='home'),
+        ])
+        assert m.reverse('item', id=1) == '/api/items/1'
+        assert m.reverse('item', _absolute=True, id=1) == \
+            'http://api.example.com/api/items/1'
+        assert list(m.reverse_many('item', [{'id': 2}], _absolute=True,
+                                   _scheme='https')) == \
+            ['https://api.example.com/api/items/2']
+        assert_raises(MapperError, m.reverse, 'home', _absolute=True)
+
+    def test_converters(self):
+        import uuid
+        key = uuid.UUID('12345678-1234-5678-1234-567812345678')
+        m = Mapper([
+            include(r'^/<slug:section>/', [
+                url(r'items/<int:id>$', None, name='item'),
+                url(r'keys/<uuid:key>/{suffix}$', None, name='key'),
+            ]),
+            url(r'^/(?P<id>\d+)/<int:page>$', None, name='page'),
+        ], replacements={'suffix': 'info'}, cache_size=10)
+        for _ in range(2):
+            result = m.match('/news/items/12')
+            assert result.url.name == 'item'
+            assert result.kwargs == {'section': 'news', 'id': 12}
+        assert m.match('/news/items/x') is None
+        assert m.match('/a/keys/%s/info' % key).kwargs['key'] == key
+        # Converted alongside plain groups, matched by regex
+        assert m.match('/3/4').kwargs == {'id': '3', 'page': 4}
+        assert m.urls[1].segments is not None
+        assert m.urls[2].segments is None
+        assert m.reverse('item', section='news', id=12) == '/news/items/12'
+        assert m.reverse('key', section='a', key=key) == \
+            '/a/keys/%s/info' % key
+        assert_raises(ValueError, url, r'^/<nope:x>$', None)
+
+    def test_path_converter_round_trip(self):
+        from surly import codegen
+        m = Mapper([url(r'^/files/<path:rest>$', 'file', name='file'),
+                    url(r'^/tags/<str:tag>$', 'tag', name='tag')])
+        path = m.reverse('file', rest='docs/read me.txt')
+        assert path == '/files/docs/read%20me.txt', path
+        assert m.match('/files/docs/readme.txt').kwargs == \
+            {'rest': 'docs/readme.txt'}
+        assert m.urls[0].reverse(rest='a/b') == '/files/a/b'
+        assert list(m.reverse_many('file', [{'rest': 'a/b'}])) == \
+            ['/files/a/b']
+        assert m.reverse('tag', tag='a/b') == '/tags/a%2Fb'
+        module = codegen.load_source(codegen.generate(m), 'routes_path')
+        assert module.reverse('file', rest='a/b c') == '/files/a/b%20c'
+        assert module.reverse('tag', tag='a/b') == '/tags/a%2Fb'
+
+    def test_freeze(self):
+        urls = [url(r'^/{section}/(?P<id>\d+)$', None, name='item'),
+                url(r'^/about$', None, name='about')]
+        m = Mapper(urls, replacements={'section': 'items'}, cache_size=10)
+        frozen = m.freeze()
+        assert frozen.frozen and frozen.freeze() is frozen
+        assert frozen.current is frozen
+        assert frozen.urls[0] is not urls[0]
+        assert frozen._dispatcher.root.children['/'].children
+        assert frozen.static_routes() == {'/about': frozen.urls[1]}
+        assert_raises(MapperError, frozen.reorder, {'about': 10})
+        plain = Mapper([url(r'^/a$', None)]).freeze()
+        assert_raises(MapperError, plain.urls[0].apply_replacements, x='y')
+        # Later changes to the original leave the snapshot alone
+        m.reorder({'about': 10})
+        m._add_urls([url(r'^/new$', None, name='new')])
+        assert [u.name for u in m.urls] == ['about', 'item', 'new']
+        assert [u.name for u in frozen.urls] == ['item', 'about']
+        assert 'new' not in frozen.reverse_patterns
+        assert frozen.reverse('item', id=1) == '/items/1'
+        assert frozen.match('/items/1').kwargs == {'id': '1'}
+        assert Mapper([]).replacements is not Mapper([]).replacements
+
+    def test_add_remove(self):
+        import random
+        from surly.bench import suite
+        urls = suite.make_urls(200)
+        m = Mapper(urls[:100], replacements=suite.REPLACEMENTS)
+        m.prepare()
+        m.js_mapper('M')
+        m.js_mapper('M', minify=True)
+        paths = ['/', '/app1/', '/app1/about/x', '/x\n']
+        rng = random.Random(2)
+        for step in range(6):
+            names = [u.name for u in m.urls]
+            for name in rng.sample(names, 10):
+                m.remove(name if rng.random() < 0.5 else
+                         m.reverse_patterns[name])
+            m.add(urls[100 + step * 15:100 + step * 15 + 15])
+            fresh = Mapper(list(m.urls))
+            for u in m.urls:
+                path = u.reverse(**suite.sample_kwargs(u))
+                paths.extend([path, path + 'x', path[:-1]])
+            for path in paths:
+                result, expected = m.match(path), fresh.match(path)
+                assert (result and (result.url, result.kwargs)) == \
+                    (expected and (expected.url, expected.kwargs)), path
+            assert m.static_routes() == fresh.static_routes()
+            source = m.js_mapper('M')
+            assert len(source) == len(fresh.js_mapper('M'))
+            for name, u in fresh.reverse_patterns.items():
+                assert '"%s":%s' % (name, u.js_pattern) in source
+            assert m.js_mapper('M', minify=True) == \
+                fresh.js_mapper('M', minify=True)
+        assert_raises(MapperError, m.remove, 'no such name')
+        count = len(m.urls)
+        assert_raises(MapperError, m.add, [url(r'^/new$', None, name='new'),
+                                           url(r'^/x$', None, name='new')])
+        assert len(m.urls) == count and 'new' not in m.reverse_patterns
+        # Any error rolls back, and leaves the urls as they were
+        new = [url(r'/new$', 'new', name='new'),
+               url(r'/c/(?P<x>{nothing})$', 'c', name='c')]
+        assert_raises(KeyError, m.add, new, prefix='^/v1')
+        assert len(m.urls) == count and 'new' not in m.reverse_patterns
+        assert m.match('/v1/new') is None
+        assert new[0].pattern == r'/new$' and not new[0]._prefix_applied
+        m.add(new[:1], prefix='^/v1')
+        assert m.match('/v1/new').target == 'new'
+        m.remove('new')
+        m.add([url(r'/(?P<any>.*)$', 'any'), url(r'/new$', 'new')],
+              prefix='^/v2')
+        assert m.match('/v2/new').target == 'any'
+        m.remove(m.urls[-2])
+        assert m.match('/v2/new').target == 'new'
+        assert m.static_routes()['/v2/new'].target == 'new'
+
+    def test_include_mapper(self):
+        loaded = []
+        def billing():
+            loaded.append(True)
+            return [url(r'^/invoices/<int:id>$', 'invoice', name='invoice'),
+                    url(r'^/$', 'billing', name='home')]
+        shop = Mapper([url(r'^/items/(?P<id>\d+)$', 'item', name='item'),
+                       url(r'^/about$', 'shop-about', name='about')])
+        m = Mapper([
+            url(r'^/$', 'home', name='home'),
+            include(r'^/billing', billing, namespace='billing'),
+            include(r'^/shop', shop, methods='GET'),
+            url(r'^/shop/items/special$', 'special'),
+            url(r'^/shop/about$', 'about'),
+        ], cache_size=10)
+        assert m.match('/').target == 'home'
+        result = m.match('/shop/items/5', 'GET')
+        assert result.url is shop.urls[0] and result.kwargs == {'id': '5'}
+        assert m.match('/shop/items/special').target == 'special'
+        assert m.match('/shop/about', 'GET').target == 'shop-about'
+        assert m.match('/shop/about', 'POST').target == 'about'
+        # Possibly claimed by the mount, so never served as static
+        assert '/shop/about' not in m.static_routes()
+        assert m.reverse('item', id=3) == '/shop/items/3'
+        assert list(m.reverse_many('about', [{}])) == ['/shop/about']
+        assert m.reverse('home') == '/'
+        assert not loaded
+        assert m.reverse('billing:home') == '/billing/'
+        assert m.match('/billing/invoices/4').kwargs == {'id': 4}
+        assert loaded == [True]
+        assert_raises(MapperError, m.reverse, 'invoice')
+        # The mounted Mapper is shared, and its changes are seen, except
+        # by snapshots, which mount frozen copies
+        frozen = m.freeze()
+        assert frozen.match('/shop/items/5').target == 'item'
+        shop.add([url(r'^/new$', 'new', name='new')])
+        assert m.match('/shop/new').target == 'new'
+        assert frozen.match('/shop/new') is None
+        assert_raises(MapperError, include, r'^/a', [], namespace='a')
+        assert_raises(MapperError, Mapper, [include(r'^/(?P<x>\w+)', shop)])
+
+    def test_freeze_mounts(self):
+        loaded = []
+        def billing():
+            loaded.append(True)
+            return [url(r'^/$', 'billing', name='home')]
+        m = Mapper([include(r'^/billing', billing, namespace='billing')])
+        frozen = m.freeze()
+        assert not loaded
+        assert frozen.reverse('billing:home') == '/billing/'
+        mounted = frozen.urls[0].mapper()
+        assert mounted.frozen and loaded == [True]
+        assert_raises(MapperError, mounted.add, [url(r'^/x$', 'x')])
+        # The snapshot loaded it through the original's mount
+        assert m.match('/billing/').target == 'billing'
+        assert loaded == [True]
+        assert not m.urls[0].mapper().frozen
+
+    def test_include_cycle(self):
+        inner = Mapper([url(r'^/$', 'inner')])
+        outer = Mapper([include(r'^/inner', inner)])
+        assert_raises(MapperError, inner.add, [include(r'^/outer', outer)])
+        assert_raises(MapperError, outer.add, [include(r'^/self', outer)])
+        assert inner.urls[-1].target == 'inner'
+        m = Mapper([include(r'^/lazy', lambda: outer)])
+        outer.add([include(r'^/m', m)])
+        assert_raises(MapperError, m.match, '/lazy/m/')
+
+    def test_include_mapper_reverse(self):
+        shop = Mapper([url(r'^items/(?P<id>\d+)$', 'item', name='item'),
+                       url(r'^$', 'shop', name='home')])
+        m = Mapper([
+            url(r'^/$', 'home', name='home'),
+            include(r'^/shop/', shop, host='shop.example.com',
+                    namespace='shop'),
+        ])
+        assert m.reverse('shop:item', _absolute=True, id=3) == \
+            'http://shop.example.com/shop/items/3'
+        assert list(m.reverse_many('shop:item', [{'id': 4}], _absolute=True,
+                                   _scheme='https')) == \
+            ['https://shop.example.com/shop/items/4']
+        # The JS mappers hold the names of mounted Mappers
+        for source in (m.js_mapper('M'), m.js_mapper('M', minify=True),
+                       m.js_chunks('M')[1].popitem()[1]):
+            assert '"shop:item"' in source and '"shop:home"' in source
+        source = m.js_mapper('M')
+        assert '"shop:item":function(fields){return ""+"/shop/items/"' \
+            in source
+        assert '"home":function(fields){return ""+"/";}' in source
+        shop.add([url(r'^new$', 'new', name='new')])
+        assert '"shop:new"' in m.js_mapper('M')
+        instrumentation = m.instrument(interval=3600)
+        m.reverse('shop:item', id=1)
+        assert instrumentation.snapshot()['reverses'] == {'item': 1}
+        m.uninstrument()
+        # prepare() builds the index of the mounted Mapper too
+        assert shop._dispatcher is None
+        m.prepare()
+        assert shop._dispatcher is not None
+
+    def test_live_mapper(self):
+        from surly.mapper import LiveMapper
+        live = LiveMapper(Mapper([url(r'^/a$', 'a', name='page')]))
+        assert live.current.frozen
+        assert live.match('/a').target == 'a'
+        previous = live.swap(Mapper([url(r'^/b$', 'b', name='page')]))
+        assert previous.match('/a').target == 'a'
+        assert live.match('/a') is None
+        assert live.reverse('page') == '/b'
+        live.reload(lambda: Mapper([url(r'^/c$', 'c', name='page')])).join()
+        assert live.match('/c').target == 'c'
+        # The read-only API answers from the current snapshot
+        assert list(live.reverse_many('page', [{}])) == ['/c']
+        assert live.reverse_patterns is live.current.reverse_patterns
+        assert live.static_routes() == {'/c': live.current.urls[0]}
+        assert live.static_route('/c') is live.current.urls[0]
+        assert not live.binds_hosts
+        assert live.js_mapper('M') == live.current.js_mapper('M')
+        assert live.js_mapper_hash('M') == live.current.js_mapper_hash('M')
+        assert live.js_chunks('M') == live.current.js_chunks('M')
+        assert live.cache_info() is None
+
+    def test_match_cache(self):
+        m = Mapper([
+            url(r'^/foo/(?P<foo>\d+)$', None, name='foo'),
+        ], cache_size=2)
+        assert m.match('/foo/1').kwargs == {'foo': '1'}
+        m.match('/foo/1').kwargs['foo'] = 'changed'
+        assert m.match('/foo/1').kwargs == {'foo': '1'}
+        assert m.match('/bar') is None
+        assert m.match('/bar') is None
+        m.match('/foo/2')
+        info = m.cache_info()
+        assert info['hits'] == 3 and info['misses'] == 3, info
+        assert info['evictions'] == 1 and info['size'] == 2, info
+        assert Mapper([]).cache_info() is None
+
+    def test_match_cache_invalidation(self):
+        u = url(r'/{section}/(?P<id>\d+)$', 'target')
+        m = Mapper([u], cache_size=10)
+        assert m.match('/{section}/1').target == 'target'
+        u.apply_replacements(section='news')
+        assert m.cache_info()['size'] == 0
+        assert m.match('/{section}/1') is None
+        assert m.match('/news/1').target == 'target'
+
+    def test_single_compile(self):
+        import surly.mapper
+        compiled = []
+        original = surly.mapper.compile_pattern
+        def counting_compile(pattern):
+            compiled.append(pattern)
+            return original(pattern)
+        surly.mapper.compile_pattern = counting_compile
+        try:
+            m = Mapper([
+                include(r'^/app', [url(r'/{section}/(?P<id>\d+)$', None,
+                                       name='item')]),
+            ], replacements={'section': 'items'})
+        finally:
+            surly.mapper.compile_pattern = original
+        assert compiled == [r'^/app/items/(?P<id>\d+)$'], compiled
+        assert m.reverse('item', id=3) == '/app/items/3'
+
+    def test_lazy(self):
+        m = Mapper([
+            url(r'^/$', 'home', name='home'),
+            include(r'^/app', [url(r'/{section}/(?P<id>\d+)$', 'item',
+                                   name='item')]),
+        ], replacements={'section': 'items'}, lazy=True)
+        assert not [u for u in m.urls if u._built('py_pattern')]
+        assert m.reverse('item', id=3) == '/app/items/3'
+        assert m.urls[1]._built('py_pattern')
+        assert not m.urls[0]._built('py_pattern')
+        assert m.match('/app/items/3').kwargs == {'id': '3'}
+        assert m.match('/').target == 'home'
+        # The JS generator is only imported once asked for
+        import subprocess, sys
+        loaded = subprocess.check_output([sys.executable, '-c',
+            'import sys, surly.mapper; print("surly.js" in sys.modules)'])
+        assert loaded.strip() == b'False', loaded
+        assert 'fields["id"]' in m.urls[1].js_pattern
+
+    def test_standalone_url(self):
+        u = url(r'/(?P<id>\d+)$', None)
+        assert u.reverse(id=1) == '/1'
+        u.apply_prefix('/items')
+        assert u.reverse(id=1) == '/items/1'
+        assert u.group_map == {1: 'id'}
+
+    def test_table_cache(self):
+        import os
+        import shutil
+        import tempfile
+        from surly import table_cache
+        def make_urls():
+            return [url(r'^/$', 'home', name='home'),
+                    include(r'^/app', [url(r'/{x}/(?P<id>\d+)$', 'item',
+                                           name='item')])]
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'routes.json')
+            m = Mapper(make_urls(), replacements={'x': 'a'}, table_cache=path)
+            assert os.path.exists(path)
+            m = Mapper(make_urls(), replacements={'x': 'a'}, table_cache=path)
+            assert not m.urls[1]._built('regex')
+            assert m.reverse('item', id=2) == '/app/a/2'
+            result = m.match('/app/a/2')
+            assert result.target == 'item' and result.kwargs == {'id': '2'}
+            # A different table must not load the stale file
+            self.assertRaises(table_cache.TableCacheError, table_cache.load,
+                              Mapper(make_urls(), replacements={'x': 'b'}),
+                              path)
+            m = Mapper(make_urls(), replacements={'x': 'b'}, table_cache=path)
+            assert m.reverse('item', id=2) == '/app/b/2'
+            # An unwritable cache only means compiling every time
+            path = os.path.join(directory, 'missing', 'routes.json')
+            m = Mapper(make_urls(), replacements={'x': 'a'}, table_cache=path)
+            assert m.reverse('item', id=2) == '/app/a/2'
+            assert m.match('/app/a/2').target == 'item'
+            assert os.listdir(directory) == ['routes.json']
+        finally:
+            shutil.rmtree(directory)
+
+    def test_codegen(self):
+        from surly import codegen
+        def make_urls():
+            # Enough children under /n to be looked up in a dict
+            return ([url(r'^/$', 'home', name='home'),
+                     url(r'^/a/(?P<x>\d+)$', 'ax', name='ax'),
+                     url(r'^/a', 'a-prefix'),
+                     url(r'^/a/1\.txt$', 'never'),
+                     url(r'^/b/<int:id>/<uuid:key>$', 'typed', name='typed'),
+                     url(r'(?i)^/c$', 'c')]
+                    + [url(r'^/n%d/(?P<y>\w+)$' % i, i, name='n%d' % i)
+                       for i in range(codegen.FANOUT + 2)])
+        m = Mapper(make_urls())
+        module = codegen.load_source(codegen.generate(m))
+        key = '12345678-1234-5678-1234-567812345678'
+        paths = ['/', '/\n', '/a/1', '/a/1.txt', '/a', '/ab', '/b/7/' + key,
+                 '/b/x/' + key, '/C', '/n3/z', '/n3/', '/n10/z', '/x', '']
+        codegen.check(module, m, paths)
+        assert module.resolve('/a/1.txt')[0] == 2
+        assert module.resolve('/b/7/' + key)[1]['id'] == 7
+        assert module.reverse('n3', y='a b') == '/n3/a%20b'
+        m = Mapper(make_urls(), generated=module)
+        assert isinstance(m._dispatcher, codegen.GeneratedDispatcher)
+        assert not m.urls[1]._built('regex')
+        assert m.match('/n9/q').target == 9
+        m.add([url(r'^/d$', 'd')])
+        assert m.match('/d').target == 'd'
+        assert m.match('/n9/q').target == 9
+        # A module for another table
+        self.assertRaises(codegen.CodegenError, Mapper, make_urls()[1:],
+                          generated=module)
+        broken = codegen.load_source(codegen.generate(m).replace(
+            "path == '/' or", "path == '/x' or"))
+        self.assertRaises(codegen.CodegenError, codegen.check, broken, m,
+                          ['/x'])
+        m = Mapper([include('^/sub', Mapper([url(r'^/$', None)]))])
+        self.assertRaises(codegen.CodegenError, codegen.generate, m)
+
+    def test_reverse_function(self):
+        from surly.re_parse import MissingArgumentError
+        m = Mapper([
+            url(r'^/a/(?P<x>\d+)/b/(?P<y>\w+)$', None, name='ab'),
+            url(r'^/static$', None, name='static'),
+        ])
+        assert m.reverse('ab', x=1, y=u'z') == u'/a/1/b/z'
+        assert m.reverse('static') == '/static'
+        self.assertRaises(MissingArgumentError, m.reverse, 'ab', x=1)
+        self.assertRaises(KeyError, m.reverse, 'ab', x=1)
+        urls = list(m.reverse_many('ab', [{'x': i, 'y': 'q'}
+                                          for i in range(3)]))
+        assert urls == ['/a/0/b/q', '/a/1/b/q', '/a/2/b/q'], urls
+        self.assertRaises(MapperError, m.reverse_many, 'nope', [])
+
+    def test_instrument(self):
+        m = Mapper([
+            url(r'^/$', None, name='home'),
+            url(r'^/foo/(?P<foo>\d+)$', None),
+        ])
+        exported = []
+        instrumentation = m.instrument(sample_rate=0.5, hook=exported.append,
+                                       interval=3600)
+        for path in ['/', '/', '/foo/1', '/bar']:
+            m.match(path)
+        m.reverse('home')
+        list(m.reverse_many('home', [{}, {}]))
+        self.assertRaises(MapperError, m.reverse_many, 'nothing', [])
+        snapshot = instrumentation.snapshot()
+        assert snapshot['matches'] == {'home': 2, r'^/foo/(?P<foo>\d+)$': 1,
+                                       '<unmatched>': 1}, snapshot
+        assert snapshot['reverses'] == {'home': 3}, snapshot
+        timed = sum(sum(histogram)
+                    for histogram in snapshot['latencies'].values())
+        assert timed == 2, snapshot['latencies']
+        instrumentation.export()
+        assert exported[0]['matches']['home'] == 2
+        assert instrumentation.snapshot()['matches'] == {}
+
+        m.uninstrument()
+        assert 'match' not in m.__dict__ and m.instrumentation is None
+        m.match('/')
+        assert instrumentation.snapshot()['matches'] == {}
+
+        # A mapper with a cache still uses it while instrumented
+        m = Mapper([url(r'^/$', None, name='home')], cache_size=10)
+        instrumentation = m.instrument(sample_rate=0.5, interval=3600)
+        for path in ['/', '/', '/', '/x']:
+            m.match(path)
+        assert instrumentation.snapshot()['matches'] == {
+            'home': 3, '<unmatched>': 1}
+        assert m.cache_info()['hits'] == 2
+        m.uninstrument()
+
+    def test_reverse_escaping(self):
+        m = Mapper([url(r'^/tag/(?P<tag>[^/]+)$', None, name='tag')])
+        assert m.reverse('tag', tag=u'caf\xe9 & co/x') == \
+            '/tag/caf%C3%A9%20%26%20co%2Fx'
+        assert m.reverse('tag', tag=7) == '/tag/7'
+        assert m.reverse('tag', tag=True) == '/tag/True'
+        assert m.reverse('tag', _escape=False, tag='a/b') == '/tag/a/b'
+        assert m.urls[0].reverse(tag='a b') == '/tag/a%20b'
+        assert list(m.reverse_many('tag', [{'tag': 'a b'}],
+                                   _escape=False)) == ['/tag/a b']
+
+    def test_escape_memo_bound(self):
+        from surly.escape import EscapeMemo
+        memo = EscapeMemo(maxsize=4)
+        for i in range(10):
+            assert memo.escape('v %d' % i) == 'v%%20%d' % i
+            assert len(memo) <= 4
+        assert memo.escape(1) == '1' and memo.escape(True) == 'True'
+        assert memo.escape([1]) == '%5B1%5D'
+
+    def test_js_mapper_minified(self):
+        m = Mapper([
+            url(r'^/$', None, name='home'),
+            include(r'^/api/v2/', [
+                url(r'accounts/(?P<id>\d+)$', None, name='account'),
+                url(r'accounts/(?P<id>\d+)/edit$', None, name='edit'),
+            ]),
+        ])
+        expected = ('M=(function(){var p0="/api/v2/accounts/";var m={'
+                    '"account":function(f){return p0+f.id},'
+                    '"edit":function(f){return p0+f.id+"/edit"},'
+                    '"home":function(f){return "/"}};'
+                    'return function(n,a){return m[n](a)}})();')
+        assert m.js_mapper('M', minify=True) == expected, \
+            m.js_mapper('M', minify=True)
+        assert m.js_mapper('M') is m.js_mapper('M')
+        digest = m.js_mapper_hash('M', minify=True)
+        assert len(digest) == 40
+        assert digest != m.js_mapper_hash('M')
+        m.urls[0].apply_replacements()
+        assert m.js_mapper_hash('M', minify=True) == digest
+
+    def test_js_chunks(self):
+        def make_mapper():
+            return Mapper([
+                url(r'^/$', None, name='home'),
+                include(r'^/api/', [url(r'a$', None, name='a'),
+                                    include(r'b/', [url(r'c$', None,
+                                                        name='c')])]),
+                include(r'^/blog/', [url(r'(?P<slug>\w+)$', None,
+                                         name='post')]),
+            ])
+        loader, chunks = make_mapper().js_chunks('M', '/js/')
+        assert len(chunks) == 2, chunks
+        api = [source for source in chunks.values() if '"a"' in source][0]
+        assert '"c":function(f){return p0+"b/c"}' in api, api
+        assert 'M.register(' in api
+        assert '"home":function(f){return "/"}' in loader
+        assert '"a"' not in loader.split('s=')[0]
+        for filename in chunks:
+            assert '"/js/%s"' % filename in loader
+        # Chunks are loaded by script tags, never synchronously
+        assert 'createElement("script")' in loader
+        assert 'XMLHttpRequest' not in loader and 'eval' not in loader
+        assert make_mapper().js_chunks('M', '/js/') == (loader, chunks)
@@ -1,5 +1,6 @@
 import unittest
 
+from surly import re_parse
 from surly.re_parse import reverse, ReverseParseError
 import sre_constants
 
@@ -96,5 +97,58 @@ class ReverseTestCase(unittest.TestCase):
                 self.assertEqual(type(e), expected)
 
 
+class ScannerTestCase(unittest.TestCase):
+    scanned = [
+        r'^/$',
+        r'^/a/b\.html$',
+        r'^/(?P<id>\d+)/(?P<slug>[-\w]+)/?$',
+        r'^/(?:x(?P<a>[^/]+)y){2}(?P<b>a|b(?:c)*?)$',
+        r'^/(?P<a>(x)(?P<b>.))\-$',
+        r'/(?:ab)?c',
+    ]
+
+    # Left to sre_parse
+    unsupported = [
+        r'(?i)^/a',
+        r'^/a|^/b',
+        r'^/[ab]',
+        r'^/(a)',
+        r'^/a{',
+        r'^/(?P<a>x)(?P=a)',
+        r'^/(?P<a>[[])',
+        r'^/a*?',
+    ]
+
+    def results(self, parse, re_str):
+        flags, ast, group_map = parse(re_str)
+        reverser = re_parse.PythonReverser()
+        try:
+            re_parse._recursive_parse(ast, group_map, reverser)
+            template = reverser.value()
+        except (ReverseParseError, KeyError):
+            # KeyError: unnamed groups
+            template = None
+        return (template, group_map, re_parse._literal_prefix(flags, ast))
+
+    def test_scanned(self):
+        for re_str in self.scanned:
+            re_parse._scan(re_str)
+            self.assertEqual(self.results(re_parse._parse, re_str),
+                             self.results(re_parse._parse_with_re, re_str))
+
+    def test_unsupported(self):
+        for re_str in self.unsupported:
+            self.assertRaises(re_parse._Unsupported, re_parse._scan, re_str)
+            self.assertEqual(self.results(re_parse._parse, re_str),
+                             self.results(re_parse._parse_with_re, re_str))
+
+    def test_compile_pattern(self):
+        compiled = re_parse.compile_pattern(r'^/a/(?P<id>\d+)$')
+        self.assertEqual(compiled.py_pattern, u'/a/{id}')
+        self.assertEqual(compiled.group_map, {1: 'id'})
+        self.assertEqual(compiled.literal_prefix, u'/a/')
+        self.assertEqual(compiled.regex.match('/a/7').group('id'), '7')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from surly.mapper import Mapper, url
+from surly.bench import suite
+from surly import reorder
+
+
+class CanOverlapTestCase(unittest.TestCase):
+    pairs = [
+        (r'^/items/(?P<id>\d+)$', r'^/items/new$', False),
+        (r'^/items/(?P<id>\w+)$', r'^/items/new$', True),
+        (r'^/a/$', r'^/a/b/$', False),
+        (r'^/a', r'^/a/b/$', True),
+        (r'^/a$', r'^/b$', False),
+        (r'^/a$', r'^/a\n$', True),
+        (r'^/a$', r'^/a\n/$', False),
+        (r'^/[a-m]x$', r'^/[n-z]x$', False),
+        (r'^/[a-m]x$', r'^/[^a]x$', True),
+        (r'^/[^a]$', r'^/a$', False),
+        (r'^/.$', r'^/\n$', False),
+        (r'^/(?:ab){2}$', r'^/abac$', False),
+        (r'^/(?P<x>.+)$', r'^/a$', True),
+        (r'(?i)^/a$', r'^/b$', True),
+        (r'^/(?:a|b)c$', r'^/ad$', False),
+        (r'^/(?:ab|cd)$', r'^/ad$', True),
+    ]
+
+    def test_pairs(self):
+        for a, b, expected in self.pairs:
+            self.assertEqual(reorder.can_overlap(url(a, None), url(b, None)),
+                             expected, (a, b))
+            self.assertEqual(reorder.can_overlap(url(b, None), url(a, None)),
+                             expected, (b, a))
+
+
+class ReorderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.urls = [
+            url(r'^/about/$', None, name='about'),
+            url(r'^/items/(?P<id>\w+)/$', None, name='item'),
+            url(r'^/items/new/$', None, name='new'),
+            url(r'^/(?P<page>\w+)/$', None, name='page'),
+        ]
+        self.hits = {'about': 1, 'item': 5, 'new': 100, 'page': 50}
+
+    def test_reorder(self):
+        ordered = reorder.reorder(self.urls, self.hits)
+        self.assertEqual([u.name for u in ordered],
+                         ['item', 'new', 'about', 'page'])
+
+    def test_profile(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'profile.json')
+            with open(path, 'w') as f:
+                json.dump({'matches': self.hits}, f)
+            m = Mapper(self.urls, profile=path)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual([u.name for u in m.urls],
+                         ['item', 'new', 'about', 'page'])
+        assert m.match('/items/new/').url.name == 'item'
+        assert m.match('/about/').url.name == 'about'
+
+    def test_same_matches(self):
+        urls = suite.make_urls(300)
+        original = Mapper(urls, replacements=suite.REPLACEMENTS)
+        rng = random.Random(1)
+        hits = dict((u.name, rng.randint(0, 1000)) for u in original.urls)
+        paths = ['/app1/', '/app1/about/x', '/app2/12/p0/x/items/new/']
+        for u in original.urls:
+            path = u.reverse(**suite.sample_kwargs(u))
+            paths.extend([path, path + 'x', path[:-1], path + '\n'])
+        expected = [original.match(path) for path in paths]
+        expected = [result and result.url for result in expected]
+        reordered = Mapper(urls, replacements=suite.REPLACEMENTS)
+        reordered.reorder(hits)
+        assert reordered.urls != original.urls
+        for path, u in zip(paths, expected):
+            result = reordered.match(path)
+            assert (result and result.url) is u, path
+        assert (reorder.mean_position(reordered.urls, hits)
+                < reorder.mean_position(original.urls, hits))